@@ -0,0 +1,111 @@
+"""
+Fast renderers of the API for the kiosks polling the session lists.
+
+ORJSONRenderer replaces DRF's JSONRenderer (application/json, same
+output), MessagePackRenderer answers Accept: application/msgpack. The
+browsable API is only chosen by browsers asking for text/html.
+
+The lists of sessions are cached rendered, one entry per format and
+version of the sessions (collection_version()), so a poll is answered
+with the bytes only, without queries, serialization or rendering. The
+version is bumped when a session, movie or room changes, see
+cinema.signals.
+"""
+import time
+
+import msgpack
+import orjson
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from cinema.cache import cached
+from cinema.page_cache import NotCacheable
+from django_cinema.settings import RENDERED_CACHE_SECONDS
+
+# dates, decimals, lazy strings... the way DRF's JSONRenderer writes them
+_default = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ JSONRenderer on orjson, indented output has 2 spaces """
+    cache_rendered = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # dates and times are written by _default like DRF does, e.g. 'Z'
+        # instead of '+00:00'
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        # the browsable API and clients asking for indent=N
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=_default, option=option)
+        # escaped by DRF too, they end a line in javascript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace(
+            '\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    cache_rendered = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+def collection_key(name):
+    return f'api_collection:{name}'
+
+
+def collection_version(name):
+    key = collection_key(name)
+    version = cache.get(key)
+    if version is None:
+        # a lost version must not bring back bytes of an old one
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_collection(name):
+    """ Drop the rendered lists once the transaction commits """
+    transaction.on_commit(
+        lambda: cache.set(collection_key(name), time.time_ns(), None))
+
+
+def rendered_response(view, request, key, build):
+    """
+    The response of build() (a Response of a list) rendered by the
+    accepted renderer, cached under the key when the renderer allows it
+    """
+    renderer = request.accepted_renderer
+    if not getattr(renderer, 'cache_rendered', False):
+        return build()
+
+    def render():
+        response = build()
+        if response.status_code != 200:
+            raise NotCacheable(response)
+        context = view.get_renderer_context()
+        context['response'] = response
+        return renderer.render(response.data, request.accepted_media_type,
+                               context)
+
+    # the media type may ask for indented output, no spaces for memcached;
+    # the poster URLs are absolute, built from the host
+    media_type = request.accepted_media_type.replace(' ', '')
+    try:
+        content = cached(
+            f'rendered:{media_type}:{request.get_host()}:{key}', render,
+            RENDERED_CACHE_SECONDS)
+    except NotCacheable as e:
+        return e.response
+    return HttpResponse(content, content_type=renderer.media_type)
@@ -1,17 +1,25 @@
+import hmac
 from datetime import datetime as dt, date, timedelta
 
+from django.db import IntegrityError, transaction
 from rest_framework import viewsets, generics, status, serializers
 from rest_framework.authentication import BasicAuthentication
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, \
     SAFE_METHODS, BasePermission
 from rest_framework.response import Response
 from rest_framework.viewsets import ViewSet
 
+from cinema import checkin, idempotency, metrics, seat_events
+from cinema.cache import cached, is_shared
+from cinema.API.renderers import rendered_response, collection_version
 from cinema.API.serialisers import RoomSerializer, UserSerializer, \
     MovieSerializer, SessionSerializer, TicketSerializer, \
     TicketAdminSerializer, RegisterSerializer, SessionAdminSerializer
 from cinema.models import Room, CinemaUser, Movie, Session, Ticket
-from django_cinema.settings import DURATION_OF_BREAKS
+from cinema.seating import RoomLayout, STANDARD
+from django_cinema.settings import DURATION_OF_BREAKS, TIMETABLE_CACHE_SECONDS, \
+    MOVIE_SEARCH_LIMIT, BEST_SEATS_MAX, CHECKIN_SCANNER_KEYS
 
 
 class ReadOnly(BasePermission):
@@ -31,6 +39,17 @@ class Register(BasePermission):
             return request.method == 'POST'
 
 
+class ScannerKey(BasePermission):
+    """ Door scanners, no user lookup nor password hashing per scan """
+    def has_permission(self, request, view):
+        # compare_digest takes ASCII strings only; headers are decoded as
+        # latin-1, encoding them back gives the bytes sent
+        key = request.META.get('HTTP_X_SCANNER_KEY', '').encode(
+            'latin-1', 'replace')
+        return any(hmac.compare_digest(key, scanner.encode())
+                   for scanner in CHECKIN_SCANNER_KEYS)
+
+
 class RoomViewSet(viewsets.ModelViewSet):
     serializer_class = RoomSerializer
     queryset = Room.objects.all()
@@ -68,7 +87,6 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminUser | Register]
 
     def get_serializer_class(self):
-        print(self.request.method)
         if hasattr(self.request, 'method'):
             if self.request.method in SAFE_METHODS:
                 return UserSerializer
@@ -78,12 +96,37 @@ class UserViewSet(viewsets.ModelViewSet):
                 return UserSerializer
 
 
+def search_movies(params):
+    """ Movies filtered by the q (search words), year and today params """
+    queryset = Movie.objects.defer('search_vector')
+    text = params.get('q', '').strip()
+    if text:
+        queryset = queryset.search(text)
+    year = params.get('year', '')
+    if year.isdigit():
+        queryset = queryset.filter(year=int(year))
+    if params.get('today'):
+        queryset = queryset.with_sessions_on(dt.now().date())
+    return queryset
+
+
 class MovieViewSet(viewsets.ModelViewSet):
     serializer_class = MovieSerializer
     queryset = Movie.objects.all()
     authentication_classes = [BasicAuthentication, ]
     permission_classes = [IsAdminUser | ReadOnly]
 
+    def get_queryset(self):
+        """
+        /movie_api/?q=star wa&year=1977&today=1
+        """
+        if self.action != 'list':
+            return self.queryset.all()
+        queryset = search_movies(self.request.query_params)
+        if self.request.query_params.get('q', '').strip():
+            queryset = queryset[:MOVIE_SEARCH_LIMIT]
+        return queryset
+
 
 class SessionViewSet(viewsets.ModelViewSet):
     serializer_class = SessionSerializer
@@ -92,7 +135,6 @@ class SessionViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminUser | ReadOnly]
 
     def get_serializer_class(self):
-        print(self.request.method)
         if hasattr(self.request, 'method'):
             if self.request.method in SAFE_METHODS:
                 return SessionSerializer
@@ -101,6 +143,40 @@ class SessionViewSet(viewsets.ModelViewSet):
             else:
                 return UserSerializer
 
+    def list(self, request, *args, **kwargs):
+        """ Polled by the kiosks, served rendered, see cinema.API.renderers """
+        return rendered_response(
+            self, request, f"sessions:{collection_version('sessions')}",
+            lambda: super(SessionViewSet, self).list(request, *args, **kwargs))
+
+    @action(detail=True)
+    def best_seats(self, request, pk=None):
+        """
+        /session_api/<pk>/best_seats/?n=2&type=S&date=YYYY-MM-DD
+        The best n adjacent free seats of the session day
+        """
+        session = self.get_object()
+        params = request.query_params
+        try:
+            day = date.fromisoformat(params.get('date', str(dt.now().date())))
+        except ValueError:
+            raise serializers.ValidationError({"date": 'Invalid date'})
+        if not session.date_start <= day <= session.date_finish:
+            raise serializers.ValidationError({"date": 'Invalid session date'})
+        n = params.get('n', '2')
+        if not n.isdigit() or not 0 < int(n) <= BEST_SEATS_MAX:
+            raise serializers.ValidationError(
+                {"n": f'From 1 to {BEST_SEATS_MAX} seats'})
+
+        layout = RoomLayout.for_room(session.room)
+        seats = layout.best_seats(seat_events.bought_seats(session.id, day),
+                                  int(n), params.get('type', STANDARD))
+        return Response({
+            'date': day,
+            'seats': seats,
+            'labels': [layout.label(seat) for seat in seats],
+        })
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -162,11 +238,15 @@ class SessionViewSet(viewsets.ModelViewSet):
             if session.time_start <= session_time_start <= session.time_finish:
                 time_err = f"start time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='api')
                 raise serializers.ValidationError(
                     {"time_finish": time_err})
             if session.time_start <= session_time_finish <= session.time_finish:
                 time_err = f"finish time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='api')
                 raise serializers.ValidationError(
                     {"time_finish": time_err})
         self.perform_update(serializer)
@@ -181,7 +261,6 @@ class SessionViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        print(serializer.validated_data)
 
         obj = serializer.validated_data
 
@@ -233,10 +312,14 @@ class SessionViewSet(viewsets.ModelViewSet):
             if session.time_start <= session_time_start <= session.time_finish:
                 time_err = f"start time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='api')
                 raise serializers.ValidationError({"time_start": time_err})
             if session.time_start <= session_time_finish <= session.time_finish:
                 time_err = f"finish time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='api')
                 raise serializers.ValidationError({"time_finish": time_err})
 
         self.perform_create(serializer)
@@ -248,6 +331,27 @@ class SessionViewSet(viewsets.ModelViewSet):
         )
 
 
+def today_sessions(params):
+    """ Today sessions filtered by min_time, max_time and room params """
+    today = dt.now().date()
+
+    queryset = Session.objects.filter(
+        date_finish__gte=today,
+        date_start__lte=today,
+    )
+    minimum_time = dt.strptime(
+        params.get('min_time', '00:00:00'), "%H:%M:%S").time()
+    queryset = queryset.filter(time_start__gte=minimum_time)
+
+    maximum_time = dt.strptime(
+        params.get('max_time', '23:59:59'), "%H:%M:%S").time()
+    queryset = queryset.filter(time_start__lte=maximum_time)
+    room = params.get('room', None)
+    if room is not None:
+        queryset = queryset.filter(room__id=room)
+    return queryset
+
+
 class TodaySessionViewSet(generics.ListAPIView, ViewSet):
     serializer_class = SessionSerializer
     authentication_classes = [BasicAuthentication, ]
@@ -261,25 +365,21 @@ class TodaySessionViewSet(generics.ListAPIView, ViewSet):
 
         /today_session_api/?min_time=12:00:00&max_time=22:00:00&room=1
         """
-        today = dt.now().date()
+        return today_sessions(self.request.query_params)
 
-        queryset = Session.objects.filter(
-            date_finish__gte=today,
-            date_start__lte=today,
-        )
-        minimum_time = dt.strptime(
-            self.request.query_params.get('min_time', '00:00:00'),
-            "%H:%M:%S").time()
-        queryset = queryset.filter(time_start__gte=minimum_time)
-
-        maximum_time = dt.strptime(
-            self.request.query_params.get('max_time', '23:59:59'),
-            "%H:%M:%S").time()
-        queryset = queryset.filter(time_start__lte=maximum_time)
-        room = self.request.query_params.get('room', None)
-        if room is not None:
-            queryset = queryset.filter(room__id=room)
-        return queryset
+    def list(self, request, *args, **kwargs):
+        """
+        The timetable is shared by all clients, see cinema.cache, and
+        served rendered, see cinema.API.renderers
+        """
+        params = request.query_params
+        key = f"timetable:{dt.now().date()}:{params.get('min_time')}:" \
+              f"{params.get('max_time')}:{params.get('room')}:" \
+              f"{collection_version('sessions')}"
+        return rendered_response(
+            self, request, key, lambda: Response(cached(
+                key, lambda: super(TodaySessionViewSet, self).list(
+                    request, *args, **kwargs).data, TIMETABLE_CACHE_SECONDS)))
 
 
 class TicketViewSet(viewsets.ModelViewSet):
@@ -295,7 +395,6 @@ class TicketViewSet(viewsets.ModelViewSet):
         return queryset
 
     def get_serializer_class(self):
-        print(self.request.method)
         if hasattr(self.request, 'method'):
             if self.request.method == 'GET':
                 return TicketSerializer
@@ -303,9 +402,42 @@ class TicketViewSet(viewsets.ModelViewSet):
                 return TicketAdminSerializer
 
     def create(self, request, *args, **kwargs):
+        """
+        Retries of one purchase send the same Idempotency-Key header and
+        get the first response back, see cinema.idempotency
+        """
+        try:
+            (status_code, data, headers), replayed = idempotency.once(
+                request, 'api', request.data, self.buy)
+        except idempotency.InvalidKey as e:
+            raise serializers.ValidationError({"idempotency_key": str(e)})
+        except idempotency.KeyReused:
+            return Response(
+                {"idempotency_key": 'The key was used for another purchase'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except idempotency.InProgress:
+            return Response(
+                {"idempotency_key": 'The purchase is being processed'},
+                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+        response = Response(data, status=status_code, headers=headers)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def buy(self):
+        """ Create the ticket, returns the status, data and headers """
+        try:
+            return self.perform_buy(self.request)
+        except serializers.ValidationError as e:
+            return e.status_code, e.detail, {}
+
+    def perform_buy(self, request):
         serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        print(serializer.validated_data)
+        if not serializer.is_valid():
+            # the unique together check fails when the seat is taken
+            if 'non_field_errors' in serializer.errors:
+                metrics.inc('cinema_seat_conflicts_total', channel='api')
+            raise serializers.ValidationError(serializer.errors)
 
         obj = serializer.validated_data
 
@@ -323,6 +455,7 @@ class TicketViewSet(viewsets.ModelViewSet):
 
         # ticket must have the free seat
         if seat_number not in free_seats:
+            metrics.inc('cinema_seat_conflicts_total', channel='api')
             raise serializers.ValidationError(
                 {"seats_number": 'Invalid seat number'}
             )
@@ -345,10 +478,66 @@ class TicketViewSet(viewsets.ModelViewSet):
                 {"seats_number": 'wrong time'}
             )
 
-        self.perform_create(serializer)
+        try:
+            with transaction.atomic():
+                self.perform_create(serializer)
+        except IntegrityError:
+            # somebody bought the seat in the meantime
+            metrics.inc('cinema_seat_conflicts_total', channel='api')
+            raise serializers.ValidationError(
+                {"seats_number": 'Invalid seat number'}
+            )
+        metrics.inc('cinema_tickets_sold_total', channel='api')
         headers = self.get_success_headers(serializer.data)
-        return Response(
-            serializer.data,
-            status=status.HTTP_201_CREATED,
-            headers=headers
-        )
+        return status.HTTP_201_CREATED, serializer.data, headers
+
+
+class CheckInViewSet(ViewSet):
+    authentication_classes = []
+    permission_classes = [ScannerKey]
+
+    # scan results other than admitted
+    REFUSED = {
+        checkin.ALREADY_ADMITTED: status.HTTP_409_CONFLICT,
+        checkin.INVALID: status.HTTP_403_FORBIDDEN,
+        checkin.REVOKED: status.HTTP_403_FORBIDDEN,
+        checkin.WRONG_SESSION: status.HTTP_403_FORBIDDEN,
+        checkin.WRONG_DATE: status.HTTP_403_FORBIDDEN,
+    }
+
+    def create(self, request):
+        """
+        Check a ticket in at the door of a session, no database read,
+        see cinema.checkin
+
+        /checkin_api/ {"token": "...", "session": 42}
+        """
+        if not is_shared():
+            # every worker would let the same ticket in once
+            return Response(
+                {"detail": 'Check-in needs a cache shared by the workers'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if not isinstance(request.data, dict):
+            raise serializers.ValidationError(
+                {"non_field_errors": 'Expected an object'})
+        token = request.data.get('token')
+        if not isinstance(token, str):
+            raise serializers.ValidationError({"token": 'A token is required'})
+        session = request.data.get('session')
+        if session is not None:
+            try:
+                session = int(session)
+            except (TypeError, ValueError):
+                raise serializers.ValidationError(
+                    {"session": 'Invalid session'})
+
+        result, ticket = checkin.check_in(token, session)
+        metrics.inc('cinema_checkins_total', result=result)
+        data = {'result': result}
+        if ticket is not None:
+            data.update(ticket=ticket.id, session=ticket.session,
+                        date=ticket.date, seat_number=ticket.seat)
+        if result == checkin.ALREADY_ADMITTED:
+            data['checked_in_at'] = checkin.admitted_at(ticket.id)
+        return Response(data, status=self.REFUSED.get(result,
+                                                       status.HTTP_200_OK))
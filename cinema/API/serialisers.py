@@ -2,7 +2,9 @@ from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
+from cinema import refcache
 from cinema.models import Movie, Session, Room, Ticket, CinemaUser
+from cinema.seating import layout_seats_count
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -60,7 +62,17 @@ class RegisterSerializer(serializers.ModelSerializer):
 class RoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = Room
-        fields = ['id', 'title', 'seats_count', ]
+        fields = ['id', 'title', 'seats_count', 'layout', ]
+
+    def validate(self, attrs):
+        layout = attrs.get('layout', getattr(self.instance, 'layout', None))
+        seats_count = attrs.get('seats_count',
+                                getattr(self.instance, 'seats_count', None))
+        if layout and seats_count != layout_seats_count(layout):
+            raise serializers.ValidationError(
+                {'seats_count': f'The layout has '
+                                f'{layout_seats_count(layout)} seats'})
+        return attrs
 
 
 class MovieSerializer(serializers.ModelSerializer):
@@ -77,9 +89,28 @@ class MovieSerializer(serializers.ModelSerializer):
         ]
 
 
+class ReferenceField(serializers.Field):
+    """
+    Read-only nested movie or room of a session, taken from
+    cinema.refcache by the foreign key (source='movie_id')
+    """
+
+    def __init__(self, serializer_class, get, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.serializer_class = serializer_class
+        self.get = get
+
+    def to_representation(self, value):
+        obj = self.get(value)
+        if obj is None:
+            return None
+        return self.serializer_class(obj, context=self.context).data
+
+
 class SessionSerializer(serializers.ModelSerializer):
-    movie = MovieSerializer()
-    room = RoomSerializer()
+    movie = ReferenceField(MovieSerializer, refcache.movie, source='movie_id')
+    room = ReferenceField(RoomSerializer, refcache.room, source='room_id')
 
     class Meta:
         model = Session
@@ -107,12 +138,15 @@ class SessionAdminSerializer(serializers.ModelSerializer):
             'date_start',
             'date_finish',
             'price',
+            'waiting_room',
+            'admission_rate',
         ]
 
 
 class TicketSerializer(serializers.ModelSerializer):
     session = SessionSerializer()
     user = UserSerializer()
+    token = serializers.CharField(read_only=True)
 
     class Meta:
         model = Ticket
@@ -121,6 +155,8 @@ class TicketSerializer(serializers.ModelSerializer):
             'user',
             'date',
             'seat_number',
+            'token',
+            'checked_in_at',
         ]
 
 
@@ -1,19 +1,47 @@
 from django.contrib import admin
 
-# Register your models here.
-from django.utils.safestring import mark_safe
+from cinema.paginator import EstimatedCountPaginator
+from .models import Ticket, CinemaUser, Movie, Room, Session, RevokedTicket
 
-from .models import Ticket, CinemaUser, Movie, Room, Session
 
-# class ProductAdmin(admin.ModelAdmin):
-#     readonly_fields = ["preview"]
-#
-#     def preview(self, obj):
-#         return mark_safe(f'<img src="{obj.image.url}" height="200">')
+@admin.register(Ticket)
+class TicketAdmin(admin.ModelAdmin):
+    """
+    Tickets are the biggest table: one query for the rows of a page
+    (Ticket.__str__ needs the session, its movie and the user), no
+    COUNT(*) and filters on indexed columns only
+    """
+    list_display = ('__str__', 'date', 'seat_number', 'checked_in_at')
+    list_select_related = ('session__movie', 'user')
+    # date leads the (date, session, seat_number) index and is the
+    # partition key; no date_hierarchy, its links need a DISTINCT over
+    # the dates of the whole table
+    list_filter = ('date',)
+    raw_id_fields = ('session', 'user')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-date', '-id')
+
+
+@admin.register(Session)
+class SessionAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'date_start', 'date_finish', 'waiting_room')
+    list_select_related = ('room', 'movie')
+    list_filter = ('room', 'waiting_room')
+    date_hierarchy = 'date_start'
+    raw_id_fields = ('movie',)
+    search_fields = ('movie__title',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
-admin.site.register(Ticket)
 admin.site.register(CinemaUser)
 admin.site.register(Movie)
 admin.site.register(Room)
-admin.site.register(Session)
+
+
+@admin.register(RevokedTicket)
+class RevokedTicketAdmin(admin.ModelAdmin):
+    list_display = ('ticket_id', 'date', 'revoked_at')
+    date_hierarchy = 'date'
+    search_fields = ('=ticket_id',)
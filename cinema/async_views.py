@@ -0,0 +1,163 @@
+"""
+Async versions of the public views for ASGI servers.
+
+The ORM is synchronous, so every query runs in a worker thread and
+independent queries of a page run at the same time.
+"""
+import asyncio
+import re
+from datetime import datetime as dt, timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator, Page, InvalidPage
+from django.db.models import Count
+from django.http import Http404, JsonResponse, HttpResponseNotAllowed
+from django.shortcuts import render
+
+from cinema import seat_events
+from cinema.API.resources import today_sessions
+from cinema.API.serialisers import SessionSerializer
+from cinema.db.async_utils import run_query
+from cinema.models import Session, Ticket
+from cinema.views import seats_context, with_card_versions
+from django_cinema.settings import DATE_REGEXP, DEFAULT_SESSION_ORDERING, \
+    SESSION_ORDERINGS, CARD_CACHE_SECONDS
+
+
+def _sessions_page(queryset, ordering, offset, limit):
+    return list(with_card_versions(queryset).with_references()
+                .order_by(ordering)[offset:offset + limit])
+
+
+def _tickets_by_session(date):
+    tickets = Ticket.objects.filter(date=date).values('session_id').annotate(
+        count=Count('id'))
+    return {i['session_id']: i['count'] for i in tickets}
+
+
+def _get_session(pk):
+    return Session.objects.with_references().get(pk=pk)
+
+
+def _bought_seats(pk, date):
+    return seat_events.bought_seats(pk, date)
+
+
+def _serialize_sessions(queryset, request):
+    return SessionSerializer(
+        queryset, many=True, context={'request': request}).data
+
+
+def _get_ordering(request):
+    ordering = request.GET.get('ordering', DEFAULT_SESSION_ORDERING)
+    if ordering not in SESSION_ORDERINGS:
+        ordering = DEFAULT_SESSION_ORDERING
+    return ordering
+
+
+async def _sessions_list(request, date, queryset, per_page, template_name):
+    ordering = _get_ordering(request)
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        raise Http404('Invalid page')
+    # the slice below can't start before the first row
+    if number < 1:
+        raise Http404('That page number is less than 1')
+
+    # page rows, total count and ticket counts don't depend on each other
+    sessions, count, tickets = await asyncio.gather(
+        run_query(_sessions_page, queryset, ordering,
+                  (number - 1) * per_page, per_page),
+        run_query(queryset.count),
+        run_query(_tickets_by_session, date),
+    )
+    paginator = Paginator(range(count), per_page)
+    try:
+        number = paginator.validate_number(number)
+    except InvalidPage as e:
+        raise Http404(str(e))
+    for session in sessions:
+        session.tickets = tickets.get(session.id, 0)
+
+    today = dt.now().date()
+    context = {
+        'paginator': paginator,
+        'page_obj': Page(sessions, number, paginator),
+        'is_paginated': paginator.num_pages > 1,
+        'page_query': f'ordering={ordering}&',
+        'session_list': sessions,
+        'object_list': sessions,
+        'today': today,
+        'tomorrow': today + timedelta(days=1),
+        'card_cache_seconds': CARD_CACHE_SECONDS,
+        'date': date.strftime('%Y-%m-%d'),
+    }
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def sessions(request):
+    """ Async SessionsView """
+    now = dt.now()
+    today = now.date()
+    queryset = Session.objects.filter(
+        date_finish__gte=today,
+        date_start__lte=today,
+        time_start__gte=now.time(),
+    )
+    return await _sessions_list(
+        request, today, queryset, 10, 'movie-list-full.html')
+
+
+async def tomorrow_sessions(request):
+    """ Async TomorrowSessionsView """
+    tomorrow = dt.now().date() + timedelta(days=1)
+    queryset = Session.objects.filter(
+        date_finish__gte=tomorrow,
+        date_start__lte=tomorrow,
+    )
+    return await _sessions_list(
+        request, tomorrow, queryset, 6, 'tomorrow-list-full.html')
+
+
+async def session_detail(request, pk):
+    """ Async SessionDetailView """
+    today = dt.now().date()
+    tomorrow = today + timedelta(days=1)
+    date = today
+    text_date = str(request.GET.get('date', ''))
+    if text_date and re.match(DATE_REGEXP, text_date):
+        requested = dt.strptime(text_date, '%Y-%m-%d').date()
+        if today <= requested <= tomorrow:
+            date = requested
+
+    # the seats are read together with the session,
+    # the date is checked against the session afterwards
+    try:
+        session, bought_seats_numbers = await asyncio.gather(
+            run_query(_get_session, pk),
+            run_query(_bought_seats, pk, date),
+        )
+    except Session.DoesNotExist:
+        raise Http404('No session found matching the query')
+    if date > session.date_finish:
+        date = today
+        bought_seats_numbers = await run_query(_bought_seats, pk, date)
+
+    context = {'session': session, 'object': session}
+    context.update(seats_context(request, session, date, bought_seats_numbers))
+    return await sync_to_async(render)(
+        request, 'movie-page-full.html', context)
+
+
+async def today_sessions_api(request):
+    """ Async TodaySessionViewSet list """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        queryset = today_sessions(request.GET)
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid time'}, status=400)
+    data = await run_query(_serialize_sessions, queryset, request)
+    return JsonResponse(data, safe=False,
+                        json_dumps_params={'separators': (',', ':')})
@@ -0,0 +1,58 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+import json
+import math
+import platform
+import subprocess
+from datetime import datetime as dt
+
+
+def percentile(values, q):
+    """ q-th percentile (0-100) of the values, nearest-rank method """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """ Throughput and latency percentiles (ms) of one benchmark run """
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'max_ms': _ms(max(latencies) if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, name, options, results):
+    """ Store results as JSON, so runs of different commits can be compared """
+    report = {
+        'benchmark': name,
+        'commit': git_commit(),
+        'created': dt.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'options': options,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
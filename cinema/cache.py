@@ -0,0 +1,104 @@
+"""
+Single-flight cached computations.
+
+cached(key, build, timeout) returns the cached result of build(). When it
+is missing or stale only one worker rebuilds it, the others serve the
+stale value or wait for the rebuild. Values are also refreshed early with
+a probability growing towards the expiry (XFetch), so hot keys are
+rebuilt by one request before they expire instead of by all at once.
+"""
+import math
+import random
+import threading
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from cinema.metrics import MeteredCache
+from django_cinema.settings import SINGLE_FLIGHT_STALE_SECONDS, \
+    SINGLE_FLIGHT_WAIT, SINGLE_FLIGHT_LOCK_SECONDS, SINGLE_FLIGHT_BETA
+
+# key -> Event of the build running in this process
+_building = {}
+_building_lock = threading.Lock()
+# returned when somebody else is building the key
+_busy = object()
+
+
+def cached(key, build, timeout, stale=SINGLE_FLIGHT_STALE_SECONDS):
+    """ Cached build(), fresh for timeout and served stale for stale """
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires, cost = entry
+        if not _needs_refresh(expires, cost):
+            return value
+        value_or_busy = _build_once(key, build, timeout, stale)
+        return value if value_or_busy is _busy else value_or_busy
+
+    # nothing to serve, wait for the worker building it
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT
+    while True:
+        value = _build_once(key, build, timeout, stale)
+        if value is not _busy:
+            return value
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            # the builder is stuck, don't let the request hang
+            return build()
+        with _building_lock:
+            event = _building.get(key)
+        if event is not None:
+            event.wait(remaining)
+        else:
+            time.sleep(min(0.05, remaining))
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+
+
+def invalidate(key):
+    cache.delete(key)
+
+
+def is_shared(alias='default'):
+    """ Whether all the worker processes see the same cache entries """
+    backend = caches[alias]
+    if isinstance(backend, MeteredCache):
+        backend = backend._cache
+    return not isinstance(backend, (LocMemCache, DummyCache))
+
+
+def _needs_refresh(expires, cost):
+    """
+    XFetch: refresh early with a probability that grows as the expiry
+    nears and with the cost (seconds) of the build
+    """
+    gap = -cost * SINGLE_FLIGHT_BETA * math.log(1 - random.random())
+    return time.time() + gap >= expires
+
+
+def _build_once(key, build, timeout, stale):
+    """ Build and store the value, _busy if somebody else is at it """
+    with _building_lock:
+        if key in _building:
+            return _busy
+        event = _building[key] = threading.Event()
+    try:
+        lock = f'{key}:building'
+        if not cache.add(lock, 1, SINGLE_FLIGHT_LOCK_SECONDS):
+            return _busy
+        try:
+            started = time.time()
+            value = build()
+            now = time.time()
+            cache.set(key, (value, now + timeout, now - started),
+                      timeout + stale)
+            return value
+        finally:
+            cache.delete(lock)
+    finally:
+        with _building_lock:
+            del _building[key]
+        event.set()
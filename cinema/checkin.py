@@ -0,0 +1,235 @@
+"""
+Signed tickets and their check-in at the doors.
+
+The token of a ticket (Ticket.token, shown as a QR code) packs the
+ticket id, session, date and seat with a truncated HMAC-SHA256 of them,
+in base32 so QR codes can use their compact alphanumeric mode. A scan
+is checked without reading the database:
+
+- the signature, the session of the door and the date, from the token
+- revoked tokens (deleted tickets) and tickets checked in earlier, from
+  per-process copies of RevokedTicket and Ticket.checked_in_at of the
+  day, loaded in the background every CHECKIN_REVOCATIONS_SECONDS. A
+  slow or failing database leaves the scanners working with the last
+  copies (or none at the start of the day); such scans are counted in
+  cinema_checkin_degraded_total.
+- a second admission of the ticket, from the default cache. It must be
+  shared by the workers (memcached, see CACHES), the API refuses to check
+  tickets in on a process-local cache.
+
+Admissions are buffered and written to Ticket.checked_in_at in one
+UPDATE per batch once the request is finished, see cinema.signals.
+"""
+import atexit
+import base64
+import binascii
+import hmac
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime as dt, timedelta
+
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from cinema import metrics
+from django_cinema.settings import CHECKIN_REVOCATIONS_SECONDS, \
+    CHECKIN_STALE_SECONDS, CHECKIN_BATCH_SIZE, CHECKIN_FLUSH_SECONDS, \
+    CHECKIN_MAX_PENDING
+
+# version, ticket, session, days since EPOCH, seat
+FORMAT = struct.Struct('>BIIHH')
+VERSION = 1
+EPOCH = date(2000, 1, 1)
+SIGNATURE_BYTES = 10
+SALT = 'cinema.checkin'
+
+# results of a scan
+ADMITTED = 'admitted'
+ALREADY_ADMITTED = 'already_admitted'
+INVALID = 'invalid'
+REVOKED = 'revoked'
+WRONG_SESSION = 'wrong_session'
+WRONG_DATE = 'wrong_date'
+
+ScannedTicket = namedtuple('ScannedTicket', 'id session date seat')
+
+# (day, frozenset of revoked ticket ids, {checked in ticket id: time})
+_lists = None
+# when the lists were loaded and last tried to load
+_lists_loaded = 0.0
+_lists_tried = 0.0
+_refreshing = threading.Lock()
+
+# (ticket id, admission time) not written yet
+_pending = []
+_pending_lock = threading.Lock()
+# when the oldest pending admission was buffered
+_oldest = 0.0
+
+
+def _signature(payload):
+    return salted_hmac(SALT, payload,
+                       algorithm='sha256').digest()[:SIGNATURE_BYTES]
+
+
+def make_token(ticket):
+    payload = FORMAT.pack(VERSION, ticket.pk, ticket.session_id,
+                          (ticket.date - EPOCH).days, ticket.seat_number)
+    raw = payload + _signature(payload)
+    return base64.b32encode(raw).decode().rstrip('=')
+
+
+def read_token(token):
+    """ The ScannedTicket of a genuine token, None otherwise """
+    token = token.strip().upper()
+    try:
+        raw = base64.b32decode(token + '=' * (-len(token) % 8))
+    except (binascii.Error, ValueError):
+        return None
+    if len(raw) != FORMAT.size + SIGNATURE_BYTES:
+        return None
+    payload, signature = raw[:FORMAT.size], raw[FORMAT.size:]
+    if not hmac.compare_digest(signature, _signature(payload)):
+        return None
+    version, ticket, session, days, seat = FORMAT.unpack(payload)
+    if version != VERSION:
+        return None
+    return ScannedTicket(ticket, session, EPOCH + timedelta(days=days), seat)
+
+
+def check_in(token, session_id=None):
+    """
+    Admit the holder of the token to the session of the door (any
+    session when None), returns the result and the ScannedTicket
+    """
+    ticket = read_token(token)
+    if ticket is None:
+        return INVALID, None
+    if session_id is not None and ticket.session != session_id:
+        return WRONG_SESSION, ticket
+    today = dt.now().date()
+    if ticket.date != today:
+        return WRONG_DATE, ticket
+    revoked, admitted, current = ticket_lists(today)
+    if not current:
+        metrics.inc('cinema_checkin_degraded_total')
+    if ticket.id in revoked:
+        return REVOKED, ticket
+    if ticket.id in admitted:
+        return ALREADY_ADMITTED, ticket
+    now = timezone.now()
+    # tokens are valid for their date only
+    if not cache.add(f'checkin:{ticket.id}', now, 2 * 24 * 60 * 60):
+        return ALREADY_ADMITTED, ticket
+    global _oldest
+    with _pending_lock:
+        if not _pending:
+            _oldest = time.monotonic()
+        if len(_pending) < CHECKIN_MAX_PENDING:
+            _pending.append((ticket.id, now))
+    return ADMITTED, ticket
+
+
+def admitted_at(ticket_id):
+    at = cache.get(f'checkin:{ticket_id}')
+    if at is None and _lists is not None:
+        at = _lists[2].get(ticket_id)
+    return at
+
+
+def ticket_lists(day):
+    """
+    (revoked ticket ids, {checked in ticket id: time}, whether they are
+    current) of the day. Never waits for the database: they are loaded
+    in the background, empty until the first load of the day.
+    """
+    now = time.monotonic()
+    of_day = _lists is not None and _lists[0] == day
+    if (not of_day or now - _lists_tried >= CHECKIN_REVOCATIONS_SECONDS) \
+            and _refreshing.acquire(blocking=False):
+        threading.Thread(target=_refresh_lists, args=(day,),
+                         daemon=True).start()
+    if not of_day:
+        return frozenset(), {}, False
+    current = now - _lists_loaded < CHECKIN_STALE_SECONDS
+    return _lists[1], _lists[2], current
+
+
+def load_lists(day):
+    from cinema.models import RevokedTicket, Ticket
+
+    global _lists, _lists_loaded, _lists_tried
+    _lists_tried = time.monotonic()
+    revoked = frozenset(RevokedTicket.objects.filter(date=day).values_list(
+        'ticket_id', flat=True))
+    admitted = dict(Ticket.objects.filter(
+        date=day, checked_in_at__isnull=False).values_list(
+        'id', 'checked_in_at'))
+    _lists = day, revoked, admitted
+    _lists_loaded = time.monotonic()
+
+
+def _refresh_lists(day):
+    try:
+        load_lists(day)
+    except DatabaseError:
+        # keep checking against the last lists, retry next period
+        pass
+    finally:
+        connection.close()
+        _refreshing.release()
+
+
+def revoke(ticket):
+    """ The ticket was deleted, its token must not let anybody in """
+    from cinema.models import RevokedTicket
+
+    if ticket.date < dt.now().date():
+        return
+    RevokedTicket.objects.get_or_create(
+        ticket_id=ticket.pk, defaults={'date': ticket.date})
+
+    def apply():
+        global _lists
+        if _lists is not None and _lists[0] == ticket.date:
+            day, revoked, admitted = _lists
+            _lists = day, revoked | {ticket.pk}, admitted
+
+    transaction.on_commit(apply)
+
+
+def save_pending(force=False):
+    """
+    Write the buffered admissions, once CHECKIN_BATCH_SIZE of them are
+    waiting or the oldest waited CHECKIN_FLUSH_SECONDS
+    """
+    from cinema.models import Ticket
+
+    global _oldest
+    with _pending_lock:
+        if not _pending:
+            return
+        if not force and len(_pending) < CHECKIN_BATCH_SIZE and \
+                time.monotonic() - _oldest < CHECKIN_FLUSH_SECONDS:
+            return
+        pending = _pending[:]
+        del _pending[:]
+
+    tickets = [Ticket(pk=pk, checked_in_at=at) for pk, at in pending]
+    try:
+        Ticket.objects.bulk_update(tickets, ['checked_in_at'],
+                                   batch_size=CHECKIN_BATCH_SIZE)
+    except DatabaseError:
+        # try again with the next batch, the cache still knows them
+        with _pending_lock:
+            room = max(0, CHECKIN_MAX_PENDING - len(_pending))
+            _pending[:0] = pending[:room]
+            _oldest = time.monotonic()
+
+
+# admissions of a stopping worker are written before it exits
+atexit.register(save_pending, force=True)
@@ -0,0 +1,19 @@
+from django.core import checks
+
+from cinema.cache import is_shared
+from django_cinema.settings import DB_POOL_WORKERS
+
+
+@checks.register(checks.Tags.caches)
+def shared_cache(app_configs, **kwargs):
+    """ The counters of several workers must live in one cache """
+    if DB_POOL_WORKERS <= 1 or is_shared():
+        return []
+    return [checks.Warning(
+        'The default cache is local to each process, every worker of '
+        'WEB_CONCURRENCY keeps its own rate limit counters and waiting '
+        'room lines.',
+        hint='Use a shared cache backend, e.g. memcached '
+             '(MEMCACHED_LOCATION).',
+        id='cinema.W001',
+    )]
@@ -0,0 +1,48 @@
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+# execute wrappers of the current request (metrics, profiler), installed
+# on the connections of the threads the queries of run_query run in
+request_wrappers = ContextVar('request_wrappers', default=())
+
+
+def add_request_wrapper(wrapper):
+    """ Run the queries of the current request through the wrapper """
+    for connection in connections.all():
+        connection.execute_wrappers.append(wrapper)
+    request_wrappers.set(request_wrappers.get() + (wrapper,))
+
+
+def remove_request_wrapper(wrapper):
+    for connection in connections.all():
+        if wrapper in connection.execute_wrappers:
+            connection.execute_wrappers.remove(wrapper)
+    request_wrappers.set(tuple(
+        other for other in request_wrappers.get() if other is not wrapper))
+
+
+def _in_worker_thread(func):
+    def inner(*args, **kwargs):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                for wrapper in request_wrappers.get():
+                    stack.enter_context(connection.execute_wrapper(wrapper))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # hand the connection of the worker thread back to the pool
+                connections.close_all()
+
+    return inner
+
+
+def run_query(func, *args):
+    """
+    Run func in its own thread, so several queries can run at once.
+    The queries go through the execute wrappers of the request.
+    """
+    return sync_to_async(_in_worker_thread(func),
+                         thread_sensitive=False)(*args)
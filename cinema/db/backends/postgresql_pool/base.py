@@ -0,0 +1,34 @@
+"""
+PostgreSQL backend taking connections from cinema.db.pool.
+
+Django closes the connection at the end of every request
+(CONN_MAX_AGE = 0), which returns it to the pool of the worker
+instead of closing the socket. The connection goes back to the pool it
+came from, the settings of the alias may have changed in the meantime.
+"""
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+
+from cinema.db.backends.postgresql_pool.creation import DatabaseCreation
+from cinema.db.pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    pool = None
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(self.alias, conn_params)
+        connection = self.pool.getconn(
+            lambda: base.DatabaseWrapper.get_new_connection(self, conn_params)
+        )
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,12 @@
+from django.db.backends.postgresql import creation
+
+from cinema.db.pool import close_pools
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # the pooled connections to the test database would make
+        # DROP DATABASE fail
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,251 @@
+"""
+Per-worker pools of PostgreSQL connections.
+
+A pool holds the connections of one database alias with one set of
+connection parameters, so a changed NAME (the test database) or the
+connection to the 'postgres' database never gets a connection of another
+database. The pool of the old parameters is closed when an alias
+connects with new ones, and before the test database is dropped.
+
+The pool of a worker holds at most DB_POOL_MAX_CONNECTIONS //
+DB_POOL_WORKERS connections. The cap of all workers together is this
+static split: it holds when WEB_CONCURRENCY is the number of workers
+(one process per worker), nothing counts the connections across the
+processes. Use PgBouncer in front of the database for a hard cap.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+
+from django.core.signals import setting_changed
+from django.db import DatabaseError
+from psycopg2 import extensions
+
+from django_cinema.settings import DB_POOL_MAX_CONNECTIONS, DB_POOL_WORKERS, \
+    DB_POOL_TIMEOUT, DB_POOL_CHECK_AFTER, DB_POOL_MAX_IDLE
+
+
+class PoolTimeout(DatabaseError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Pool of database connections of one worker process.
+
+    Connections are checked before being handed out, waits for a free
+    connection and the pool utilisation are recorded in stats().
+    """
+
+    def __init__(self, max_size, timeout, check_after, max_idle,
+                 database=None):
+        self.max_size = max_size
+        self.database = database
+        self.closed = False
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.health_check_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def getconn(self, connect):
+        """ Take a healthy connection, open one with connect() if needed """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(
+                f'no free database connection in {self.timeout} seconds')
+        waited = time.monotonic() - started
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    conn = connect()
+                    with self._lock:
+                        self.created += 1
+                elif self._is_healthy(*item):
+                    conn = item[0]
+                else:
+                    with self._lock:
+                        self.health_check_failures += 1
+                    self._discard(item[0])
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return conn
+
+    def putconn(self, conn):
+        """ Give the connection back, broken connections are closed """
+        discard = conn.closed
+        if not discard:
+            try:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        if discard or self.closed:
+            self._discard(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        idle = time.monotonic() - returned_at
+        if idle > self.max_idle:
+            return False
+        # recently used connections are trusted without a round trip
+        if idle < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        """ Close the idle connections, the busy ones once returned """
+        with self._lock:
+            self.closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+            return {
+                'max_size': self.max_size,
+                'in_use': self.in_use,
+                'idle': idle,
+                'utilisation': self.in_use / self.max_size,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'health_check_failures': self.health_check_failures,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'wait_seconds_avg': (self.wait_seconds_total / self.checkouts
+                                     if self.checkouts else 0.0),
+            }
+
+
+# (alias, pid, connection parameters digest) -> pool; pools are never
+# shared with forked workers
+_pools = {}
+# (alias, pid) -> key of the pool the alias connects to
+_current = {}
+_pools_lock = threading.Lock()
+
+
+def params_digest(conn_params):
+    """ Digest of the psycopg2.connect() parameters of a connection """
+    params = repr(sorted((name, str(value))
+                         for name, value in conn_params.items()))
+    return hashlib.sha256(params.encode()).hexdigest()[:16]
+
+
+def get_pool(alias, conn_params):
+    """
+    The pool of the alias and the connection parameters. The pool of
+    other parameters the alias used before is closed.
+    """
+    key = (alias, os.getpid(), params_digest(conn_params))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                # each worker gets an equal share of DB_POOL_MAX_CONNECTIONS
+                share = DB_POOL_MAX_CONNECTIONS // DB_POOL_WORKERS
+                pool = ConnectionPool(
+                    max_size=max(1, share),
+                    timeout=DB_POOL_TIMEOUT,
+                    check_after=DB_POOL_CHECK_AFTER,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    database=conn_params.get('database'),
+                )
+                _pools[key] = pool
+            previous = _current.get(key[:2])
+            _current[key[:2]] = key
+            if previous is not None and previous != key:
+                # the settings of the alias changed
+                _pools.pop(previous).close()
+    return pool
+
+
+def close_pools(database=None):
+    """
+    Close the pools of the current process, of one database name only if
+    given. Their connections don't keep a database busy after that.
+    """
+    pid = os.getpid()
+    with _pools_lock:
+        keys = [key for key, pool in _pools.items()
+                if key[1] == pid and database in (None, pool.database)]
+        pools = [_pools.pop(key) for key in keys]
+        for key in keys:
+            if _current.get(key[:2]) == key:
+                del _current[key[:2]]
+    for pool in pools:
+        pool.close()
+
+
+def close_all(**kwargs):
+    close_pools()
+
+
+def _databases_changed(setting, **kwargs):
+    if setting == 'DATABASES':
+        close_all()
+
+
+setting_changed.connect(_databases_changed)
+
+
+def pool_stats():
+    """ Stats of the pools of the current process by database alias """
+    pid = os.getpid()
+    return {alias: _pools[key].stats()
+            for (alias, pool_pid), key in list(_current.items())
+            if pool_pid == pid and key in _pools}
@@ -39,7 +39,8 @@ class RoomCreateForm(ModelForm):
         model = Room
         fields = [
             'title',
-            'seats_count']
+            'seats_count',
+            'layout']
 
 
 class MovieCreateForm(ModelForm):
@@ -66,6 +67,8 @@ class SessionCreateForm(ModelForm):
             'date_start',
             'date_finish',
             'price',
+            'waiting_room',
+            'admission_rate',
         ]
 
 
@@ -86,6 +89,9 @@ class BuyTicketForm(Form):
     session = forms.IntegerField(widget=forms.HiddenInput())
     date = forms.DateField(widget=forms.HiddenInput())
     seat_numbers = MultiSeatsField(label='')
+    # the same for the retries of one purchase, see cinema.idempotency
+    idempotency_key = forms.CharField(widget=forms.HiddenInput(),
+                                      required=False, max_length=255)
 
     def clean_date(self):
         today = dt.now().date()
@@ -0,0 +1,97 @@
+"""
+Idempotency keys of the ticket purchases (/buyticket/, POST /ticket_api/).
+
+A client sends the same Idempotency-Key header (or the idempotency_key
+field of the buy form) with every retry of one purchase. The first
+request runs and its result is kept for IDEMPOTENCY_TTL; the retries get
+that result back without running the validation queries or touching the
+seats. A retry arriving while the first request still runs gets
+InProgress, a key sent again with another payload gets KeyReused.
+
+The results live in the default cache, which must be shared by the
+workers (e.g. memcached) for retries landing on another worker.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from cinema import metrics
+from django_cinema.settings import IDEMPOTENCY_TTL, \
+    IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_KEY_MAX_LENGTH
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FIELD = 'idempotency_key'
+# fields of the payload which don't make two purchases different
+IGNORED_FIELDS = {FIELD, 'csrfmiddlewaretoken'}
+PENDING = 'pending'
+DONE = 'done'
+
+
+class InProgress(Exception):
+    pass
+
+
+class KeyReused(Exception):
+    pass
+
+
+class InvalidKey(Exception):
+    pass
+
+
+def request_key(request, data):
+    key = request.META.get(HEADER) or data.get(FIELD) or ''
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise InvalidKey(
+            f'Idempotency keys are up to {IDEMPOTENCY_KEY_MAX_LENGTH} '
+            f'characters')
+    return key
+
+
+def fingerprint(data):
+    """ Hash of the purchase fields of a QueryDict or a dict """
+    if hasattr(data, 'lists'):
+        items = {name: sorted(values) for name, values in data.lists()}
+    else:
+        items = dict(data)
+    for name in IGNORED_FIELDS:
+        items.pop(name, None)
+    payload = json.dumps(items, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def once(request, scope, data, run):
+    """
+    run() once per idempotency key of the user, returns its result and
+    whether it was replayed. Without a key run() simply runs.
+    """
+    key = request_key(request, data)
+    if not key:
+        return run(), False
+
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    cache_key = f'idempotency:{scope}:{request.user.pk}:{digest}'
+    payload = fingerprint(data)
+    if cache.add(cache_key, (payload, PENDING, None),
+                 IDEMPOTENCY_LOCK_SECONDS):
+        try:
+            result = run()
+        except BaseException:
+            # nothing to replay, the client may try again
+            cache.delete(cache_key)
+            raise
+        cache.set(cache_key, (payload, DONE, result), IDEMPOTENCY_TTL)
+        return result, False
+
+    entry = cache.get(cache_key)
+    if entry is None:
+        # the first request gave up in the meantime
+        raise InProgress()
+    stored_payload, state, result = entry
+    if stored_payload != payload:
+        raise KeyReused()
+    if state == PENDING:
+        raise InProgress()
+    metrics.inc('cinema_idempotent_replays_total', channel=scope)
+    return result, True
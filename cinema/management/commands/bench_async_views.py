@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError, HTTPError
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand
+
+from cinema.bench import summarize, write_results
+
+# (name, WSGI view path, async view path)
+TARGETS = [
+    ('sessions', '/', '/async/'),
+    ('tomorrow', '/tomorrow/', '/async/tomorrow/'),
+    ('session_detail', '/session/{pk}/', '/async/session/{pk}/'),
+    ('today_session_api', '/today_session_api/', '/async/today_session_api/'),
+]
+
+
+class Command(BaseCommand):
+    """
+    Compare the sync views served by a WSGI server with the async views
+    served by an ASGI server, e.g.
+
+        gunicorn -w 4 django_cinema.wsgi -b :8000
+        uvicorn --workers 4 django_cinema.asgi:application --port 8001
+        manage.py bench_async_views --session 1 --concurrency 200
+    """
+    help = 'Benchmark the public views under WSGI and ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--asgi-url', default='http://127.0.0.1:8001')
+        parser.add_argument('--session', type=int, default=1,
+                            help='Session id for the detail page')
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per target and server')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--output', help='Store the results as JSON')
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, sync_path, async_path in TARGETS:
+            for server, base, path in (
+                    ('wsgi', options['wsgi_url'], sync_path),
+                    ('asgi', options['asgi_url'], async_path)):
+                url = base + path.format(pk=options['session'])
+                result = self.run(url, options)
+                results[f'{name}.{server}'] = result
+                self.stdout.write(
+                    f"{name:18} {server}  {result['throughput']:>9} req/s  "
+                    f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  "
+                    f"p99 {result['p99_ms']} ms  errors {result['errors']}")
+
+        if options['output']:
+            write_results(options['output'], 'async_views', options, results)
+
+    def run(self, url, options):
+        timeout = options['timeout']
+
+        def fetch(_):
+            started = time.perf_counter()
+            try:
+                with urlopen(url, timeout=timeout) as response:
+                    response.read()
+                ok = True
+            except (HTTPError, URLError, OSError):
+                ok = False
+            return time.perf_counter() - started, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            samples = list(executor.map(fetch, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for latency, ok in samples if ok]
+        errors = len(samples) - len(latencies)
+        return summarize(latencies, elapsed, errors)
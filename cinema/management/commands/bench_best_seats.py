@@ -0,0 +1,54 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from cinema.bench import percentile, write_results
+from cinema.seating import RoomLayout, default_layout
+
+
+class Command(BaseCommand):
+    """
+    Time RoomLayout.best_seats() on a room filled to different levels, e.g.
+
+        manage.py bench_best_seats --seats 1000 --n 4
+    """
+    help = 'Benchmark the best-available seats finder'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seats', type=int, default=1000)
+        parser.add_argument('--n', type=int, default=2,
+                            help='Adjacent seats to find')
+        parser.add_argument('--lookups', type=int, default=10000,
+                            help='Lookups per fill level')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Store the results as JSON')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        seats = range(1, options['seats'] + 1)
+
+        started = time.perf_counter()
+        layout = RoomLayout(default_layout(options['seats']))
+        layout.blocks(options['n'])
+        self.stdout.write(f'layout and blocks built in '
+                          f'{(time.perf_counter() - started) * 1e6:.0f} us')
+
+        results = {}
+        for fill in (0, 0.5, 0.9, 0.99):
+            taken = set(rng.sample(seats, int(len(seats) * fill)))
+            latencies = []
+            for _ in range(options['lookups']):
+                started = time.perf_counter()
+                layout.best_seats(taken, options['n'])
+                latencies.append(time.perf_counter() - started)
+            # microseconds, the milliseconds of summarize() are too coarse
+            result = {f'p{q}_us': round(percentile(latencies, q) * 1e6, 2)
+                      for q in (50, 95, 99)}
+            results[f'fill_{fill}'] = result
+            self.stdout.write(
+                f"{fill:>5.0%} taken  p50 {result['p50_us']} us  "
+                f"p95 {result['p95_us']} us  p99 {result['p99_us']} us")
+
+        if options['output']:
+            write_results(options['output'], 'best_seats', options, results)
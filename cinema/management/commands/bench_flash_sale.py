@@ -0,0 +1,281 @@
+import base64
+import random
+import threading
+import time
+from datetime import datetime as dt, time as tm, timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from cinema import rate_limit
+from cinema.bench import summarize, write_results
+from cinema.models import CinemaUser, Movie, Room, RevokedTicket, \
+    Session, Ticket
+
+PREFIX = 'bench-'
+PASSWORD = 'bench-password'
+# sessions of a room start every 2 hours from 10:00, the last at 22:00
+MAX_SESSIONS = 7
+# outcomes of a request, the latencies of OK and CONFLICT are measured
+OK = 'ok'
+CONFLICT = 'conflict'
+ERROR = 'error'
+# the message of /buyticket/ for seats bought by somebody else
+SEAT_TAKEN = 'Invalid seats'
+MESSAGE_COOKIE = getattr(settings, 'MESSAGE_COOKIE_NAME', 'messages')
+
+
+class Command(BaseCommand):
+    """
+    Flash sale against the configured database: many buyers load the
+    schedule and the session page and buy the same few seats through
+    /buyticket/ and /ticket_api/ at once.
+
+        manage.py bench_flash_sale --buyers 100 --output flash.json
+
+    The synthetic cinema is created with the bench- prefix and removed
+    afterwards unless --keep is given.
+    """
+    help = 'Benchmark the purchase and listing endpoints under contention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50,
+                            help='Concurrent simulated buyers')
+        parser.add_argument('--rounds', type=int, default=5,
+                            help='Requests of each buyer per scenario')
+        parser.add_argument('--rooms', type=int, default=3)
+        parser.add_argument('--seats', type=int, default=100,
+                            help='Seats of every room')
+        parser.add_argument('--sessions', type=int, default=3,
+                            help=f'Sessions of every room, at most '
+                                 f'{MAX_SESSIONS}')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the synthetic cinema')
+        parser.add_argument('--output', help='Store the results as JSON')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['sessions'] <= MAX_SESSIONS:
+            raise CommandError(f'--sessions must be from 1 to {MAX_SESSIONS}, '
+                               f'add --rooms for more sessions')
+        self.random = random.Random(options['seed'])
+        # the buyers log in all the time, a fast hasher keeps it out of
+        # the numbers; they share one address, so no rate limits either
+        with override_settings(PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.MD5PasswordHasher']), \
+                mock.patch.object(rate_limit, 'RULES', []):
+            self.cleanup()
+            sessions, users = self.seed(options)
+            try:
+                results = self.run_scenarios(sessions, users, options)
+            finally:
+                if not options['keep']:
+                    self.cleanup()
+
+        for name, result in results.items():
+            if not isinstance(result, dict) or 'throughput' not in result:
+                continue
+            self.stdout.write(
+                f"{name:16} {result['throughput']:>9} req/s  "
+                f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  "
+                f"p99 {result['p99_ms']} ms  "
+                f"{result['queries_per_request']} queries/req  "
+                f"errors {result['errors']}")
+        self.stdout.write(f"double bookings: {results['double_bookings']}")
+        self.stdout.write(f"oversold sessions: {results['oversold']}")
+
+        if options['output']:
+            write_results(options['output'], 'flash_sale', options, results)
+
+    def seed(self, options):
+        """ Rooms, movies, sessions running today and tomorrow, buyers """
+        today = dt.now().date()
+        sessions = []
+        for n in range(options['rooms']):
+            room = Room.objects.create(
+                title=f'{PREFIX}room-{n}', seats_count=options['seats'])
+            for k in range(options['sessions']):
+                movie = Movie.objects.create(
+                    title=f'{PREFIX}movie-{n}-{k}',
+                    description='Synthetic movie', duration=90)
+                sessions.append(Session.objects.create(
+                    movie=movie,
+                    room=room,
+                    time_start=tm(10 + k * 2),
+                    time_finish=tm(11 + k * 2, 55),
+                    date_start=today,
+                    date_finish=today + timedelta(days=1),
+                    price=10,
+                ))
+
+        users = []
+        for n in range(options['buyers']):
+            user = CinemaUser(username=f'{PREFIX}buyer-{n}', phone='0')
+            user.set_password(PASSWORD)
+            users.append(user)
+        CinemaUser.objects.bulk_create(users)
+        users = list(CinemaUser.objects.filter(username__startswith=PREFIX))
+        return sessions, users
+
+    def cleanup(self):
+        # deleted tickets are revoked for the doors, see cinema.checkin
+        tickets = list(Ticket.objects.filter(
+            session__room__title__startswith=PREFIX).values_list(
+            'id', flat=True))
+        Session.objects.filter(room__title__startswith=PREFIX).delete()
+        for n in range(0, len(tickets), 500):
+            RevokedTicket.objects.filter(
+                ticket_id__in=tickets[n:n + 500]).delete()
+        Room.objects.filter(title__startswith=PREFIX).delete()
+        Movie.objects.filter(title__startswith=PREFIX).delete()
+        CinemaUser.objects.filter(username__startswith=PREFIX).delete()
+
+    def run_scenarios(self, sessions, users, options):
+        # tickets are bought for tomorrow, so no session is over yet
+        date = dt.now().date() + timedelta(days=1)
+        seats = options['seats']
+
+        def listing(client, user):
+            page = self.random.choice(['', '?ordering=price'])
+            response = client.get(f'/{page}')
+            return OK if response.status_code == 200 else ERROR
+
+        def session_page(client, user):
+            session = self.random.choice(sessions)
+            response = client.get(f'/session/{session.id}/?date={date}')
+            return OK if response.status_code == 200 else ERROR
+
+        def buy_form(client, user):
+            session = self.random.choice(sessions)
+            # everybody wants the middle of the room
+            wanted = self.random.sample(
+                range(seats // 3, 2 * seats // 3 + 1), 2)
+            # the buyer never follows the redirect, only the messages of
+            # this purchase are classified
+            client.cookies.pop(MESSAGE_COOKIE, None)
+            response = client.post('/buyticket/', {
+                'session': session.id,
+                'date': str(date),
+                'seat_numbers': [str(i) for i in wanted],
+            }, HTTP_REFERER=f'/session/{session.id}/')
+            return form_outcome(response)
+
+        def buy_api(client, user):
+            session = self.random.choice(sessions)
+            seat = self.random.randint(seats // 3, 2 * seats // 3)
+            credentials = base64.b64encode(
+                f'{user.username}:{PASSWORD}'.encode()).decode()
+            response = client.post('/ticket_api/', {
+                'session': session.id,
+                'user': user.id,
+                'date': str(date),
+                'seat_number': seat,
+            }, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Basic {credentials}')
+            return api_outcome(response)
+
+        results = {}
+        for name, scenario, login in (
+                ('sessions_list', listing, False),
+                ('session_detail', session_page, False),
+                ('buy_form', buy_form, True),
+                ('buy_api', buy_api, False)):
+            results[name] = self.run(scenario, users, login, options)
+
+        duplicates = Ticket.objects.filter(
+            session__in=sessions).values(
+            'session', 'date', 'seat_number').annotate(
+            n=Count('id')).filter(n__gt=1).count()
+        oversold = Ticket.objects.filter(
+            session__in=sessions).values('session', 'date').annotate(
+            n=Count('id')).filter(n__gt=seats).count()
+        results['double_bookings'] = duplicates
+        results['oversold'] = oversold
+        results['tickets_sold'] = Ticket.objects.filter(
+            session__in=sessions).count()
+        return results
+
+    def run(self, scenario, users, login, options):
+        """ Run the scenario by every buyer in its own thread """
+        lock = threading.Lock()
+        latencies = []
+        queries = []
+        errors = 0
+        conflicts = 0
+        # the clock starts when every buyer is logged in and ready
+        marks = []
+        start = threading.Barrier(
+            len(users), action=lambda: marks.append(time.perf_counter()))
+
+        def buyer(user):
+            nonlocal errors, conflicts
+            client = Client(raise_request_exception=False,
+                            HTTP_HOST='localhost')
+            if login:
+                client.force_login(user)
+            start.wait()
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as captured:
+                    try:
+                        outcome = scenario(client, user)
+                    except Exception:
+                        outcome = ERROR
+                latency = time.perf_counter() - started
+                with lock:
+                    queries.append(len(captured))
+                    if outcome == ERROR:
+                        errors += 1
+                    else:
+                        latencies.append(latency)
+                    if outcome == CONFLICT:
+                        conflicts += 1
+            connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(user,))
+                   for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - marks[0]
+
+        result = summarize(latencies, elapsed, errors)
+        result['seat_conflicts'] = conflicts
+        result['queries_per_request'] = round(
+            sum(queries) / len(queries), 2) if queries else 0
+        return result
+
+
+def form_outcome(response):
+    """
+    OK for tickets bought through /buyticket/, CONFLICT for seats bought
+    by somebody else, ERROR for anything else (invalid forms, rate
+    limits, the waiting room...)
+    """
+    if response.status_code != 302:
+        return ERROR
+    if response['Location'] == '/tickets/':
+        return OK
+    errors = [message.message for message in
+              get_messages(response.wsgi_request)]
+    return CONFLICT if errors == [SEAT_TAKEN] else ERROR
+
+
+def api_outcome(response):
+    """ OK, CONFLICT or ERROR of a POST to /ticket_api/ """
+    if response.status_code == 201:
+        return OK
+    if response.status_code == 400:
+        errors = response.json()
+        # the unique together check, or the seat check of the view
+        if 'non_field_errors' in errors or \
+                errors == {'seats_number': ['Invalid seat number']}:
+            return CONFLICT
+    return ERROR
@@ -0,0 +1,101 @@
+import random
+import time
+from collections import OrderedDict
+from datetime import date, time as dtime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from cinema.API.renderers import ORJSONRenderer, MessagePackRenderer
+from cinema.bench import percentile, write_results
+
+
+def session_list(count, rng):
+    """ Data of a SessionSerializer list of count sessions """
+    today = date.today()
+    movies = [OrderedDict([
+        ('id', pk),
+        ('title', f'Movie {pk}'),
+        ('description', 'A long description of the movie. ' * 10),
+        ('poster', f'/media/posters/movie-{pk}.jpg'),
+        ('year', rng.randint(1950, 2020)),
+        ('duration', rng.randint(80, 180)),
+        ('director', f'Director {pk}'),
+    ]) for pk in range(1, 51)]
+    rooms = [OrderedDict([
+        ('id', pk),
+        ('title', f'Room {pk}'),
+        ('seats_count', 100),
+        ('layout', [10] * 10),
+    ]) for pk in range(1, 11)]
+    sessions = []
+    for pk in range(1, count + 1):
+        start = dtime(rng.randint(9, 21), rng.choice((0, 15, 30, 45)))
+        sessions.append(OrderedDict([
+            ('id', pk),
+            ('movie', rng.choice(movies)),
+            ('room', rng.choice(rooms)),
+            ('time_start', start.isoformat()),
+            ('time_finish', dtime(start.hour + 2, start.minute).isoformat()),
+            ('date_start', today.isoformat()),
+            ('date_finish', (today + timedelta(days=7)).isoformat()),
+            ('price', Decimal(rng.randint(50, 200))),
+        ]))
+    return sessions
+
+
+class Command(BaseCommand):
+    """
+    Time the API renderers on big session lists, against the cached
+    rendered bytes, e.g.
+
+        manage.py bench_renderers --sessions 100 1000 5000
+    """
+    help = 'Benchmark the API renderers on session lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, nargs='+',
+                            default=[100, 1000, 5000])
+        parser.add_argument('--renders', type=int, default=200,
+                            help='Renders per renderer and list size')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Store the results as JSON')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        renderers = {
+            'drf_json': JSONRenderer(),
+            'orjson': ORJSONRenderer(),
+            'msgpack': MessagePackRenderer(),
+        }
+
+        results = {}
+        for count in options['sessions']:
+            data = session_list(count, rng)
+            key = f'bench_renderers:{count}'
+            cache.set(key, renderers['orjson'].render(data), None)
+            runs = {name: (lambda renderer=renderer: renderer.render(data))
+                    for name, renderer in renderers.items()}
+            runs['cached'] = lambda: cache.get(key)
+
+            for name, run in runs.items():
+                latencies = []
+                for _ in range(options['renders']):
+                    started = time.perf_counter()
+                    content = run()
+                    latencies.append(time.perf_counter() - started)
+                # microseconds, small lists render in well under a ms
+                result = {f'p{q}_us': round(percentile(latencies, q) * 1e6, 1)
+                          for q in (50, 95, 99)}
+                result['bytes'] = len(content)
+                results[f'{name}_{count}'] = result
+                self.stdout.write(
+                    f"{count:>6} sessions  {name:<8}  "
+                    f"p50 {result['p50_us']} us  p95 {result['p95_us']} us  "
+                    f"p99 {result['p99_us']} us  {result['bytes']} bytes")
+            cache.delete(key)
+
+        if options['output']:
+            write_results(options['output'], 'renderers', options, results)
@@ -0,0 +1,112 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cinema.bench import write_results
+from django_cinema.settings import BASE_DIR
+
+# run in a fresh interpreter, so nothing is imported yet
+STARTUP_SCRIPT = '''
+import json
+import time
+
+started = time.perf_counter()
+from django.db.backends.signals import connection_created
+
+connections = []
+queries = []
+
+
+def record(execute, sql, params, many, context):
+    queries.append(sql)
+    return execute(sql, params, many, context)
+
+
+def opened(sender, connection, **kwargs):
+    connections.append(connection.alias)
+    connection.execute_wrappers.append(record)
+
+
+connection_created.connect(opened)
+import {module}
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'connections': connections,
+    'queries': queries,
+}}))
+'''
+
+
+class Command(BaseCommand):
+    """
+    Time the start of a worker: django.setup(), the URLconf, the views
+    and the warm-up, and check that it doesn't touch the database.
+
+        manage.py bench_startup --runs 10 --imports 15
+    """
+    help = 'Benchmark the worker startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='django_cinema.wsgi',
+                            help='Module loaded by the worker')
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--imports', type=int, default=0,
+                            help='Show the N slowest imports')
+        parser.add_argument('--output', help='Store the results as JSON')
+
+    def handle(self, *args, **options):
+        script = STARTUP_SCRIPT.format(module=options['module'])
+        runs = [self.start(script) for _ in range(options['runs'])]
+        seconds = [run['seconds'] for run in runs]
+        results = {
+            'module': options['module'],
+            'median_ms': round(statistics.median(seconds) * 1000, 1),
+            'min_ms': round(min(seconds) * 1000, 1),
+            'max_ms': round(max(seconds) * 1000, 1),
+            'connections': len(runs[0]['connections']),
+            'queries': runs[0]['queries'],
+        }
+        self.stdout.write(
+            f"{options['module']}: median {results['median_ms']} ms, "
+            f"min {results['min_ms']} ms, max {results['max_ms']} ms")
+        self.stdout.write(
+            f"database connections {results['connections']}, "
+            f"queries {len(results['queries'])}")
+        for sql in results['queries']:
+            self.stdout.write(f'  {sql}')
+
+        if options['imports']:
+            results['imports'] = self.slowest_imports(
+                script, options['imports'])
+            for module, ms in results['imports']:
+                self.stdout.write(f'{ms:10.1f} ms  {module}')
+
+        if options['output']:
+            write_results(options['output'], 'startup', options, results)
+
+    def run_script(self, script, *flags):
+        return subprocess.run(
+            [sys.executable, *flags, '-c', script],
+            cwd=BASE_DIR, env=os.environ.copy(),
+            capture_output=True, text=True)
+
+    def start(self, script):
+        process = self.run_script(script)
+        if process.returncode:
+            raise CommandError(process.stderr)
+        return json.loads(process.stdout.splitlines()[-1])
+
+    def slowest_imports(self, script, count):
+        """ Modules by cumulative import time (python -X importtime) """
+        process = self.run_script(script, '-X', 'importtime')
+        imports = []
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, module = line[len('import time:'):].split('|')
+            imports.append((module.strip(), int(cumulative) / 1000))
+        return sorted(imports, key=lambda i: i[1], reverse=True)[:count]
@@ -0,0 +1,238 @@
+import io
+import math
+import random
+import time
+from datetime import datetime as dt, date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from cinema.management.commands.partition_tickets import is_partitioned, \
+    create_day_partition, daterange
+from cinema.models import CinemaUser, Movie, Room, Session, Ticket, \
+    update_search_vectors
+from django_cinema.settings import DURATION_OF_BREAKS
+
+WORDS = [
+    'Dark', 'Last', 'Silent', 'Red', 'Lost', 'Iron', 'Broken', 'Golden',
+    'Night', 'River', 'Storm', 'Star', 'City', 'Shadow', 'Empire', 'Dream',
+    'Island', 'Road', 'Garden', 'Winter', 'Fire', 'Ghost', 'Machine', 'Song',
+]
+DIRECTORS = [
+    'A. Novak', 'B. Kovalenko', 'C. Moreau', 'D. Tanaka', 'E. Lindqvist',
+    'F. Okafor', 'G. Rossi', 'H. Schmidt', 'I. Petrenko', 'J. Alvarez',
+]
+# occupancy factor by weekday, Monday first
+WEEKDAY_DEMAND = [0.75, 0.7, 0.8, 0.9, 1.25, 1.4, 1.15]
+
+
+class Command(BaseCommand):
+    """
+    Generate a large synthetic cinema for load and query testing.
+
+    Rows are inserted with bulk_create, tickets with COPY on PostgreSQL,
+    so the per-row validation of Session.save and Ticket.save is skipped.
+    The schedule doesn't overlap and every ticket is a distinct seat.
+    """
+    help = 'Generate rooms, movies, sessions, users and tickets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='gen-',
+                            help='Prefix of the room titles and user names')
+        parser.add_argument('--rooms', type=int, default=20)
+        parser.add_argument('--movies', type=int, default=500)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=90,
+                            help='Days of schedule ending tomorrow')
+        parser.add_argument('--run-days', type=int, default=7,
+                            help='Days a session runs (date_start to '
+                                 'date_finish)')
+        parser.add_argument('--seats-min', type=int, default=80)
+        parser.add_argument('--seats-max', type=int, default=400)
+        parser.add_argument('--occupancy', type=float, default=0.5,
+                            help='Average share of sold seats')
+        parser.add_argument('--batch-size', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['seats_min'] > options['seats_max']:
+            raise CommandError('--seats-min is bigger than --seats-max')
+        self.random = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        if Room.objects.filter(title__startswith=self.prefix).exists():
+            raise CommandError(
+                f'Rooms with the {self.prefix} prefix exist, use --prefix')
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        rooms = self.create_rooms(options)
+        movies = self.create_movies(options)
+        user_ids = self.create_users(options)
+        sessions = self.create_sessions(rooms, movies, options)
+        self.log(f'{len(rooms)} rooms, {len(movies)} movies, '
+                 f'{len(user_ids)} users, {len(sessions)} sessions', started)
+
+        tickets = self.load_tickets(
+            self.tickets(sessions, movies, user_ids, options))
+        self.log(f'{tickets} tickets', started)
+
+    def log(self, message, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'[{elapsed:8.1f}s] {message}')
+
+    def create_rooms(self, options):
+        rooms = [
+            Room(title=f'{self.prefix}room-{n}',
+                 seats_count=self.random.randint(
+                     options['seats_min'], options['seats_max']))
+            for n in range(options['rooms'])
+        ]
+        Room.objects.bulk_create(rooms, batch_size=self.batch_size)
+        return list(Room.objects.filter(title__startswith=self.prefix))
+
+    def create_movies(self, options):
+        movies = []
+        for n in range(options['movies']):
+            title = ' '.join(self.random.sample(WORDS, 2))
+            movies.append(Movie(
+                title=f'{title} {n}',
+                description=' '.join(self.random.choices(WORDS, k=40)),
+                duration=self.random.randint(80, 180),
+                director=self.random.choice(DIRECTORS),
+                year=self.random.randint(1960, dt.now().year),
+            ))
+        Movie.objects.bulk_create(movies, batch_size=self.batch_size)
+        # bulk_create skips save(), index the new movies in one UPDATE
+        update_search_vectors(Movie.objects.filter(search_vector=None))
+        # the popularity rank is the list index
+        return list(Movie.objects.order_by('-id')[:options['movies']])
+
+    def create_users(self, options):
+        password = make_password(None)
+        users = [
+            CinemaUser(username=f'{self.prefix}user-{n}', password=password,
+                       phone='0')
+            for n in range(options['users'])
+        ]
+        CinemaUser.objects.bulk_create(users, batch_size=self.batch_size)
+        return list(CinemaUser.objects.filter(
+            username__startswith=self.prefix).values_list('id', flat=True))
+
+    def create_sessions(self, rooms, movies, options):
+        """
+        Every room shows back to back sessions from 10:00 to 23:00,
+        the schedule changes every run_days days.
+        """
+        tomorrow = dt.now().date() + timedelta(days=1)
+        first_day = tomorrow - timedelta(days=options['days'] - 1)
+        # popular movies are shown more often (Zipf-like)
+        weights = [1 / (rank + 1) for rank in range(len(movies))]
+
+        sessions = []
+        for room in rooms:
+            block_start = first_day
+            while block_start <= tomorrow:
+                block_finish = min(
+                    block_start + timedelta(days=options['run_days'] - 1),
+                    tomorrow)
+                start = dt.combine(date.min, dt.min.time()) + \
+                    timedelta(hours=10)
+                while True:
+                    movie = self.random.choices(movies, weights)[0]
+                    finish = start + timedelta(
+                        minutes=movie.duration + DURATION_OF_BREAKS)
+                    if finish.day != start.day or finish.hour >= 23:
+                        break
+                    sessions.append(Session(
+                        movie=movie,
+                        room=room,
+                        time_start=start.time(),
+                        time_finish=finish.time(),
+                        date_start=block_start,
+                        date_finish=block_finish,
+                        price=self.random.choice([5, 7, 9, 12]),
+                    ))
+                    # the next session starts on a multiple of 5 minutes
+                    start = finish + timedelta(minutes=-finish.minute % 5)
+                block_start = block_finish + timedelta(days=1)
+
+        Session.objects.bulk_create(sessions, batch_size=self.batch_size)
+        return list(Session.objects.filter(
+            room__in=rooms).select_related('room'))
+
+    def occupancy(self, session, day, popularity, mean):
+        """ Share of sold seats of the session day """
+        hour = session.time_start.hour
+        # evenings sell best, mornings worst
+        time_demand = 0.6 + 0.8 * math.exp(-((hour - 20) / 3) ** 2)
+        # interest fades during the run
+        run_day = (day - session.date_start).days
+        freshness = 0.7 + 0.5 * math.exp(-run_day / 3)
+        demand = mean * WEEKDAY_DEMAND[day.weekday()] * time_demand * \
+            freshness * popularity * self.random.uniform(0.7, 1.3)
+        return min(1.0, max(0.0, demand))
+
+    def tickets(self, sessions, movies, user_ids, options):
+        """ Rows (session id, user id, date, seat number) """
+        movie_rank = {movie.id: rank for rank, movie in enumerate(movies)}
+        users = len(user_ids)
+
+        for session in sessions:
+            seats = session.room.seats_count
+            # from 1.5 for the most popular movie down to 0.5
+            popularity = 1.5 - movie_rank[session.movie_id] / len(movies)
+            for day in daterange(session.date_start, session.date_finish):
+                sold = int(seats * self.occupancy(
+                    session, day, popularity, options['occupancy']))
+                for seat in self.random.sample(range(1, seats + 1), sold):
+                    yield (session.id,
+                           user_ids[self.random.randrange(users)],
+                           day, seat)
+
+    def load_tickets(self, rows):
+        if connection.vendor == 'postgresql':
+            return self.copy_tickets(rows)
+
+        count = 0
+        batch = []
+        for session_id, user_id, day, seat in rows:
+            batch.append(Ticket(session_id=session_id, user_id=user_id,
+                                date=day, seat_number=seat))
+            if len(batch) >= self.batch_size:
+                Ticket.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        Ticket.objects.bulk_create(batch)
+        return count + len(batch)
+
+    def copy_tickets(self, rows):
+        table = Ticket._meta.db_table
+        days = set()
+        count = 0
+        buffer = io.StringIO()
+        partitioned = is_partitioned()
+
+        def flush():
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY {table} (session_id, user_id, date, seat_number) '
+                    f'FROM STDIN WITH (FORMAT csv)', buffer)
+            buffer.seek(0)
+            buffer.truncate()
+
+        batch = 0
+        for session_id, user_id, day, seat in rows:
+            if partitioned and day not in days:
+                create_day_partition(day)
+                days.add(day)
+            buffer.write(f'{session_id},{user_id},{day},{seat}\n')
+            batch += 1
+            if batch >= self.batch_size:
+                flush()
+                count += batch
+                batch = 0
+                self.stdout.write(f'{count} tickets')
+        flush()
+        return count + batch
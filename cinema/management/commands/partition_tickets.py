@@ -0,0 +1,235 @@
+import re
+from datetime import datetime as dt, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from cinema.models import Ticket
+from django_cinema.settings import TICKET_PARTITION_DAYS_AHEAD, \
+    TICKET_PARTITION_RETAIN_DAYS, TICKET_ARCHIVE_SCHEMA
+
+DAY_PARTITION = re.compile(r'_p(\d{8})$')
+BEFORE_PARTITION = re.compile(r'_before_(\d{8})$')
+
+
+class Command(BaseCommand):
+    """
+    Keep the ticket table range-partitioned by date (PostgreSQL only).
+
+    One partition per show day is created ahead of time, partitions of
+    past days are detached and moved to the archive schema. Run it daily,
+    the first run needs --convert to partition the existing table.
+
+    Tickets of a day without a partition land in the default partition,
+    they are moved to the partition of their day once it is created.
+    Fields added to Ticket later (e.g. checked_in_at) are added to the
+    table by every run, before a conversion too: ALTER TABLE ... ADD
+    COLUMN on the partitioned table reaches all its partitions. The
+    archived partitions keep the columns they had.
+    """
+    help = 'Create future ticket partitions and archive past ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help='Convert the plain ticket table into a partitioned one')
+        parser.add_argument(
+            '--days-ahead', type=int, default=TICKET_PARTITION_DAYS_AHEAD,
+            help='Create partitions up to this many days ahead')
+        parser.add_argument(
+            '--retain-days', type=int, default=TICKET_PARTITION_RETAIN_DAYS,
+            help='Archive partitions older than this many days')
+        parser.add_argument(
+            '--archive-schema', default=TICKET_ARCHIVE_SCHEMA,
+            help='Schema the detached partitions are moved to')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Ticket partitioning needs PostgreSQL')
+
+        self.table = Ticket._meta.db_table
+        today = dt.now().date()
+        first_day = today - timedelta(days=options['retain_days'])
+        last_day = today + timedelta(days=options['days_ahead'])
+
+        partitioned = self.is_partitioned()
+        self.add_missing_columns()
+        if not partitioned:
+            if not options['convert']:
+                raise CommandError(
+                    f'{self.table} is not partitioned, run with --convert')
+            self.convert(first_day, last_day)
+        else:
+            for day in daterange(today, last_day):
+                create_day_partition(day)
+
+        self.archive(first_day, options['archive_schema'])
+
+    def execute_sql(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.description:
+                return cursor.fetchall()
+
+    def is_partitioned(self):
+        partitioned = is_partitioned()
+        if partitioned is None:
+            raise CommandError(f'{self.table} does not exist')
+        return partitioned
+
+    def add_missing_columns(self):
+        """ Add the columns of the Ticket fields missing in the table """
+        with connection.cursor() as cursor:
+            columns = {column.name for column in
+                       connection.introspection.get_table_description(
+                           cursor, self.table)}
+        missing = [field for field in Ticket._meta.local_concrete_fields
+                   if field.column not in columns]
+        if not missing:
+            return
+        with transaction.atomic(), connection.schema_editor() as editor:
+            for field in missing:
+                editor.add_field(Ticket, field)
+                self.stdout.write(f'{self.table}.{field.column} added')
+
+    def convert(self, first_day, last_day):
+        table = self.table
+        legacy = f'{table}_legacy'
+        session_table = Ticket._meta.get_field('session').related_model \
+            ._meta.db_table
+        user_table = Ticket._meta.get_field('user').related_model \
+            ._meta.db_table
+
+        with transaction.atomic():
+            sequence = self.execute_sql(
+                "SELECT pg_get_serial_sequence(%s, 'id')", [table])[0][0]
+            oldest = self.execute_sql(
+                f'SELECT min(date) FROM {table}')[0][0] or first_day
+
+            self.execute_sql(f'ALTER TABLE {table} RENAME TO {legacy}')
+            self.execute_sql(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+
+            # the primary key of a partitioned table must contain the
+            # partition key, ids stay unique through the shared sequence
+            self.execute_sql(
+                f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS '
+                f'INCLUDING CONSTRAINTS) PARTITION BY RANGE (date)')
+            self.execute_sql(f'ALTER TABLE {table} ADD PRIMARY KEY (id, date)')
+            self.execute_sql(
+                f'ALTER TABLE {table} ADD UNIQUE (date, session_id, '
+                f'seat_number)')
+            self.execute_sql(
+                f'ALTER TABLE {table} ADD FOREIGN KEY (session_id) '
+                f'REFERENCES {session_table} (id) '
+                f'DEFERRABLE INITIALLY DEFERRED')
+            self.execute_sql(
+                f'ALTER TABLE {table} ADD FOREIGN KEY (user_id) '
+                f'REFERENCES {user_table} (id) DEFERRABLE INITIALLY DEFERRED')
+            self.execute_sql(f'CREATE INDEX ON {table} (session_id)')
+            self.execute_sql(f'CREATE INDEX ON {table} (user_id)')
+
+            # days before the retained period go to one partition,
+            # it is archived right after the conversion
+            if oldest < first_day:
+                self.execute_sql(
+                    f'CREATE TABLE '
+                    f"{partition_name(first_day, 'before_')} "
+                    f'PARTITION OF {table} '
+                    f"FOR VALUES FROM (MINVALUE) TO ('{first_day}')")
+            for day in daterange(max(oldest, first_day), last_day):
+                create_day_partition(day)
+            self.execute_sql(
+                f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+            self.execute_sql(f'INSERT INTO {table} SELECT * FROM {legacy}')
+            self.execute_sql(f'DROP TABLE {legacy}')
+            self.execute_sql(
+                f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+
+        self.stdout.write(self.style.SUCCESS(f'{table} is partitioned'))
+
+    def archive(self, first_day, schema):
+        partitions = self.execute_sql(
+            'SELECT c.relname FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent '
+            'WHERE p.relname = %s ORDER BY c.relname', [self.table])
+
+        self.execute_sql(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+        for name, in partitions:
+            day_match = DAY_PARTITION.search(name)
+            before_match = BEFORE_PARTITION.search(name)
+            if day_match:
+                day = dt.strptime(day_match.group(1), '%Y%m%d').date()
+                upper = day + timedelta(days=1)
+            elif before_match:
+                upper = dt.strptime(before_match.group(1), '%Y%m%d').date()
+            else:
+                continue
+            if upper > first_day:
+                continue
+
+            with transaction.atomic():
+                self.execute_sql(
+                    f'ALTER TABLE {self.table} DETACH PARTITION {name}')
+                self.execute_sql(f'ALTER TABLE {name} SET SCHEMA {schema}')
+            self.stdout.write(f'{name} moved to {schema}')
+
+
+def is_partitioned():
+    """ Whether the ticket table is partitioned, None if it doesn't exist """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind FROM pg_class WHERE relname = %s "
+            "AND relnamespace = 'public'::regnamespace",
+            [Ticket._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] == 'p' if row else None
+
+
+def partition_name(day, prefix='p'):
+    return f'{Ticket._meta.db_table}_{prefix}{day:%Y%m%d}'
+
+
+def create_day_partition(day):
+    """
+    Create the ticket partition of the day if it's missing. Tickets of
+    the day in the default partition are moved to it, PostgreSQL refuses
+    a partition for rows the default partition holds.
+    """
+    table = Ticket._meta.db_table
+    name = partition_name(day)
+    bounds = f"FROM ('{day}') TO ('{day + timedelta(days=1)}')"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s), to_regclass(%s)',
+                       [name, f'{table}_default'])
+        exists, default = cursor.fetchone()
+        if exists:
+            return
+        if default:
+            cursor.execute(
+                f'SELECT 1 FROM {table}_default '
+                f'WHERE date = %s LIMIT 1', [day])
+            default = cursor.fetchone()
+        if not default:
+            cursor.execute(
+                f'CREATE TABLE {name} PARTITION OF {table} '
+                f'FOR VALUES {bounds}')
+            return
+        # fill a plain table, attach it once the default partition has
+        # no rows of the day left
+        cursor.execute(
+            f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS '
+            f'INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {table}_default WHERE date = %s '
+            f'RETURNING *) INSERT INTO {name} SELECT * FROM moved', [day])
+        cursor.execute(
+            f'ALTER TABLE {table} ATTACH PARTITION {name} '
+            f'FOR VALUES {bounds}')
+
+
+def daterange(first_day, last_day):
+    """ Days from first_day to last_day inclusive """
+    for n in range((last_day - first_day).days + 1):
+        yield first_day + timedelta(days=n)
@@ -0,0 +1,43 @@
+import time
+from datetime import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cinema import snapshots
+from cinema.API.renderers import collection_version
+from django_cinema.settings import SNAPSHOT_ROOT, SNAPSHOT_SECONDS, \
+    SNAPSHOT_POLL_SECONDS
+
+
+class Command(BaseCommand):
+    """
+    Publish the schedule snapshots, see cinema.snapshots. With --watch
+    keep them fresh: republish every SNAPSHOT_SECONDS, at midnight and
+    when the sessions change, e.g.
+
+        SNAPSHOT_ROOT=/srv/cinema/snapshots manage.py publish_schedule --watch
+    """
+    help = 'Render the public schedule to static files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep republishing until interrupted')
+
+    def handle(self, *args, **options):
+        if not SNAPSHOT_ROOT:
+            raise CommandError('Set SNAPSHOT_ROOT to publish the schedule')
+        while True:
+            version = collection_version('sessions')
+            day = dt.now().date()
+            published = snapshots.publish()
+            self.stdout.write(
+                f"{dt.now():%H:%M:%S} published " + ', '.join(
+                    f'{name} ({size} bytes)'
+                    for name, size in published.items()))
+            if not options['watch']:
+                return
+            deadline = time.monotonic() + SNAPSHOT_SECONDS
+            while time.monotonic() < deadline and \
+                    collection_version('sessions') == version and \
+                    dt.now().date() == day:
+                time.sleep(SNAPSHOT_POLL_SECONDS)
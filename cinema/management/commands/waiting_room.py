@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cinema import waiting_room
+from cinema.models import Session
+
+
+class Command(BaseCommand):
+    """
+    Turn the waiting room of a session on or off, also once tickets are
+    sold (Session.save() refuses to change such sessions), e.g.
+
+        manage.py waiting_room 42 --on --rate 200
+        manage.py waiting_room 42 --off
+    """
+    help = 'Turn the waiting room of a session on or off'
+
+    def add_arguments(self, parser):
+        parser.add_argument('session', type=int)
+        state = parser.add_mutually_exclusive_group()
+        state.add_argument('--on', action='store_true')
+        state.add_argument('--off', action='store_true')
+        parser.add_argument('--rate', type=int,
+                            help='Visitors let in per minute')
+
+    def handle(self, *args, **options):
+        changes = {}
+        if options['on'] or options['off']:
+            changes['waiting_room'] = options['on']
+        if options['rate'] is not None:
+            if options['rate'] < 0:
+                raise CommandError('The rate must not be negative')
+            changes['admission_rate'] = options['rate']
+        if changes and not Session.objects.filter(
+                pk=options['session']).update(**changes):
+            raise CommandError(f"No session {options['session']}")
+        # update() sends no signals
+        waiting_room.sessions_changed()
+
+        session = Session.objects.get(pk=options['session'])
+        state = 'on' if session.waiting_room else 'off'
+        self.stdout.write(f'Waiting room of session {session.pk} is {state}, '
+                          f'{session.admission_rate} visitors a minute')
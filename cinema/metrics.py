@@ -0,0 +1,335 @@
+"""
+Prometheus metrics of all worker processes, served at /metrics/.
+
+Every thread counts in its own dictionary, so recording takes no lock.
+At most every METRICS_FLUSH_INTERVAL seconds a process writes the sum of
+its threads to METRICS_DIR/<pid>.json, the endpoint adds up the files of
+all processes. Counters of finished processes are folded into dead.json.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.utils.module_loading import import_string
+
+from django_cinema.settings import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'cinema_http_request_duration_seconds': (
+        'histogram', 'Latency of views and API actions', LATENCY_BUCKETS),
+    'cinema_http_responses_total': (
+        'counter', 'Responses by view, action and status', None),
+    'cinema_sql_query_duration_seconds': (
+        'histogram', 'Duration of SQL queries by view', SQL_BUCKETS),
+    'cinema_sql_queries_per_request': (
+        'histogram', 'SQL queries of a request by view', QUERY_COUNT_BUCKETS),
+    'cinema_cache_requests_total': (
+        'counter', 'Cache lookups by cache and result (hit or miss)', None),
+    'cinema_tickets_sold_total': (
+        'counter', 'Tickets sold by channel', None),
+    'cinema_seat_conflicts_total': (
+        'counter', 'Purchases lost because a seat was already taken', None),
+    'cinema_session_overlap_rejections_total': (
+        'counter', 'Sessions rejected for overlapping another session', None),
+    'cinema_idempotent_replays_total': (
+        'counter', 'Purchase retries answered with the first result', None),
+    'cinema_rate_limited_total': (
+        'counter', 'Requests rejected by the rate limits by rule', None),
+    'cinema_waiting_room_visitors_total': (
+        'counter', 'Visitors queued and admitted by the waiting rooms', None),
+    'cinema_checkins_total': (
+        'counter', 'Tickets scanned at the doors by result', None),
+    'cinema_checkin_degraded_total': (
+        'counter', 'Scans checked without current revocations', None),
+    'cinema_db_pool_connections': (
+        'gauge', 'Pooled database connections by state', None),
+    'cinema_db_pool_checkouts_total': (
+        'gauge', 'Connections handed out by the pool', None),
+    'cinema_db_pool_timeouts_total': (
+        'gauge', 'Requests that got no connection in time', None),
+    'cinema_db_pool_wait_seconds_total': (
+        'gauge', 'Time spent waiting for a free connection', None),
+}
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_pid = os.getpid()
+_last_flush = 0.0
+
+
+def _shard():
+    try:
+        return _local.values
+    except AttributeError:
+        values = _local.values = {}
+        with _shards_lock:
+            _shards.append(values)
+        return values
+
+
+def inc(name, amount=1, **labels):
+    """ Add amount to the counter """
+    shard = _shard()
+    key = (name, tuple(sorted(labels.items())))
+    shard[key] = shard.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """ Record value in the histogram """
+    buckets = METRICS[name][2]
+    shard = _shard()
+    key = (name, tuple(sorted(labels.items())))
+    counts = shard.get(key)
+    if counts is None:
+        # a count per bucket, +Inf and the sum
+        counts = shard[key] = [0] * (len(buckets) + 2)
+    counts[bisect_left(buckets, value)] += 1
+    counts[-1] += value
+
+
+def _collect_process():
+    """ Counters and histograms of all threads of this process """
+    global _pid
+    if os.getpid() != _pid:
+        # a forked worker starts from zero, its parent reports its own
+        _pid = os.getpid()
+        with _shards_lock:
+            for shard in _shards:
+                shard.clear()
+
+    values = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        for key, value in shard.copy().items():
+            _add(values, key, value)
+    return values
+
+
+def _add(values, key, value):
+    if isinstance(value, list):
+        total = values.get(key)
+        if total is None:
+            values[key] = list(value)
+        else:
+            for i, n in enumerate(value):
+                total[i] += n
+    else:
+        values[key] = values.get(key, 0) + value
+
+
+def _gauges():
+    """ Gauges of this process, read when the snapshot is written """
+    from cinema.db.pool import pool_stats
+
+    gauges = {}
+    for alias, stats in pool_stats().items():
+        for state in ('in_use', 'idle'):
+            gauges[('cinema_db_pool_connections',
+                    (('db', alias), ('state', state)))] = stats[state]
+        gauges[('cinema_db_pool_checkouts_total',
+                (('db', alias),))] = stats['checkouts']
+        gauges[('cinema_db_pool_timeouts_total',
+                (('db', alias),))] = stats['timeouts']
+        gauges[('cinema_db_pool_wait_seconds_total',
+                (('db', alias),))] = stats['wait_seconds_total']
+    return gauges
+
+
+def _dump(values):
+    return [[name, dict(labels), value]
+            for (name, labels), value in values.items()]
+
+
+def _load(items):
+    return {(name, tuple(sorted(labels.items()))): value
+            for name, labels, value in items}
+
+
+def _write(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush():
+    """ Write the snapshot of this process """
+    global _last_flush
+    _last_flush = time.monotonic()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write(os.path.join(METRICS_DIR, f'{os.getpid()}.json'), {
+        'values': _dump(_collect_process()),
+        'gauges': _dump(_gauges()),
+    })
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """ Values of all processes, gauges are labelled with the pid """
+    flush()
+    values = {}
+    gauges = {}
+    with open(os.path.join(METRICS_DIR, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead_path = os.path.join(METRICS_DIR, 'dead.json')
+        try:
+            with open(dead_path) as f:
+                dead = _load(json.load(f))
+        except (OSError, ValueError):
+            dead = {}
+        folded = []
+
+        for name in os.listdir(METRICS_DIR):
+            pid = name[:-len('.json')]
+            if not name.endswith('.json') or not pid.isdigit():
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _alive(int(pid)):
+                for key, value in _load(snapshot['values']).items():
+                    _add(values, key, value)
+                for (metric, labels), value in _load(
+                        snapshot['gauges']).items():
+                    gauges[(metric, labels + (('pid', pid),))] = value
+            else:
+                # the counters of a finished process are kept in dead.json
+                for key, value in _load(snapshot['values']).items():
+                    _add(dead, key, value)
+                folded.append(path)
+
+        if folded:
+            _write(dead_path, _dump(dead))
+            for path in folded:
+                os.remove(path)
+    for key, value in dead.items():
+        _add(values, key, value)
+    values.update(gauges)
+    return values
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def render():
+    """ All metrics in the Prometheus text format """
+    by_name = {}
+    for (name, labels), value in collect().items():
+        if name in METRICS:
+            by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(by_name.get(name, ())):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), value):
+                cumulative += count
+                lines.append(f'{name}_bucket'
+                             f'{_labels(labels, [("le", _number(bound))])}'
+                             f' {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+_missing = object()
+
+
+class MeteredCache:
+    """
+    Cache backend counting hits and misses of the wrapped backend:
+
+        'BACKEND': 'cinema.metrics.MeteredCache',
+        'WRAPPED_BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    """
+
+    def __init__(self, location, params):
+        params = dict(params)
+        backend = import_string(params.pop('WRAPPED_BACKEND'))
+        self._cache = backend(location, params)
+        self._name = params.get('METRICS_NAME', location or 'default')
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def _count(self, hits, misses):
+        if hits:
+            inc('cinema_cache_requests_total', hits,
+                cache=self._name, result='hit')
+        if misses:
+            inc('cinema_cache_requests_total', misses,
+                cache=self._name, result='miss')
+
+    def get(self, key, default=None, version=None):
+        value = self._cache.get(key, _missing, version=version)
+        if value is _missing:
+            self._count(0, 1)
+            return default
+        self._count(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = self._cache.get_many(keys, version=version)
+        self._count(len(values), len(keys) - len(values))
+        return values
+
+    def get_or_set(self, key, default, timeout=_missing, version=None):
+        value = self.get(key, _missing, version=version)
+        if value is not _missing:
+            return value
+        if timeout is _missing:
+            return self._cache.get_or_set(key, default, version=version)
+        return self._cache.get_or_set(key, default, timeout, version=version)
@@ -1,7 +1,22 @@
+import random
+import re
+import time
+
 from django.contrib.auth import logout
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import redirect
+from django.template.loader import render_to_string
 from datetime import datetime as dt
 
-from django_cinema.settings import SESSION_IDLE_TIMEOUT, DATATIME_FORMAT
+from cinema import metrics, rate_limit, waiting_room
+from cinema.db.async_utils import add_request_wrapper, \
+    remove_request_wrapper
+from cinema.profiling import RequestProfile
+from cinema.routers import replica_reads
+from cinema.slow_queries import current_view
+from django_cinema.settings import SESSION_IDLE_TIMEOUT, DATATIME_FORMAT, \
+    REPLICA_PIN_SECONDS, REPLICA_PIN_COOKIE, PROFILER_HEADER, \
+    PROFILER_SAMPLE_RATE, WAITING_ROOM_TOKEN_SECONDS, API_PATHS
 
 from django.utils.deprecation import MiddlewareMixin
 
@@ -17,3 +32,212 @@ class AutoLogout(MiddlewareMixin):
             if (now - last_action).seconds > SESSION_IDLE_TIMEOUT:
                 logout(request)
         request.session['last_action'] = now.strftime(DATATIME_FORMAT)
+
+
+class RateLimit(MiddlewareMixin):
+    """
+    Reject the clients over the RATE_LIMITS budgets with 429 before the
+    session, the authentication and the view run
+    """
+
+    def process_request(self, request):
+        limited = rate_limit.check(request)
+        if limited is None:
+            return None
+        rule, retry_after = limited
+        metrics.inc('cinema_rate_limited_total', rule=rule['name'],
+                    per=rule['per'])
+        message = f'Request was throttled. Expected available in ' \
+                  f'{retry_after} seconds.'
+        if 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+            response = HttpResponse(message, status=429,
+                                    content_type='text/plain')
+        else:
+            response = JsonResponse({'detail': message}, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+
+class WaitingRoom(MiddlewareMixin):
+    """
+    Queue the visitors of the sessions with a waiting room, see
+    cinema.waiting_room. Only the admitted ones reach the views.
+    """
+
+    def process_request(self, request):
+        rooms = waiting_room.protected_sessions()
+        if not rooms:
+            return None
+        session_id = waiting_room.requested_session(request)
+        if session_id not in rooms:
+            return None
+        admitted, position, wait, token = waiting_room.admit(
+            request, session_id, rooms[session_id])
+        if admitted:
+            if token:
+                metrics.inc('cinema_waiting_room_visitors_total',
+                            result='admitted')
+                request.waiting_room_token = (session_id, token)
+            return None
+
+        if token:
+            metrics.inc('cinema_waiting_room_visitors_total',
+                        result='queued')
+        response = self.waiting_page(request, session_id, position, wait,
+                                     token)
+        if wait:
+            response['Retry-After'] = str(wait)
+        if token:
+            self.set_token(response, session_id, token)
+        return response
+
+    def process_response(self, request, response):
+        if hasattr(request, 'waiting_room_token'):
+            self.set_token(response, *request.waiting_room_token)
+        return response
+
+    def waiting_page(self, request, session_id, position, wait, token):
+        # API clients and the EventSource of the seat events
+        if re.match(API_PATHS, request.path_info) or \
+                request.META.get('HTTP_ACCEPT') == 'text/event-stream':
+            return JsonResponse({
+                'detail': 'You are in the waiting room, retry later '
+                          'with the token.',
+                'position': position,
+                'wait': wait,
+                'token': token,
+            }, status=503)
+        if waiting_room.PURCHASE_PATHS.match(request.path_info):
+            # the refresh of the waiting page would GET the purchase URL,
+            # wait on the session page and pick the seats again from there
+            return redirect('session', pk=session_id)
+        return HttpResponse(render_to_string('waiting-room.html', {
+            'position': position,
+            'wait': wait,
+            'refresh': min(max(wait or 30, 5), 30),
+        }))
+
+    def set_token(self, response, session_id, token):
+        response['X-Waiting-Room-Token'] = token
+        response.set_cookie(waiting_room.cookie_name(session_id), token,
+                            max_age=WAITING_ROOM_TOKEN_SECONDS,
+                            httponly=True, samesite='Lax')
+
+
+class ReplicaRouting(MiddlewareMixin):
+    """
+    Allow replica reads for safe requests.
+    After a write (e.g. buying a ticket) the client reads from the primary
+    for REPLICA_PIN_SECONDS, so it always sees its own changes.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def process_request(self, request):
+        pinned = REPLICA_PIN_COOKIE in request.COOKIES
+        replica_reads.set(request.method in self.safe_methods and not pinned)
+
+    def process_response(self, request, response):
+        replica_reads.set(False)
+        if request.method not in self.safe_methods:
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1',
+                max_age=REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class RequestProfiler(MiddlewareMixin):
+    """
+    Profile requests of staff sent with the X-Profile header and
+    a PROFILER_SAMPLE_RATE share of all requests.
+    Profiles are listed for administrators at /profiles/.
+    """
+
+    def process_request(self, request):
+        if PROFILER_HEADER in request.META:
+            if not request.user.is_staff:
+                return
+        elif not PROFILER_SAMPLE_RATE or \
+                random.random() >= PROFILER_SAMPLE_RATE:
+            return
+        request.profile = RequestProfile(request)
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.render(response)
+        return response
+
+    def process_response(self, request, response):
+        profile = getattr(request, 'profile', None)
+        if profile is None:
+            return response
+        response['X-Profile-Id'] = profile.finish(response)['id']
+        return response
+
+
+class Metrics(MiddlewareMixin):
+    """
+    Latency, responses and SQL queries of every view and API action,
+    see cinema.metrics.
+    """
+
+    def process_request(self, request):
+        durations = request.sql_durations = []
+
+        def record_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                durations.append(time.perf_counter() - started)
+
+        request.record_query = record_query
+        add_request_wrapper(record_query)
+        request.metrics_started = time.perf_counter()
+
+    def process_response(self, request, response):
+        started = getattr(request, 'metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        remove_request_wrapper(request.record_query)
+
+        view, action = self.view_labels(request)
+        metrics.observe('cinema_http_request_duration_seconds', elapsed,
+                        view=view, action=action)
+        metrics.inc('cinema_http_responses_total', view=view, action=action,
+                    status=str(response.status_code))
+        for duration in request.sql_durations:
+            metrics.observe('cinema_sql_query_duration_seconds', duration,
+                            view=view)
+        metrics.observe('cinema_sql_queries_per_request',
+                        len(request.sql_durations), view=view)
+        metrics.maybe_flush()
+        return response
+
+    @staticmethod
+    def view_labels(request):
+        """ URL name and DRF action (or HTTP method) of the request """
+        method = request.method.lower()
+        match = request.resolver_match
+        if match is None:
+            # unknown paths share one label
+            return 'unresolved', method
+        actions = getattr(match.func, 'actions', None) or {}
+        return match.view_name, actions.get(method, method)
+
+
+class SlowQueryLog(MiddlewareMixin):
+    """
+    Tell cinema.slow_queries which view runs the queries of the request.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current_view.set(request.resolver_match.view_name)
+
+    def process_response(self, request, response):
+        current_view.set('')
+        return response
@@ -1,9 +1,32 @@
+import re
 from datetime import datetime as dt, date, timedelta
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField, SearchQuery, \
+    SearchRank, SearchVector
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connections, models
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Coalesce
+from django.db.models.query import ModelIterable
+from django.utils import timezone
 
-from django_cinema.settings import DURATION_OF_BREAKS
+from cinema import checkin, refcache
+from cinema.seating import validate_layout, layout_seats_count
+from django_cinema.settings import DURATION_OF_BREAKS, MOVIE_SEARCH_CONFIG, \
+    WAITING_ROOM_DEFAULT_RATE
+
+
+def update_search_vectors(queryset):
+    """ Update the full-text column of the movies (PostgreSQL only) """
+    if connections[queryset.db].vendor != 'postgresql':
+        return
+    queryset.update(search_vector=(
+        SearchVector('title', weight='A', config=MOVIE_SEARCH_CONFIG) +
+        SearchVector(Coalesce('director', Value('')), weight='B',
+                     config=MOVIE_SEARCH_CONFIG) +
+        SearchVector('description', weight='C', config=MOVIE_SEARCH_CONFIG)
+    ))
 
 
 class CinemaUser(AbstractUser):
@@ -36,10 +59,61 @@ class Room(models.Model):
     """
     title = models.CharField(max_length=120, unique=True)
     seats_count = models.PositiveIntegerField()
+    # rows, sections and seat types, see cinema.seating
+    layout = models.JSONField(null=True, blank=True,
+                              validators=[validate_layout])
+    # version of the cached session cards
+    modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'{self.title}  / {self.seats_count} seats'
 
+    def clean(self):
+        if self.layout:
+            try:
+                validate_layout(self.layout)
+            except ValidationError:
+                # reported by the field
+                return
+            count = layout_seats_count(self.layout)
+            if self.seats_count != count:
+                raise ValidationError(
+                    {'seats_count': f'The layout has {count} seats'})
+
+
+class MovieQuerySet(models.QuerySet):
+
+    def search(self, text):
+        """
+        Movies matching all words of text, the last one as a prefix,
+        best matches first
+        """
+        words = re.findall(r'\w+', text.lower())
+        if not words:
+            return self.none()
+        if connections[self.db].vendor != 'postgresql':
+            # no full-text index, match the title, director and description
+            queryset = self
+            for word in words:
+                queryset = queryset.filter(
+                    Q(title__icontains=word) | Q(director__icontains=word) |
+                    Q(description__icontains=word))
+            return queryset.order_by('title', 'id')
+
+        # prefix matching of every word, for search as you type
+        query = SearchQuery(' & '.join(f'{word}:*' for word in words),
+                            config=MOVIE_SEARCH_CONFIG, search_type='raw')
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', 'id')
+
+    def with_sessions_on(self, date):
+        return self.filter(Exists(Session.objects.filter(
+            movie=OuterRef('pk'),
+            date_start__lte=date,
+            date_finish__gte=date,
+        )))
+
 
 class Movie(models.Model):
     """
@@ -57,6 +131,22 @@ class Movie(models.Model):
         null=True,
         blank=True
     )
+    # version of the cached session cards
+    modified = models.DateTimeField(auto_now=True)
+    # title, director and description, updated by save()
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = MovieQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            models.Index(fields=['year']),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_search_vectors(Movie.objects.filter(pk=self.pk))
 
     @property
     def duration_format(self):
@@ -68,6 +158,29 @@ class Movie(models.Model):
         return f"{self.title} / {self.duration_format}"
 
 
+class ReferenceIterable(ModelIterable):
+    """ Sessions, or tickets with their sessions, with cached references """
+
+    def __iter__(self):
+        for obj in super().__iter__():
+            if isinstance(obj, Ticket):
+                if Ticket.session.field.is_cached(obj) and obj.session:
+                    refcache.attach(obj.session)
+            else:
+                refcache.attach(obj)
+            yield obj
+
+
+class ReferenceQuerySet(models.QuerySet):
+    """ Queryset of the sessions and the tickets """
+
+    def with_references(self):
+        """ Movies and rooms from cinema.refcache instead of the database """
+        clone = self._chain()
+        clone._iterable_class = ReferenceIterable
+        return clone
+
+
 class Session(models.Model):
     """
     Session
@@ -89,15 +202,25 @@ class Session(models.Model):
     date_start = models.DateField()
     date_finish = models.DateField(null=True, blank=True, )
     price = models.FloatField()
+    # queue the visitors of a premiere, see cinema.waiting_room
+    waiting_room = models.BooleanField(default=False)
+    # visitors let in per minute
+    admission_rate = models.PositiveIntegerField(
+        default=WAITING_ROOM_DEFAULT_RATE)
+    # version of the cached session cards
+    modified = models.DateTimeField(auto_now=True)
+
+    objects = ReferenceQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
+        movie = refcache.movie(self.movie_id)
         # the session does not change after buying tickets
         if self.session_tickets.count():
             raise ValidationError('The session has a ticket')
 
         # autofill the finish time field
         if not self.time_finish:
-            td = timedelta(minutes=self.movie.duration + DURATION_OF_BREAKS)
+            td = timedelta(minutes=movie.duration + DURATION_OF_BREAKS)
             time = dt.combine(date.min, self.time_start)
             self.time_finish = (time + td).time()
 
@@ -109,10 +232,10 @@ class Session(models.Model):
         finish = dt.combine(date.min, self.time_finish)
         start = dt.combine(date.min, self.time_start)
         session_duration = (finish - start).seconds // 60
-        if self.movie.duration > session_duration:
+        if movie.duration > session_duration:
             raise ValidationError(
-                f'session too short for {self.movie.title} movie. '
-                f'Should be more then {self.movie.duration_format}'
+                f'session too short for {movie.title} movie. '
+                f'Should be more then {movie.duration_format}'
             )
 
         super().save(*args, **kwargs)
@@ -141,6 +264,15 @@ class Ticket(models.Model):
     )
     date = models.DateField()
     seat_number = models.PositiveIntegerField()
+    # written in batches by cinema.checkin
+    checked_in_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ReferenceQuerySet.as_manager()
+
+    @property
+    def token(self):
+        """ Signed token of the QR code checked at the door """
+        return checkin.make_token(self)
 
     def save(self, *args, **kwargs):
         today = dt.now().date()
@@ -152,7 +284,8 @@ class Ticket(models.Model):
         )
         # the count of tickets should not exceed
         # the count of seats in the room
-        if day_session_tickets.count() >= self.session.room.seats_count:
+        room = refcache.room(self.session.room_id)
+        if day_session_tickets.count() >= room.seats_count:
             raise ValidationError('no more seats for new tickets')
 
         # ticket day must be in session period
@@ -174,9 +307,49 @@ class Ticket(models.Model):
         super().save(*args, **kwargs)
 
     class Meta:
+        # in PostgreSQL the table is range-partitioned by date,
+        # see the partition_tickets command
         unique_together = (("date", "session", "seat_number"),)
 
     def __str__(self):
         return f"{self.session.movie.title}  [{self.date} " \
                f"{self.session.time_start}] ( #{self.seat_number} )" \
                f" user: {self.user.get_full_name()}"
+
+
+class RevokedTicket(models.Model):
+    """
+    Deleted tickets of today and later, their tokens are refused at the
+    door, see cinema.checkin
+    """
+    ticket_id = models.PositiveIntegerField(unique=True)
+    date = models.DateField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'#{self.ticket_id} [{self.date}]'
+
+
+class SlowQuery(models.Model):
+    """
+    Queries slower than SLOW_QUERY_THRESHOLD_MS grouped by the normalized
+    SQL and the code running them, see cinema.slow_queries
+    """
+    fingerprint = models.CharField(max_length=32, unique=True)
+    sql = models.TextField()
+    params_shape = models.TextField(blank=True)
+    view = models.CharField(max_length=255, blank=True)
+    template = models.CharField(max_length=255, blank=True)
+    code = models.CharField(max_length=255, blank=True)
+    calls = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    @property
+    def avg_ms(self):
+        return self.total_ms / self.calls if self.calls else 0
+
+    def __str__(self):
+        return f'{self.calls} x {self.avg_ms:.1f} ms {self.sql[:80]}'
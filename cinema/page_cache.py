@@ -0,0 +1,75 @@
+"""
+Full-page cache of the public schedule (SessionsView, TomorrowSessionsView).
+
+The pages don't depend on the user, the user part of the header is
+loaded by the browser from /usernav/. Entries are keyed by the date,
+ordering, page and the schedule generation, which is bumped whenever a
+session, movie, room or ticket changes, see cinema.signals.
+
+The generation lives in the default cache, so it must be shared by the
+workers (e.g. memcached) for the invalidation to reach all of them.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+from cinema.cache import cached
+from django_cinema.settings import PAGE_CACHE_SECONDS
+
+GENERATION_KEY = 'schedule_generation'
+# pages with other query parameters are not cached
+CACHED_PARAMS = {'ordering', 'page'}
+
+
+def schedule_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # a lost generation must not bring back pages of an old one
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+def bump_schedule():
+    """ Drop the cached pages once the transaction commits """
+    transaction.on_commit(
+        lambda: cache.set(GENERATION_KEY, time.time_ns(), None))
+
+
+def page_key(request, name, date, ordering):
+    page = request.GET.get('page', '1')
+    return f'page:{name}:{date}:{ordering}:{page}:{schedule_generation()}'
+
+
+class NotCacheable(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def cached_page(request, key, build):
+    """
+    The cached page, or build() it. Only one request builds a missing
+    page, see cinema.cache.
+    """
+    if request.method != 'GET' or not set(request.GET) <= CACHED_PARAMS:
+        return build()
+    built = False
+
+    def render():
+        nonlocal built
+        built = True
+        response = build()
+        if response.status_code != 200:
+            raise NotCacheable(response)
+        response.render()
+        return response.content
+
+    try:
+        content = cached(key, render, PAGE_CACHE_SECONDS)
+    except NotCacheable as e:
+        return e.response
+    response = HttpResponse(content)
+    response['X-Page-Cache'] = 'miss' if built else 'hit'
+    return response
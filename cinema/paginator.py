@@ -0,0 +1,94 @@
+"""
+Pagination of big tables without COUNT(*).
+
+On PostgreSQL the number of rows comes from the planner: pg_class
+reltuples (summed over the partitions) for a whole table, the row
+estimate of EXPLAIN for a filtered queryset. Estimates below
+ESTIMATED_COUNT_THRESHOLD are replaced by an exact count, which is cheap
+there and keeps small lists exact. Templates show estimated counts as
+"about N", see pagination.html.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from django_cinema.settings import ESTIMATED_COUNT_THRESHOLD, \
+    COUNT_CACHE_SECONDS
+
+TABLE_ROWS_SQL = '''
+    SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint
+    FROM pg_class c
+    WHERE c.oid = %s::regclass AND c.relkind = 'r'
+       OR c.oid IN (SELECT inhrelid FROM pg_inherits
+                    WHERE inhparent = %s::regclass)
+'''
+
+
+def estimated_count(queryset):
+    """ Planner estimate of the rows of the queryset, None if unknown """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    query = queryset.query
+    with connection.cursor() as cursor:
+        if not query.where and not query.distinct and \
+                not query.is_sliced:
+            table = queryset.model._meta.db_table
+            cursor.execute(TABLE_ROWS_SQL, [table, table])
+        else:
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            return int(plan[0]['Plan']['Plan Rows'])
+        return cursor.fetchone()[0]
+
+
+def count_key(queryset):
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f'{sql}{params!r}'.encode()).hexdigest()
+    return f'count:{queryset.db}:{digest}'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting the planner estimate of big querysets, the last
+    pages may be a little off. Without estimates (other databases) big
+    counts are cached for COUNT_CACHE_SECONDS instead.
+
+    count_queryset, when given, is counted instead of the object list,
+    e.g. the list without its Count annotations.
+    """
+    # whether count is an estimate
+    estimated = False
+
+    def __init__(self, *args, count_queryset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_queryset = count_queryset
+
+    @cached_property
+    def count(self):
+        queryset = self.count_queryset
+        if queryset is None:
+            queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+
+        estimate = estimated_count(queryset)
+        if estimate is not None:
+            if estimate >= ESTIMATED_COUNT_THRESHOLD:
+                self.estimated = True
+                return estimate
+            return queryset.count()
+
+        key = count_key(queryset)
+        count = cache.get(key)
+        if count is not None:
+            self.estimated = True
+            return count
+        count = queryset.count()
+        if count >= ESTIMATED_COUNT_THRESHOLD:
+            cache.set(key, count, COUNT_CACHE_SECONDS)
+        return count
@@ -0,0 +1,130 @@
+"""
+Profiles of single requests, see cinema.middleware.RequestProfiler.
+
+A profile is a cProfile dump (<id>.prof) and a JSON summary (<id>.json)
+with the SQL queries and the template render time, in PROFILES_DIR.
+"""
+import io
+import json
+import os
+import time
+import uuid
+from datetime import datetime as dt
+
+from cinema.db.async_utils import add_request_wrapper, \
+    remove_request_wrapper
+from django_cinema.settings import PROFILES_DIR, PROFILES_KEEP
+
+# how many functions and queries are kept in the summary
+TOP_FUNCTIONS = 30
+TOP_QUERIES = 50
+
+
+class RequestProfile:
+    """ Python stack, SQL and template timings of one request """
+
+    def __init__(self, request):
+        # loaded by the first profiled request, not by every worker
+        import cProfile
+
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.started = dt.now()
+        self.queries = []
+        self.template_seconds = 0.0
+        self.profiler = cProfile.Profile()
+        self.start_time = time.perf_counter()
+        add_request_wrapper(self.record_query)
+        self.profiler.enable()
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (sql, time.perf_counter() - started,
+                 context['connection'].alias))
+
+    def render(self, response):
+        """ Render the template response, timing it """
+        started = time.perf_counter()
+        response.render()
+        self.template_seconds += time.perf_counter() - started
+
+    def finish(self, response):
+        """ Stop profiling and store the profile """
+        import pstats
+
+        self.profiler.disable()
+        total = time.perf_counter() - self.start_time
+        remove_request_wrapper(self.record_query)
+
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        self.profiler.dump_stats(profile_path(self.id, 'prof'))
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+        match = self.request.resolver_match
+        user = getattr(self.request, 'user', None)
+        slowest = sorted(self.queries, key=lambda q: q[1], reverse=True)
+        summary = {
+            'id': self.id,
+            'started': self.started.isoformat(timespec='seconds'),
+            'method': self.request.method,
+            'path': self.request.get_full_path(),
+            'view': match.view_name if match else None,
+            'user': user.username if user and user.is_authenticated
+            else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'sql_count': len(self.queries),
+            'sql_ms': round(sum(q[1] for q in self.queries) * 1000, 2),
+            'template_ms': round(self.template_seconds * 1000, 2),
+            'queries': [
+                {'sql': sql, 'ms': round(seconds * 1000, 2), 'db': alias}
+                for sql, seconds, alias in slowest[:TOP_QUERIES]
+            ],
+            'functions': stream.getvalue(),
+        }
+        with open(profile_path(self.id, 'json'), 'w') as f:
+            json.dump(summary, f)
+        prune_profiles()
+        return summary
+
+
+def profile_path(profile_id, extension):
+    return os.path.join(PROFILES_DIR, f'{profile_id}.{extension}')
+
+
+def list_profiles():
+    """ Summaries of the stored profiles, newest first """
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILES_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILES_DIR, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(profiles, key=lambda p: p['started'], reverse=True)
+
+
+def prune_profiles():
+    """ Keep the PROFILES_KEEP newest profiles """
+    names = [n for n in os.listdir(PROFILES_DIR) if n.endswith('.json')]
+    if len(names) <= PROFILES_KEEP:
+        return
+    paths = sorted((os.path.join(PROFILES_DIR, n) for n in names),
+                   key=os.path.getmtime)
+    for path in paths[:len(paths) - PROFILES_KEEP]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(f'{path[:-len(".json")]}.{extension}')
+            except OSError:
+                pass
@@ -0,0 +1,111 @@
+"""
+Sliding-window rate limits of RATE_LIMITS.
+
+cinema.middleware.RateLimit checks them before the session, the
+authentication and the views run, so a rejected request costs two cache
+round trips and no database or password hashing work.
+
+A rule counts the requests of a client address (per 'ip'), of a
+username (per 'user', from the Basic auth header or the form field of
+the rule, as sent by the client) or of a username from one address
+(per 'ip_user', so nobody can lock others out of their accounts) in
+fixed windows kept in the default cache. The client address is taken
+from X-Forwarded-For only when the request comes from TRUSTED_PROXIES.
+The count of the sliding window is the current window plus the
+previous one weighted by its part still inside the sliding window.
+The counters live in the shared default cache (memcached, see CACHES),
+so a budget holds across all the workers; with a process-local cache it
+would be multiplied by their number (check cinema.W001).
+"""
+import base64
+import binascii
+import hashlib
+import math
+import re
+import time
+
+from django.core.cache import cache
+
+from django_cinema.settings import RATE_LIMITS, TRUSTED_PROXIES
+
+RULES = [dict(rule, path=re.compile(rule['path'])) for rule in RATE_LIMITS]
+
+
+def client_ip(request):
+    """
+    Address of the client, the last one before the trusted proxies
+    in X-Forwarded-For. The addresses before it may be forged.
+    """
+    address = request.META.get('REMOTE_ADDR', '')
+    if address not in TRUSTED_PROXIES:
+        return address
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    for hop in reversed(forwarded.split(',')):
+        hop = hop.strip()
+        if not hop:
+            break
+        address = hop
+        if hop not in TRUSTED_PROXIES:
+            break
+    return address
+
+
+def basic_auth_username(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header[:6].lower() != 'basic ':
+        return ''
+    try:
+        decoded = base64.b64decode(header[6:]).decode('utf-8', 'replace')
+    except (binascii.Error, ValueError):
+        return ''
+    return decoded.partition(':')[0]
+
+
+def identity(rule, request):
+    if rule['per'] == 'ip':
+        return client_ip(request)
+    if rule.get('field'):
+        username = request.POST.get(rule['field'], '')
+    else:
+        username = basic_auth_username(request)
+    if rule['per'] == 'ip_user' and username:
+        return f'{client_ip(request)} {username}'
+    return username
+
+
+def hit(rule, ident):
+    """ Count a request, the seconds to wait if it is over the limit """
+    window = rule['seconds']
+    index, elapsed = divmod(time.time(), window)
+    digest = hashlib.md5(ident.encode()).hexdigest()
+    key = f'ratelimit:{rule["name"]}:{rule["per"]}:{digest}'
+    current_key = f'{key}:{int(index)}'
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        cache.add(current_key, 0, window * 2)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            # the cache is unreachable, don't lock everybody out
+            return None
+    previous = cache.get(f'{key}:{int(index) - 1}', 0)
+    if previous * (1 - elapsed / window) + current <= rule['requests']:
+        return None
+    return max(1, math.ceil(window - elapsed))
+
+
+def check(request):
+    """ (rule, seconds to wait) of the first exceeded limit, or None """
+    for rule in RULES:
+        if rule['methods'] and request.method not in rule['methods']:
+            continue
+        if not rule['path'].match(request.path_info):
+            continue
+        ident = identity(rule, request)
+        if not ident:
+            continue
+        retry_after = hit(rule, ident)
+        if retry_after is not None:
+            return rule, retry_after
+    return None
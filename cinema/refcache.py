@@ -0,0 +1,94 @@
+"""
+In-process cache of the reference data: movies and rooms.
+
+Both tables are small and rarely change, so every process keeps all
+their rows and resolves Session.movie and Session.room from them
+instead of joins and lazy loads (ReferenceQuerySet.with_references(),
+ReferenceField of the API). The cached objects are shared, treat them
+as read-only.
+
+A change of a movie or a room (cinema.signals) drops the copy of the
+process and, once committed, bumps a version in the default cache. The
+other processes compare that version at most every REFCACHE_CHECK_SECONDS
+and reload on a change, so the cache must be shared by the workers (e.g.
+memcached) for them to see the changes.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from django_cinema.settings import REFCACHE_CHECK_SECONDS
+
+VERSION_KEY = 'refcache_version'
+
+# table name -> {id: object}
+_tables = {}
+_version = None
+_checked = 0.0
+
+
+def _querysets():
+    from cinema.models import Movie, Room
+
+    # the search vector is only needed by the search
+    return {'movie': Movie.objects.defer('search_vector'),
+            'room': Room.objects.all()}
+
+
+def _check_version():
+    global _version, _checked
+    now = time.monotonic()
+    if now - _checked < REFCACHE_CHECK_SECONDS:
+        return
+    _checked = now
+    version = cache.get(VERSION_KEY)
+    if version != _version:
+        _tables.clear()
+        _version = version
+
+
+def _table(name):
+    _check_version()
+    rows = _tables.get(name)
+    if rows is None:
+        rows = _tables[name] = {obj.pk: obj for obj in _querysets()[name]}
+    return rows
+
+
+def _get(name, pk):
+    if pk is None:
+        return None
+    rows = _table(name)
+    obj = rows.get(pk)
+    if obj is None:
+        # added by another process since the table was loaded
+        obj = _querysets()[name].filter(pk=pk).first()
+        if obj is not None:
+            rows[pk] = obj
+    return obj
+
+
+def movie(pk):
+    return _get('movie', pk)
+
+
+def room(pk):
+    return _get('room', pk)
+
+
+def attach(session):
+    """ Set the movie and the room of the session from the cache """
+    for name in ('movie', 'room'):
+        field = session._meta.get_field(name)
+        if not field.is_cached(session):
+            field.set_cached_value(
+                session, _get(name, getattr(session, field.attname)))
+    return session
+
+
+def changed(name):
+    """ A movie or a room was saved or deleted """
+    _tables.pop(name, None)
+    transaction.on_commit(
+        lambda: cache.set(VERSION_KEY, time.time_ns(), None))
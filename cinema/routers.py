@@ -0,0 +1,80 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.db import connections
+
+from django_cinema.settings import DATABASE_REPLICAS, REPLICA_MAX_LAG, \
+    REPLICA_LAG_CHECK_INTERVAL
+
+# set by cinema.middleware.ReplicaRouting for the current request
+replica_reads = ContextVar('replica_reads', default=False)
+
+# alias -> (checked at, lag in seconds or None if the replica is unusable)
+_replica_lag = {}
+
+
+def get_replica_lag(alias):
+    """
+    Replication lag of the replica in seconds, None if it can't be used.
+    The value is cached for REPLICA_LAG_CHECK_INTERVAL seconds.
+    """
+    now = time.monotonic()
+    checked, lag = _replica_lag.get(alias, (None, None))
+    if checked is not None and now - checked < REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+
+    try:
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # zero lag for an idle replica with nothing left to replay
+                cursor.execute(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = "
+                    "pg_last_wal_replay_lsn() THEN 0 ELSE EXTRACT(EPOCH "
+                    "FROM now() - pg_last_xact_replay_timestamp()) END"
+                )
+                row = cursor.fetchone()
+                lag = float(row[0]) if row and row[0] is not None else 0.0
+            else:
+                cursor.execute('SELECT 1')
+                lag = 0.0
+    except Exception:
+        lag = None
+
+    _replica_lag[alias] = (now, lag)
+    return lag
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads of safe requests to a replica, everything else to default.
+
+    Replicas lagging more than REPLICA_MAX_LAG seconds are skipped.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not DATABASE_REPLICAS or not replica_reads.get():
+            return 'default'
+
+        # reads inside a transaction on the primary must see its writes
+        if connections['default'].in_atomic_block:
+            return 'default'
+
+        replicas = list(DATABASE_REPLICAS)
+        random.shuffle(replicas)
+        for alias in replicas:
+            lag = get_replica_lag(alias)
+            if lag is not None and lag <= REPLICA_MAX_LAG:
+                return alias
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
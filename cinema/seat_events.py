@@ -0,0 +1,294 @@
+"""
+Live seat availability over Server-Sent Events.
+
+Purchases and refunds are published with PostgreSQL NOTIFY, so every
+process sees them once the transaction commits. Each ASGI process keeps
+one LISTEN connection and fans the events out to its subscribers:
+
+    GET /session/<pk>/seats/events/?date=YYYY-MM-DD
+
+The streams are served outside of Django's middleware, the rate limits
+(cinema.middleware.RateLimit) and the waiting room of the session
+(cinema.middleware.WaitingRoom) are checked before a stream starts.
+Snapshots of the taken seats come from the cached bought_seats().
+"""
+import asyncio
+import io
+import json
+import re
+from datetime import datetime as dt
+from urllib.parse import parse_qs
+
+import psycopg2
+from psycopg2 import extensions
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+
+from cinema.cache import cached, invalidate
+from cinema.db.async_utils import run_query
+from cinema.middleware import RateLimit, WaitingRoom
+from cinema.models import Ticket
+from django_cinema.settings import DATE_REGEXP, SEAT_EVENTS_CHANNEL, \
+    SEAT_EVENTS_KEEPALIVE, SEAT_EVENTS_QUEUE_SIZE, SEATS_CACHE_SECONDS
+
+EVENTS_PATH = re.compile(r'^/session/(\d+)/seats/events/$')
+
+
+def seats_key(session_id, date):
+    return f'seats:{session_id}:{date}'
+
+
+def bought_seats(session_id, date):
+    """
+    Seats sold for the session day as shown on the session page, cached
+    until the next publish(). Purchases check the database instead.
+    """
+    return cached(seats_key(session_id, date),
+                  lambda: set(_taken_seats(session_id, date)),
+                  SEATS_CACHE_SECONDS)
+
+
+def publish(session_id, date, taken=(), freed=()):
+    """ Publish seats taken or freed on the session day """
+    transaction.on_commit(lambda: invalidate(seats_key(session_id, date)))
+    payload = json.dumps({
+        'session': session_id,
+        'date': str(date),
+        'taken': sorted(taken),
+        'freed': sorted(freed),
+    })
+    if connection.vendor == 'postgresql':
+        # delivered by PostgreSQL when the transaction commits
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)',
+                           [SEAT_EVENTS_CHANNEL, payload])
+    else:
+        # without NOTIFY only the subscribers of this process are reached
+        transaction.on_commit(lambda: hub.dispatch_threadsafe(payload))
+
+
+class SeatEventHub:
+    """
+    Fan-out of seat events to the subscribers of this process
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.subscribers = {}
+        self.listener = None
+        # the LISTEN connection is open or being opened
+        self.listening = False
+
+    def subscribe(self, session_id, date):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        if not self.listening and \
+                connections['default'].vendor == 'postgresql':
+            self.listening = True
+            self.loop.create_task(self.listen())
+        queue = asyncio.Queue(SEAT_EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault((session_id, date), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, session_id, date, queue):
+        queues = self.subscribers.get((session_id, date))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[(session_id, date)]
+
+    def dispatch(self, payload):
+        event = json.loads(payload)
+        key = (event['session'], event['date'])
+        for queue in self.subscribers.get(key, ()):
+            self.put(queue, event)
+
+    def put(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a stuck client gets a fresh snapshot instead of the backlog
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({'resync': True})
+
+    def dispatch_threadsafe(self, payload):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.dispatch, payload)
+
+    def resync_all(self):
+        for queues in self.subscribers.values():
+            for queue in queues:
+                self.put(queue, {'resync': True})
+
+    def listen_later(self):
+        self.loop.call_later(1, lambda: self.loop.create_task(self.listen()))
+
+    async def listen(self):
+        """ Open the LISTEN connection of the process """
+        params = connections['default'].get_connection_params()
+        try:
+            # connecting blocks, not in the event loop
+            self.listener = await self.loop.run_in_executor(
+                None, _connect_listener, params)
+        except psycopg2.Error:
+            self.listen_later()
+            return
+        self.loop.add_reader(self.listener.fileno(), self.on_notify)
+        # events before LISTEN are lost, the subscribers get a new snapshot
+        self.resync_all()
+
+    def on_notify(self):
+        try:
+            self.listener.poll()
+        except psycopg2.Error:
+            # reconnect, subscribers get a new snapshot
+            self.loop.remove_reader(self.listener.fileno())
+            self.listener.close()
+            self.listener = None
+            self.resync_all()
+            self.listen_later()
+            return
+        while self.listener.notifies:
+            self.dispatch(self.listener.notifies.pop(0).payload)
+
+
+def _connect_listener(params):
+    listener = psycopg2.connect(**params)
+    try:
+        listener.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {SEAT_EVENTS_CHANNEL}')
+    except psycopg2.Error:
+        listener.close()
+        raise
+    return listener
+
+
+hub = SeatEventHub()
+
+
+def _taken_seats(session_id, date):
+    return sorted(Ticket.objects.filter(
+        session_id=session_id, date=date).values_list(
+        'seat_number', flat=True))
+
+
+def _taken_snapshot(session_id, date):
+    return sorted(bought_seats(session_id, date))
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+def _no_view(request):
+    return None
+
+
+_rate_limit = RateLimit(_no_view)
+_waiting_room = WaitingRoom(_no_view)
+
+
+def _admission(request, response):
+    """
+    The response refusing the stream (rate limit, waiting room), None
+    if it may start with response
+    """
+    refused = _rate_limit.process_request(request) or \
+        _waiting_room.process_request(request)
+    if refused is not None:
+        return refused
+    # a visitor let in now gets the token of the admission
+    _waiting_room.process_response(request, response)
+    return None
+
+
+async def _start(send, response):
+    """ Send the status and the headers of the Django response """
+    headers = [(header.encode('ascii'), value.encode('latin1'))
+               for header, value in response.items()]
+    headers.extend(
+        (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+        for cookie in response.cookies.values())
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': headers,
+    })
+
+
+async def stream_seat_events(scope, receive, send, session_id):
+    query = parse_qs(scope['query_string'].decode())
+    date = query.get('date', [''])[0]
+    if not re.match(DATE_REGEXP, date):
+        date = str(dt.now().date())
+
+    response = HttpResponse(content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    refused = await run_query(
+        _admission, ASGIRequest(scope, io.BytesIO()), response)
+    if refused is not None:
+        await _start(send, refused)
+        await send({'type': 'http.response.body', 'body': refused.content})
+        return
+    await _start(send, response)
+
+    # subscribe first, so nothing is lost between snapshot and events
+    queue = hub.subscribe(session_id, date)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        taken = await run_query(_taken_snapshot, session_id, date)
+        await _send(send, _sse('snapshot', {'taken': taken}))
+        while not disconnected.done():
+            get_event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                [get_event, disconnected],
+                timeout=SEAT_EVENTS_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED)
+            if get_event not in done:
+                get_event.cancel()
+                if not disconnected.done():
+                    await _send(send, b': keepalive\n\n')
+                continue
+            event = get_event.result()
+            if event.get('resync'):
+                taken = await run_query(_taken_snapshot, session_id, date)
+                await _send(send, _sse('snapshot', {'taken': taken}))
+            else:
+                await _send(send, _sse('seats', {
+                    'taken': event['taken'],
+                    'freed': event['freed'],
+                }))
+    finally:
+        hub.unsubscribe(session_id, date, queue)
+        disconnected.cancel()
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _send(send, body):
+    await send({'type': 'http.response.body', 'body': body,
+                'more_body': True})
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def seat_events_app(application):
+    """ Serve the seat event streams, pass other requests to application """
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'http':
+            match = EVENTS_PATH.match(scope['path'])
+            if match:
+                return await stream_seat_events(
+                    scope, receive, send, int(match.group(1)))
+        return await application(scope, receive, send)
+
+    return app
@@ -0,0 +1,173 @@
+"""
+Seat layout of the rooms and the best-available seats finder.
+
+Room.layout lists the rows from the screen to the back:
+
+    [{"row": "A", "section": "Stalls", "seats": "SSSS.SSSSSS.SSSS"},
+     {"row": "B", "section": "Stalls", "seats": "VVVV.VVVVVV.VVVV"}]
+
+Every character of seats is a seat of a type in SEAT_TYPES, '.' is an
+aisle. Seats keep their numbers, 1 to seats_count across the rows, so the
+tickets don't change. Rooms without a layout are rows of
+DEFAULT_ROW_SEATS standard seats.
+
+best_seats() finds n adjacent free seats of one type nearest to the best
+spot of the room. The blocks of n seats are computed once per layout and
+kept sorted by distance, a lookup checks them against a bytearray of the
+taken seats and stops at the first free one.
+"""
+from array import array
+
+from django.core.exceptions import ValidationError
+
+from django_cinema.settings import DEFAULT_ROW_SEATS, BEST_ROW_POSITION, \
+    BEST_SEATS_MAX
+
+STANDARD = 'S'
+SEAT_TYPES = {STANDARD: 'standard', 'V': 'VIP', 'W': 'wheelchair'}
+AISLE = '.'
+# a row away from the best one costs as much as this many seats aside
+ROW_WEIGHT = 2
+
+# room id -> (room.modified, RoomLayout)
+_layouts = {}
+
+
+def row_name(index):
+    """ A, B, ... Z, AA, AB, ... """
+    name = ''
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        name = chr(ord('A') + letter) + name
+    return name
+
+
+def default_layout(seats_count):
+    rows = []
+    for index, start in enumerate(range(0, seats_count, DEFAULT_ROW_SEATS)):
+        count = min(DEFAULT_ROW_SEATS, seats_count - start)
+        rows.append({'row': row_name(index), 'seats': STANDARD * count})
+    return rows
+
+
+def layout_seats_count(layout):
+    return sum(len(row['seats'].replace(AISLE, '')) for row in layout)
+
+
+def validate_layout(layout):
+    """ Validator of Room.layout """
+    if not isinstance(layout, list) or not layout:
+        raise ValidationError('The layout must be a list of rows')
+    for index, row in enumerate(layout):
+        if not isinstance(row, dict) or \
+                not isinstance(row.get('seats'), str):
+            raise ValidationError(
+                f'Row {index + 1} must be an object with a seats string')
+        unknown = set(row['seats']) - set(SEAT_TYPES) - {AISLE}
+        if unknown:
+            raise ValidationError(
+                f'Row {index + 1} has unknown seat types: '
+                f'{", ".join(sorted(unknown))}')
+    if not layout_seats_count(layout):
+        raise ValidationError('The layout has no seats')
+
+
+class RoomLayout:
+    """
+    Rows of a room with the row, the number in the row and the type of
+    every seat, indexed by the seat number
+    """
+
+    def __init__(self, layout):
+        self.rows = []
+        self.seat_row = array('H', [0])
+        self.seat_place = array('H', [0])
+        types = [AISLE]
+        # (row index, column of the first seat, seat types) of the
+        # stretches of adjacent seats of one type
+        self.runs = []
+        for index, row in enumerate(layout):
+            name = str(row.get('row') or row_name(index))
+            seats = row['seats']
+            self.rows.append((name, row.get('section', ''), len(seats)))
+            place = 0
+            run_start = None
+            for column, seat_type in enumerate(seats + AISLE):
+                if run_start is not None and \
+                        seat_type != seats[run_start]:
+                    self.runs.append((index, run_start, len(types) - (
+                        column - run_start), seats[run_start:column]))
+                    run_start = None
+                if seat_type == AISLE:
+                    continue
+                if run_start is None:
+                    run_start = column
+                place += 1
+                self.seat_row.append(index)
+                self.seat_place.append(place)
+                types.append(seat_type)
+        self.seat_types = ''.join(types)
+        self.seats_count = len(types) - 1
+        self.labels = [''] + [self._label(seat)
+                              for seat in range(1, self.seats_count + 1)]
+        self._blocks = {}
+
+    @classmethod
+    def for_room(cls, room):
+        """ Layout of the room, built once per version of the room """
+        cached = _layouts.get(room.pk)
+        if cached is not None and cached[0] == room.modified:
+            return cached[1]
+        layout = cls(room.layout or default_layout(room.seats_count))
+        _layouts[room.pk] = (room.modified, layout)
+        return layout
+
+    def label(self, seat):
+        """ Row and place of the seat, e.g. 'C12' or 'A3 VIP' """
+        return self.labels[seat]
+
+    def _label(self, seat):
+        label = f'{self.rows[self.seat_row[seat]][0]}' \
+                f'{self.seat_place[seat]}'
+        if self.seat_types[seat] != STANDARD:
+            label += f' {SEAT_TYPES[self.seat_types[seat]]}'
+        return label
+
+    def types(self):
+        """ (code, name) of the seat types of the room """
+        return [(code, name) for code, name in SEAT_TYPES.items()
+                if code in self.seat_types]
+
+    def blocks(self, n, seat_type=STANDARD):
+        """ First seats of the blocks of n adjacent seats, best first """
+        key = (n, seat_type)
+        if key not in self._blocks:
+            best_row = (len(self.rows) - 1) * BEST_ROW_POSITION
+            scored = []
+            for index, column, first_seat, types in self.runs:
+                if types[0] != seat_type:
+                    continue
+                middle = (self.rows[index][2] - 1) / 2
+                row_distance = abs(index - best_row) * ROW_WEIGHT
+                for offset in range(len(types) - n + 1):
+                    centre = column + offset + (n - 1) / 2
+                    scored.append((row_distance + abs(centre - middle),
+                                   first_seat + offset))
+            scored.sort()
+            self._blocks[key] = array('H', (seat for _, seat in scored))
+        return self._blocks[key]
+
+    def best_seats(self, taken, n, seat_type=STANDARD):
+        """ The best n adjacent seats not in taken, [] if there are none """
+        if not 0 < n <= BEST_SEATS_MAX or seat_type not in SEAT_TYPES:
+            return []
+        occupied = bytearray(self.seats_count + 1)
+        for seat in taken:
+            if 0 < seat <= self.seats_count:
+                occupied[seat] = 1
+        find = occupied.find
+        for first in self.blocks(n, seat_type):
+            if find(1, first, first + n) < 0:
+                return list(range(first, first + n))
+        return []
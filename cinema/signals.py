@@ -0,0 +1,86 @@
+from django.core.signals import request_finished
+from django.db import close_old_connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from cinema import checkin, refcache, seat_events, slow_queries, snapshots, \
+    waiting_room
+from cinema.API.renderers import bump_collection
+from cinema.models import Movie, Room, Session, Ticket
+from cinema.page_cache import bump_schedule
+
+
+# TicketsBuyView uses bulk_create and publishes the seats itself
+@receiver(post_save, sender=Ticket)
+def ticket_saved(sender, instance, created, **kwargs):
+    if created:
+        seat_events.publish(instance.session_id, instance.date,
+                            taken=[instance.seat_number])
+    bump_schedule()
+
+
+@receiver(post_delete, sender=Ticket)
+def ticket_deleted(sender, instance, **kwargs):
+    seat_events.publish(instance.session_id, instance.date,
+                        freed=[instance.seat_number])
+    checkin.revoke(instance)
+    bump_schedule()
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Session)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Room)
+def schedule_changed(sender, **kwargs):
+    bump_schedule()
+    # the session lists of the API nest movies and rooms
+    bump_collection('sessions')
+    snapshots.changed()
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Room)
+def reference_changed(sender, **kwargs):
+    refcache.changed(sender._meta.model_name)
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def session_changed(sender, **kwargs):
+    waiting_room.sessions_changed()
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # the wrapper list outlives the database connection, add it once
+    if slow_queries.log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, slow_queries.log_slow_queries)
+
+
+@receiver(request_finished)
+def save_slow_queries(sender, **kwargs):
+    slow_queries.save_pending()
+
+
+# the response is sent by then, the client doesn't wait for the pages
+@receiver(request_finished)
+def publish_snapshots(sender, **kwargs):
+    snapshots.publish_pending()
+
+
+@receiver(request_finished)
+def save_admissions(sender, **kwargs):
+    checkin.save_pending()
+
+
+# the receivers above write to the database once the request is finished,
+# after Django returned the connections of the request to the pool; run
+# its handler again last, or the connections they reopen keep a pool slot
+# until the thread serves another request
+request_finished.disconnect(close_old_connections)
+request_finished.connect(close_old_connections)
@@ -0,0 +1,174 @@
+"""
+Slow-query log with the code that ran the query.
+
+Every connection runs its queries through log_slow_queries. Queries
+slower than SLOW_QUERY_THRESHOLD_MS are kept with the view of the
+request, the template line being rendered and the first frame of the
+project, so lazy queries of templates and __str__ methods can be found.
+They are written to SlowQuery, grouped by fingerprint, when the request
+finishes. The report is at /slowqueries/.
+"""
+import atexit
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from django_cinema.settings import BASE_DIR, SLOW_QUERY_THRESHOLD_MS, \
+    SLOW_QUERY_MAX_PENDING
+
+# set by cinema.middleware.SlowQueryLog for the current request
+current_view = ContextVar('current_view', default='')
+
+PROJECT_DIR = os.path.join(str(BASE_DIR), '')
+# frames of these files are not the origin of a query
+SKIPPED_FILES = (__file__, os.path.join(PROJECT_DIR, 'cinema', 'db', ''),
+                 os.path.join(PROJECT_DIR, 'cinema', 'middleware.py'),
+                 os.path.join(PROJECT_DIR, 'cinema', 'profiling.py'))
+
+_pending = []
+_pending_lock = threading.Lock()
+_saving = threading.local()
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    """ Execute wrapper recording the queries above the threshold """
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        if ms >= SLOW_QUERY_THRESHOLD_MS and \
+                not getattr(_saving, 'active', False):
+            _record(sql, params, many, ms)
+
+
+def _record(sql, params, many, ms):
+    template, code = call_site(sys._getframe(2))
+    normalized = normalize(sql)
+    shape = params_shape(params, many)
+    view = current_view.get()
+    fingerprint = hashlib.md5(
+        '\0'.join((normalized, template, code)).encode()).hexdigest()
+    with _pending_lock:
+        if len(_pending) < SLOW_QUERY_MAX_PENDING:
+            _pending.append(
+                (fingerprint, normalized, shape, view, template, code, ms))
+
+
+def call_site(frame):
+    """ Template line and project code line the query comes from """
+    template = code = ''
+    while frame is not None and not (template and code):
+        if not template and frame.f_code.co_name == 'render_annotated':
+            # the innermost template node being rendered
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = f'{origin.template_name}:{token.lineno}'
+        filename = frame.f_code.co_filename
+        if not code and filename.startswith(PROJECT_DIR) and \
+                not filename.startswith(SKIPPED_FILES) and \
+                'site-packages' not in filename:
+            code = f'{filename[len(PROJECT_DIR):]}:{frame.f_lineno} ' \
+                   f'in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return template, code
+
+
+LITERALS = re.compile(r"'(?:''|[^'])*'|\b\d+(?:\.\d+)?\b|%s")
+VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACES = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """ SQL with literals and placeholders replaced by ? """
+    sql = LITERALS.sub('?', sql)
+    sql = VALUE_LISTS.sub('(?, ...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+def params_shape(params, many):
+    """ Types of the parameters, e.g. 'int, date, int x 3' """
+    if many:
+        params = list(params)
+        first = params[0] if params else ()
+        return f'{len(params)} x ({params_shape(first, False)})'
+    if params is None:
+        return ''
+    if isinstance(params, dict):
+        return ', '.join(f'{key}: {type(value).__name__}'
+                         for key, value in params.items())
+    groups = []
+    for param in params:
+        name = type(param).__name__
+        if groups and groups[-1][0] == name:
+            groups[-1][1] += 1
+        else:
+            groups.append([name, 1])
+    return ', '.join(name if n == 1 else f'{name} x {n}'
+                     for name, n in groups)
+
+
+def save_pending():
+    """ Add the recorded queries to SlowQuery """
+    from cinema.models import SlowQuery
+
+    with _pending_lock:
+        pending = _pending[:]
+        del _pending[:]
+    if not pending:
+        return
+
+    grouped = {}
+    for fingerprint, sql, shape, view, template, code, ms in pending:
+        item = grouped.setdefault(fingerprint, {
+            'sql': sql, 'params_shape': shape, 'template': template,
+            'code': code, 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        item['view'] = view
+        item['calls'] += 1
+        item['total_ms'] += ms
+        item['max_ms'] = max(item['max_ms'], ms)
+
+    _saving.active = True
+    try:
+        now = timezone.now()
+        for fingerprint, item in grouped.items():
+            updated = SlowQuery.objects.filter(
+                fingerprint=fingerprint).update(
+                calls=F('calls') + item['calls'],
+                total_ms=F('total_ms') + item['total_ms'],
+                max_ms=Greatest('max_ms', item['max_ms']),
+                params_shape=item['params_shape'],
+                view=item['view'],
+                last_seen=now)
+            if updated:
+                continue
+            try:
+                with transaction.atomic():
+                    SlowQuery.objects.create(fingerprint=fingerprint, **item)
+            except IntegrityError:
+                # created by another worker in the meantime
+                SlowQuery.objects.filter(fingerprint=fingerprint).update(
+                    calls=F('calls') + item['calls'],
+                    total_ms=F('total_ms') + item['total_ms'],
+                    max_ms=Greatest('max_ms', item['max_ms']),
+                    last_seen=now)
+    except DatabaseError:
+        # the log must never break a request
+        pass
+    finally:
+        _saving.active = False
+
+
+# queries of management commands are saved when they exit
+atexit.register(save_pending)
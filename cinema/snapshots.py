@@ -0,0 +1,139 @@
+"""
+Static snapshots of the public schedule for nginx (or a CDN) to serve.
+
+The schedule of today and tomorrow is the same for everybody, so it is
+rendered to files under SNAPSHOT_ROOT:
+
+    index.html                  /                     SessionsView
+    tomorrow/index.html         /tomorrow/            TomorrowSessionsView
+    today_session_api.json      /today_session_api/   TodaySessionViewSet
+
+Only the URLs without query parameters are published, other pages and
+clients asking for MessagePack still reach Django. Files are replaced
+atomically, nginx never serves a half written one.
+
+A process that changed a session, movie or room republishes once its
+request is finished (cinema.signals). The publish_schedule command
+republishes every SNAPSHOT_SECONDS, at the date rollover and when
+another process changed the sessions, which also refreshes the counts of
+sold tickets and drops the started sessions of today. nginx falls back
+to Django when a file is missing:
+
+    # only JSON clients get the file, browsers (the browsable API) and
+    # MessagePack clients reach Django
+    map $http_accept $schedule_api {
+        default             none;
+        ""                  today_session_api.json;
+        "*/*"               today_session_api.json;
+        ~^application/json  today_session_api.json;
+    }
+    server {
+        location = / {
+            root /srv/cinema/snapshots;
+            try_files /index.html$is_args @django;
+        }
+        location = /tomorrow/ {
+            root /srv/cinema/snapshots;
+            try_files /tomorrow/index.html$is_args @django;
+        }
+        location = /today_session_api/ {
+            root /srv/cinema/snapshots;
+            try_files /$schedule_api$is_args @django;
+        }
+        location @django {
+            proxy_pass http://django;
+        }
+    }
+"""
+import os
+import tempfile
+import threading
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.http import HttpRequest
+
+from django_cinema.settings import SNAPSHOT_ROOT, SNAPSHOT_HOST
+
+_pending = threading.Event()
+
+
+def _request(path, accept):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = path
+    request.META = {
+        'SERVER_NAME': SNAPSHOT_HOST,
+        'SERVER_PORT': '80',
+        'HTTP_HOST': SNAPSHOT_HOST,
+        'HTTP_ACCEPT': accept,
+    }
+    request.user = AnonymousUser()
+    return request
+
+
+def _snapshots():
+    """ (file, view, path, accepted media type) of the snapshots """
+    from cinema.API.resources import TodaySessionViewSet
+    from cinema.views import SessionsView, TomorrowSessionsView
+
+    return [
+        ('index.html', SessionsView.as_view(), '/', 'text/html'),
+        ('tomorrow/index.html', TomorrowSessionsView.as_view(),
+         '/tomorrow/', 'text/html'),
+        ('today_session_api.json',
+         TodaySessionViewSet.as_view({'get': 'list'}),
+         '/today_session_api/', 'application/json'),
+    ]
+
+
+def write_atomic(path, content):
+    """ Write the file under a temporary name and rename it """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by its owner only
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def publish():
+    """
+    Render the snapshots, returns {file: size}. A page that can't be
+    rendered is removed, nginx passes its requests to Django then.
+    """
+    _pending.clear()
+    published = {}
+    if not SNAPSHOT_ROOT:
+        return published
+    for name, view, path, accept in _snapshots():
+        target = os.path.join(SNAPSHOT_ROOT, name)
+        response = view(_request(path, accept))
+        if hasattr(response, 'render'):
+            response.render()
+        if response.status_code != 200:
+            if os.path.exists(target):
+                os.unlink(target)
+            continue
+        write_atomic(target, response.content)
+        published[name] = len(response.content)
+    return published
+
+
+def changed():
+    """ The schedule changed, republish once the request is finished """
+    if SNAPSHOT_ROOT:
+        transaction.on_commit(_pending.set)
+
+
+def publish_pending():
+    if _pending.is_set():
+        publish()
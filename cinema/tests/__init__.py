@@ -0,0 +1,24 @@
+from datetime import datetime as dt, time, timedelta
+
+from cinema.models import CinemaUser, Movie, Room, Session
+
+# the tests need no memcached server
+LOCAL_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_session(title='Red', seats_count=50, time_start=time(21, 30),
+                   **kwargs):
+    """ A session of today to the day after tomorrow """
+    today = dt.now().date()
+    room = Room.objects.create(title=title, seats_count=seats_count)
+    movie = Movie.objects.create(title='Alien', duration=100,
+                                 director='Scott', year=1979)
+    return Session.objects.create(
+        movie=movie, room=room, time_start=time_start, date_start=today,
+        date_finish=today + timedelta(days=2), price=5, **kwargs)
+
+
+def create_user(username='bob', **kwargs):
+    return CinemaUser.objects.create_user(
+        username, password='pw12345x!', phone='1', **kwargs)
@@ -0,0 +1,47 @@
+from datetime import datetime as dt
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from cinema.models import Ticket
+from cinema.tests import LOCAL_CACHE, create_session, create_user
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class TicketAdminTests(TestCase):
+    def setUp(self):
+        self.session = create_session()
+        self.client.force_login(create_user(
+            'admin', is_staff=True, is_superuser=True))
+
+    def buy(self, *seats):
+        for seat in seats:
+            Ticket.objects.create(
+                session=self.session, user=create_user(f'buyer{seat}'),
+                date=dt.now().date(), seat_number=seat)
+
+    def changelist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/cinema/ticket/')
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def test_queries_independent_of_rows(self):
+        self.buy(1, 2)
+        # caches the list of the waiting rooms
+        self.changelist()
+        few = self.changelist()
+        self.buy(3, 4, 5, 6)
+        self.assertEqual(len(self.changelist()), len(few))
+
+    def test_no_full_table_scans(self):
+        self.buy(1)
+        for sql in self.changelist():
+            if '"cinema_ticket"' in sql:
+                self.assertNotIn('DISTINCT', sql)
+                self.assertNotIn('date_trunc', sql.lower())
+        # the paginator counts once, the full result count is off
+        counts = [sql for sql in self.changelist()
+                  if 'COUNT(*)' in sql and '"cinema_ticket"' in sql]
+        self.assertEqual(len(counts), 1)
@@ -0,0 +1,51 @@
+from unittest import mock
+
+from django.http import Http404
+from django.test import SimpleTestCase, TransactionTestCase, \
+    override_settings
+from django.test.client import AsyncClient, AsyncRequestFactory
+
+from cinema import async_views
+from cinema.db.async_utils import request_wrappers, run_query
+from cinema.models import Session
+from cinema.tests import LOCAL_CACHE, create_session
+
+
+class PageNumberTests(SimpleTestCase):
+    async def test_page_below_one(self):
+        for page in ('0', '-1', 'x'):
+            # AsyncRequestFactory of Django 3.1 drops the data of a GET
+            request = AsyncRequestFactory().get(f'/async/?page={page}')
+            with self.assertRaises(Http404):
+                await async_views.sessions(request)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class AsyncViewTests(TransactionTestCase):
+    def setUp(self):
+        self.session = create_session()
+
+    async def test_tomorrow_page(self):
+        response = await AsyncClient().get('/async/tomorrow/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Alien')
+
+    async def test_queries_go_through_request_wrappers(self):
+        seen = []
+
+        def wrapper(execute, sql, params, many, context):
+            seen.append(sql)
+            return execute(sql, params, many, context)
+
+        request_wrappers.set((wrapper,))
+        count = await run_query(Session.objects.count)
+        self.assertEqual(count, 1)
+        self.assertEqual(len(seen), 1)
+
+    async def test_queries_counted_in_metrics(self):
+        with mock.patch('cinema.middleware.metrics.observe') as observe:
+            await AsyncClient().get('/async/')
+        counts = [call.args[1] for call in observe.call_args_list
+                  if call.args[0] == 'cinema_sql_queries_per_request']
+        self.assertEqual(len(counts), 1)
+        self.assertGreaterEqual(counts[0], 3)
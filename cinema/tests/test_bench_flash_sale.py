@@ -0,0 +1,68 @@
+from datetime import datetime as dt, timedelta
+from types import SimpleNamespace
+
+from django.core.management import CommandError, call_command
+from django.http import HttpResponseRedirect, JsonResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from cinema.management.commands import bench_flash_sale
+from cinema.management.commands.bench_flash_sale import CONFLICT, ERROR, \
+    OK, api_outcome, form_outcome
+from cinema.models import RevokedTicket, Ticket
+from cinema.tests import LOCAL_CACHE, create_session, create_user
+
+
+def redirect(location, *messages):
+    response = HttpResponseRedirect(location)
+    response.wsgi_request = SimpleNamespace(
+        _messages=[SimpleNamespace(message=message)
+                   for message in messages])
+    return response
+
+
+def api(status, errors=None):
+    response = JsonResponse(errors or {}, status=status)
+    # as the test client returns it
+    response.json = lambda: errors or {}
+    return response
+
+
+class OutcomeTests(SimpleTestCase):
+    def test_form(self):
+        self.assertEqual(form_outcome(redirect('/tickets/')), OK)
+        self.assertEqual(form_outcome(
+            redirect('/session/1/', 'Invalid seats')), CONFLICT)
+        # validation errors, the waiting room, rate limits
+        self.assertEqual(form_outcome(
+            redirect('/session/1/', 'wrong time')), ERROR)
+        self.assertEqual(form_outcome(redirect('/session/1/')), ERROR)
+        self.assertEqual(form_outcome(JsonResponse({}, status=429)), ERROR)
+
+    def test_api(self):
+        self.assertEqual(api_outcome(api(201)), OK)
+        for errors in ({'non_field_errors': ['taken']},
+                       {'seats_number': ['Invalid seat number']}):
+            self.assertEqual(api_outcome(api(400, errors)), CONFLICT)
+        self.assertEqual(api_outcome(api(400, {'date': ['Invalid date']})),
+                         ERROR)
+        self.assertEqual(api_outcome(api(503)), ERROR)
+
+    def test_sessions_option(self):
+        with self.assertRaisesMessage(CommandError, '--sessions'):
+            call_command('bench_flash_sale', '--sessions', '8')
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class CleanupTests(TestCase):
+    def test_revoked_tickets_removed(self):
+        session = create_session(title='bench-room-0')
+        kept = create_session(title='Blue')
+        tomorrow = dt.now().date() + timedelta(days=1)
+        for s in (session, kept):
+            Ticket.objects.create(session=s, user=create_user(
+                f'buyer-{s.id}'), date=tomorrow, seat_number=1)
+        Ticket.objects.filter(session=kept).delete()
+
+        bench_flash_sale.Command().cleanup()
+        self.assertFalse(Ticket.objects.filter(session=session).exists())
+        self.assertEqual(RevokedTicket.objects.count(), 1)
@@ -0,0 +1,82 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from cinema.cache import cached, _needs_refresh, is_shared
+from cinema.tests import LOCAL_CACHE
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+
+    def build(self, value='fresh', seconds=0):
+        def build():
+            self.builds += 1
+            time.sleep(seconds)
+            return value
+        return build
+
+    def test_concurrent_misses_build_once(self):
+        results = []
+        build = self.build(seconds=0.2)
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cached('k', build, 60)))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['fresh'] * 8)
+        self.assertEqual(self.builds, 1)
+
+    def test_fresh_value_served(self):
+        cached('k', self.build(), 60)
+        self.assertEqual(cached('k', self.build('new'), 60), 'fresh')
+        self.assertEqual(self.builds, 1)
+
+    def test_stale_value_served_while_rebuilt(self):
+        cache.set('k', ('stale', time.time() - 1, 0.1), 60)
+        # another worker is rebuilding it
+        cache.add('k:building', 1)
+        self.assertEqual(cached('k', self.build(), 60), 'stale')
+        self.assertEqual(self.builds, 0)
+
+        cache.delete('k:building')
+        self.assertEqual(cached('k', self.build(), 60), 'fresh')
+        self.assertEqual(cache.get('k')[0], 'fresh')
+
+    @mock.patch('cinema.cache.SINGLE_FLIGHT_WAIT', 0.1)
+    def test_stuck_builder_not_waited_for(self):
+        cache.add('k:building', 1)
+        started = time.monotonic()
+        self.assertEqual(cached('k', self.build(), 60), 'fresh')
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.builds, 1)
+
+    def test_early_refresh(self):
+        expires = time.time() + 10
+        # the gap is -cost * beta * log(1 - random)
+        with mock.patch('cinema.cache.random.random', return_value=0):
+            self.assertFalse(_needs_refresh(expires, cost=1))
+            self.assertTrue(_needs_refresh(time.time() - 1, cost=1))
+        with mock.patch('cinema.cache.random.random',
+                        return_value=1 - 1e-9):
+            # an expensive value is rebuilt long before its expiry
+            self.assertTrue(_needs_refresh(expires, cost=1))
+            self.assertFalse(_needs_refresh(expires, cost=0.001))
+
+    def test_is_shared(self):
+        self.assertFalse(is_shared())
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'cinema.metrics.MeteredCache',
+                'WRAPPED_BACKEND':
+                    'django.core.cache.backends.memcached.MemcachedCache',
+                'LOCATION': '127.0.0.1:11211'}}):
+            self.assertTrue(is_shared())
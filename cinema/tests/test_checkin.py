@@ -0,0 +1,85 @@
+import time
+from datetime import datetime as dt, timedelta
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from cinema import checkin
+from cinema.models import Ticket
+from cinema.tests import LOCAL_CACHE
+
+
+def ticket(pk=7, session_id=3, date=None, seat_number=12):
+    return Ticket(pk=pk, session_id=session_id, seat_number=seat_number,
+                  date=date or dt.now().date())
+
+
+class TokenTests(SimpleTestCase):
+    def test_round_trip(self):
+        scanned = checkin.read_token(checkin.make_token(ticket()))
+        self.assertEqual(scanned, checkin.ScannedTicket(
+            7, 3, dt.now().date(), 12))
+
+    def test_lowercase_and_spaces(self):
+        token = checkin.make_token(ticket())
+        self.assertIsNotNone(checkin.read_token(f' {token.lower()}\n'))
+
+    def test_tampered(self):
+        token = checkin.make_token(ticket())
+        for i in (0, 8, len(token) - 1):
+            other = 'A' if token[i] != 'A' else 'B'
+            self.assertIsNone(
+                checkin.read_token(token[:i] + other + token[i + 1:]))
+
+    def test_garbage(self):
+        for token in ('', 'not base32!', 'AAAA'):
+            self.assertIsNone(checkin.read_token(token))
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class CheckInTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = dt.now().date()
+        self.lists(frozenset(), {})
+        self.addCleanup(setattr, checkin, '_lists', None)
+        del checkin._pending[:]
+        self.addCleanup(checkin._pending.clear)
+
+    def lists(self, revoked, admitted):
+        # as just loaded, no background load is started
+        checkin._lists = self.today, revoked, admitted
+        checkin._lists_loaded = checkin._lists_tried = time.monotonic()
+
+    def test_admitted_once(self):
+        token = checkin.make_token(ticket())
+        self.assertEqual(checkin.check_in(token, 3)[0], checkin.ADMITTED)
+        self.assertEqual(checkin.check_in(token, 3)[0],
+                         checkin.ALREADY_ADMITTED)
+        self.assertEqual([pk for pk, _ in checkin._pending], [7])
+        self.assertIsNotNone(checkin.admitted_at(7))
+
+    def test_any_session(self):
+        token = checkin.make_token(ticket())
+        self.assertEqual(checkin.check_in(token)[0], checkin.ADMITTED)
+
+    def test_checked_in_earlier(self):
+        at = dt.now()
+        self.lists(frozenset(), {7: at})
+        token = checkin.make_token(ticket())
+        self.assertEqual(checkin.check_in(token, 3)[0],
+                         checkin.ALREADY_ADMITTED)
+        self.assertEqual(checkin.admitted_at(7), at)
+
+    def test_refused(self):
+        self.lists(frozenset({8}), {})
+        yesterday = self.today - timedelta(days=1)
+        for token, result in [
+                ('AAAA', checkin.INVALID),
+                (checkin.make_token(ticket(session_id=4)),
+                 checkin.WRONG_SESSION),
+                (checkin.make_token(ticket(date=yesterday)),
+                 checkin.WRONG_DATE),
+                (checkin.make_token(ticket(pk=8)), checkin.REVOKED)]:
+            self.assertEqual(checkin.check_in(token, 3)[0], result)
+        self.assertEqual(checkin._pending, [])
@@ -0,0 +1,71 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db.models import Count, F
+from django.test import TestCase
+
+from cinema.models import CinemaUser, Room, Session, Ticket
+from django_cinema.settings import DURATION_OF_BREAKS
+
+
+class GenerateDataTests(TestCase):
+    def generate(self, *args):
+        call_command('generate_data', '--rooms', '2', '--movies', '5',
+                     '--users', '10', '--days', '4', '--run-days', '2',
+                     '--seats-min', '10', '--seats-max', '20',
+                     *args, stdout=StringIO())
+
+    def test_generated_cinema(self):
+        self.generate()
+        self.assertEqual(Room.objects.count(), 2)
+        self.assertEqual(CinemaUser.objects.filter(
+            username__startswith='gen-').count(), 10)
+        self.assertTrue(Ticket.objects.exists())
+
+        for room in Room.objects.all():
+            self.assertTrue(10 <= room.seats_count <= 20)
+            sessions = list(Session.objects.filter(room=room)
+                            .select_related('movie')
+                            .order_by('date_start', 'time_start'))
+            for previous, session in zip(sessions, sessions[1:]):
+                if session.date_start == previous.date_start:
+                    self.assertGreaterEqual(session.time_start,
+                                            previous.time_finish)
+            for session in sessions:
+                minutes = session.movie.duration + DURATION_OF_BREAKS
+                self.assertLessEqual(session.time_finish.hour, 23)
+                self.assertGreater(session.time_finish, session.time_start)
+                self.assertGreaterEqual(
+                    session.time_finish.hour * 60 +
+                    session.time_finish.minute -
+                    session.time_start.hour * 60 -
+                    session.time_start.minute, minutes)
+
+        # every ticket is a distinct seat of a running session day
+        self.assertFalse(Ticket.objects.values(
+            'session', 'date', 'seat_number').annotate(
+            n=Count('id')).filter(n__gt=1).exists())
+        self.assertFalse(Ticket.objects.filter(
+            seat_number__gt=F('session__room__seats_count')).exists())
+        for day, start, finish in Ticket.objects.values_list(
+                'date', 'session__date_start', 'session__date_finish'):
+            self.assertTrue(start <= day <= finish)
+
+    def test_same_seed_same_data(self):
+        self.generate('--prefix', 'a-')
+        first = list(Ticket.objects.values_list('date', 'seat_number')
+                     .order_by('date', 'seat_number'))
+        Ticket.objects.all().delete()
+        Session.objects.all().delete()
+        self.generate('--prefix', 'b-')
+        self.assertEqual(list(Ticket.objects.values_list(
+            'date', 'seat_number').order_by('date', 'seat_number')), first)
+
+    def test_existing_prefix_refused(self):
+        self.generate()
+        with self.assertRaisesMessage(CommandError, '--prefix'):
+            self.generate()
+
+    def test_seats_range_checked(self):
+        with self.assertRaisesMessage(CommandError, '--seats-min'):
+            self.generate('--seats-min', '30')
@@ -0,0 +1,48 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from cinema import idempotency
+from cinema.tests import LOCAL_CACHE
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class IdempotencyTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def run_purchase(self):
+        self.calls += 1
+        return self.calls
+
+    def request(self, key='retry-1'):
+        request = RequestFactory().post('/buyticket/',
+                                        HTTP_IDEMPOTENCY_KEY=key)
+        request.user = AnonymousUser()
+        return request
+
+    def test_replay(self):
+        data = {'session': '3', 'seat': '12'}
+        self.assertEqual(idempotency.once(
+            self.request(), 'test', data, self.run_purchase), (1, False))
+        self.assertEqual(idempotency.once(
+            self.request(), 'test', data, self.run_purchase), (1, True))
+        self.assertEqual(idempotency.once(
+            self.request('retry-2'), 'test', data, self.run_purchase),
+            (2, False))
+
+    def test_key_reused(self):
+        idempotency.once(self.request(), 'test', {'seat': '12'},
+                         self.run_purchase)
+        with self.assertRaises(idempotency.KeyReused):
+            idempotency.once(self.request(), 'test', {'seat': '13'},
+                             self.run_purchase)
+        self.assertEqual(self.calls, 1)
+
+    def test_without_key(self):
+        for expected in (1, 2):
+            self.assertEqual(idempotency.once(
+                self.request(''), 'test', {}, self.run_purchase),
+                (expected, False))
+
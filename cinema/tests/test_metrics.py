@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from cinema import metrics
+from cinema.tests import LOCAL_CACHE
+
+DEAD_PID = 2 ** 22 + 1
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        for patcher in (mock.patch('cinema.metrics.METRICS_DIR', self.dir),
+                        mock.patch('cinema.metrics._shards', []),
+                        mock.patch('cinema.metrics._local',
+                                   threading.local()),
+                        mock.patch('cinema.metrics._gauges', dict)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_process(self, pid, values):
+        with open(os.path.join(self.dir, f'{pid}.json'), 'w') as f:
+            json.dump({'values': metrics._dump(values), 'gauges': []}, f)
+
+    def value(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        return metrics.collect().get(key)
+
+    def test_threads_added_up(self):
+        def sell():
+            metrics.inc('cinema_tickets_sold_total', channel='web')
+
+        threads = [threading.Thread(target=sell) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        sell()
+        self.assertEqual(
+            self.value('cinema_tickets_sold_total', channel='web'), 4)
+
+    def test_processes_added_up(self):
+        key = ('cinema_tickets_sold_total', (('channel', 'api'),))
+        metrics.inc('cinema_tickets_sold_total', 2, channel='api')
+        # another live worker (the parent of the test process)
+        self.write_process(os.getppid(), {key: 3})
+        self.write_process(DEAD_PID, {key: 5})
+
+        self.assertEqual(
+            self.value('cinema_tickets_sold_total', channel='api'), 10)
+        # the finished process is folded into dead.json once
+        self.assertFalse(os.path.exists(
+            os.path.join(self.dir, f'{DEAD_PID}.json')))
+        self.assertEqual(
+            self.value('cinema_tickets_sold_total', channel='api'), 10)
+
+    def test_histograms(self):
+        name = 'cinema_http_request_duration_seconds'
+        metrics.observe(name, 0.003, view='sessions', action='')
+        metrics.observe(name, 0.3, view='sessions', action='')
+        self.write_process(DEAD_PID, {
+            (name, (('action', ''), ('view', 'sessions'))):
+                [0] * 11 + [1, 20.0]})
+
+        lines = metrics.render().splitlines()
+        prefix = f'{name}_bucket{{action="",view="sessions",'
+        self.assertIn(f'{prefix}le="0.005"}} 1', lines)
+        self.assertIn(f'{prefix}le="0.25"}} 1', lines)
+        self.assertIn(f'{prefix}le="0.5"}} 2', lines)
+        self.assertIn(f'{prefix}le="+Inf"}} 3', lines)
+        self.assertIn(f'{name}_count{{action="",view="sessions"}} 3', lines)
+        self.assertIn(f'{name}_sum{{action="",view="sessions"}} 20.303',
+                      lines)
+
+    def test_labels_escaped(self):
+        metrics.inc('cinema_checkins_total', result='a"b\\c')
+        self.assertIn('cinema_checkins_total{result="a\\"b\\\\c"} 1.0',
+                      metrics.render())
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+@mock.patch('cinema.rate_limit.TRUSTED_PROXIES', ['127.0.0.1'])
+@mock.patch('cinema.views.METRICS_TOKEN', 'secret')
+@mock.patch('cinema.metrics.render', return_value='metrics\n')
+class MetricsViewTests(TestCase):
+    def test_local_scraper(self, render):
+        self.assertEqual(self.client.get(
+            '/metrics/', REMOTE_ADDR='127.0.0.1').status_code, 200)
+
+    def test_public_client_behind_proxy(self, render):
+        self.assertEqual(self.client.get(
+            '/metrics/', REMOTE_ADDR='127.0.0.1',
+            HTTP_X_FORWARDED_FOR='5.6.7.8').status_code, 403)
+
+    def test_token(self, render):
+        for token, status in (('secret', 200), ('wrong', 403)):
+            self.assertEqual(self.client.get(
+                '/metrics/', REMOTE_ADDR='5.6.7.8',
+                HTTP_AUTHORIZATION=f'Bearer {token}').status_code, status)
@@ -0,0 +1,60 @@
+from datetime import datetime as dt
+
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from cinema.models import Ticket
+from cinema.tests import LOCAL_CACHE, create_session, create_user
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class PageCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = create_session()
+
+    def get(self, path='/tomorrow/'):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit(self):
+        first = self.get()
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        second = self.get()
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second.content, first.content)
+        self.assertIn(b'Alien', second.content)
+        # the orderings and pages are cached apart
+        self.assertEqual(self.get('/tomorrow/?ordering=price')
+                         ['X-Page-Cache'], 'miss')
+
+    def test_page_shared_by_users(self):
+        self.get()
+        user = create_user()
+        self.client.force_login(user)
+        response = self.get()
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotIn(b'bob', response.content)
+
+        nav = self.client.get('/usernav/')
+        self.assertEqual(nav['Cache-Control'], 'private, no-store')
+        self.assertTrue(nav.json()['authenticated'])
+        self.assertIn('bob', nav.json()['panel'])
+
+    def test_sold_ticket_drops_pages(self):
+        self.get()
+        Ticket.objects.create(session=self.session, user=create_user(),
+                              date=dt.now().date(), seat_number=1)
+        self.assertEqual(self.get()['X-Page-Cache'], 'miss')
+
+        movie = self.session.movie
+        movie.title = 'Aliens'
+        movie.save()
+        response = self.get()
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertIn(b'Aliens', response.content)
+
+    def test_other_parameters_not_cached(self):
+        response = self.get('/tomorrow/?utm_source=mail')
+        self.assertNotIn('X-Page-Cache', response)
@@ -0,0 +1,76 @@
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+
+from cinema.models import Movie
+from cinema.paginator import EstimatedCountPaginator, estimated_count
+from cinema.tests import LOCAL_CACHE, create_user
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+@mock.patch('cinema.paginator.ESTIMATED_COUNT_THRESHOLD', 3)
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for n in range(4):
+            Movie.objects.create(title=f'Movie {n}', duration=90, year=2000)
+        self.movies = Movie.objects.order_by('id')
+
+    def paginator(self, queryset=None, **kwargs):
+        if queryset is None:
+            queryset = self.movies
+        return EstimatedCountPaginator(queryset, 2, **kwargs)
+
+    def test_small_counts_exact(self):
+        paginator = self.paginator(self.movies.filter(title='Movie 1'))
+        self.assertEqual((paginator.count, paginator.estimated), (1, False))
+
+    def test_big_counts_cached_without_estimates(self):
+        paginator = self.paginator()
+        self.assertEqual((paginator.count, paginator.estimated), (4, False))
+        Movie.objects.create(title='Movie 5', duration=90)
+        with self.assertNumQueries(0):
+            paginator = self.paginator()
+            self.assertEqual((paginator.count, paginator.estimated),
+                             (4, True))
+
+    def test_planner_estimate(self):
+        with mock.patch('cinema.paginator.estimated_count',
+                        return_value=20000), self.assertNumQueries(0):
+            paginator = self.paginator()
+            self.assertEqual((paginator.count, paginator.estimated),
+                             (20000, True))
+            self.assertEqual(paginator.num_pages, 10000)
+        # a small estimate is counted
+        with mock.patch('cinema.paginator.estimated_count', return_value=2):
+            self.assertEqual(self.paginator().count, 4)
+
+    def test_count_queryset(self):
+        annotated = self.movies.annotate(sessions=Count('movie_sessions'))
+        paginator = self.paginator(
+            annotated, count_queryset=self.movies.filter(title='Movie 1'))
+        self.assertEqual(paginator.count, 1)
+        self.assertEqual(EstimatedCountPaginator([1, 2, 3], 2).count, 3)
+
+    def test_list_shows_estimate(self):
+        self.client.force_login(create_user(is_staff=True))
+        with mock.patch('cinema.paginator.estimated_count',
+                        return_value=20000):
+            response = self.client.get('/movieslist/')
+        self.assertContains(response, 'about 20000 results')
+        self.assertContains(self.client.get('/movieslist/?q=movie%201'),
+                            '1 result<')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL')
+class PlannerEstimateTests(TestCase):
+    def test_estimates(self):
+        Movie.objects.create(title='Heat', duration=150)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Movie._meta.db_table}')
+        self.assertEqual(estimated_count(Movie.objects.all()), 1)
+        self.assertGreaterEqual(
+            estimated_count(Movie.objects.filter(year=1995)), 1)
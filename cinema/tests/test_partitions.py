@@ -0,0 +1,67 @@
+import io
+from datetime import date, datetime as dt, timedelta
+from unittest import skipIf, skipUnless
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from cinema.management.commands.partition_tickets import \
+    create_day_partition, daterange, is_partitioned, partition_name
+from cinema.models import Ticket
+from cinema.tests import create_session, create_user
+
+
+class HelperTests(SimpleTestCase):
+    def test_partition_name(self):
+        self.assertEqual(partition_name(date(2026, 3, 9)),
+                         f'{Ticket._meta.db_table}_p20260309')
+
+    def test_daterange_inclusive(self):
+        self.assertEqual(list(daterange(date(2026, 2, 27), date(2026, 3, 1))),
+                         [date(2026, 2, 27), date(2026, 2, 28),
+                          date(2026, 3, 1)])
+
+
+@skipIf(connection.vendor == 'postgresql', 'PostgreSQL partitions tickets')
+class OtherDatabaseTests(SimpleTestCase):
+    def test_refused(self):
+        with self.assertRaisesMessage(CommandError, 'needs PostgreSQL'):
+            call_command('partition_tickets', '--convert')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL')
+class PartitionTests(TestCase):
+    def setUp(self):
+        self.session = create_session()
+        self.user = create_user()
+        self.today = dt.now().date()
+        call_command('partition_tickets', '--convert', '--days-ahead', '1',
+                     stdout=io.StringIO())
+
+    def count(self, table, day):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {table} WHERE date = %s',
+                           [day])
+            return cursor.fetchone()[0]
+
+    def test_converted(self):
+        self.assertTrue(is_partitioned())
+        Ticket.objects.bulk_create([Ticket(
+            session=self.session, user=self.user, date=self.today,
+            seat_number=1)])
+        self.assertEqual(self.count(partition_name(self.today),
+                                     self.today), 1)
+
+    def test_rows_moved_from_default_partition(self):
+        day = self.today + timedelta(days=2)
+        Ticket.objects.bulk_create([Ticket(
+            session=self.session, user=self.user, date=day, seat_number=n)
+            for n in (1, 2)])
+        default = f'{Ticket._meta.db_table}_default'
+        self.assertEqual(self.count(default, day), 2)
+
+        create_day_partition(day)
+        self.assertEqual(self.count(default, day), 0)
+        self.assertEqual(self.count(partition_name(day), day), 2)
+        self.assertEqual(Ticket.objects.filter(date=day).count(), 2)
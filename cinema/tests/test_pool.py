@@ -0,0 +1,132 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+from psycopg2 import extensions
+
+from cinema.db import pool as db_pool
+from cinema.db.backends.postgresql_pool.creation import DatabaseCreation
+from cinema.db.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = SimpleNamespace(
+            transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+        self.rolled_back = False
+
+    def rollback(self):
+        self.rolled_back = True
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def new_pool(max_size=2, check_after=60, database='cinemabase'):
+    return ConnectionPool(max_size=max_size, timeout=0.01,
+                          check_after=check_after, max_idle=300,
+                          database=database)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_reuses_returned_connection(self):
+        pool = new_pool()
+        conn = pool.getconn(FakeConnection)
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(FakeConnection), conn)
+        stats = pool.stats()
+        self.assertEqual((stats['created'], stats['checkouts'],
+                          stats['in_use']), (1, 2, 1))
+
+    def test_timeout_when_exhausted(self):
+        pool = new_pool(max_size=1)
+        conn = pool.getconn(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(FakeConnection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(FakeConnection), conn)
+
+    def test_broken_connections_discarded(self):
+        pool = new_pool()
+        conn = pool.getconn(FakeConnection)
+        pool.putconn(conn)
+        conn.closed = 1
+        self.assertIsNot(pool.getconn(FakeConnection), conn)
+        self.assertEqual(pool.stats()['health_check_failures'], 1)
+
+    def test_open_transaction_rolled_back(self):
+        pool = new_pool()
+        conn = pool.getconn(FakeConnection)
+        conn.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+        pool.putconn(conn)
+        self.assertTrue(conn.rolled_back)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_connect_failure_frees_slot(self):
+        pool = new_pool(max_size=1)
+
+        def connect():
+            raise db_pool.DatabaseError('down')
+
+        with self.assertRaises(db_pool.DatabaseError):
+            pool.getconn(connect)
+        self.assertIsNotNone(pool.getconn(FakeConnection))
+
+    def test_close(self):
+        pool = new_pool()
+        idle, busy = pool.getconn(FakeConnection), \
+            pool.getconn(FakeConnection)
+        pool.putconn(idle)
+        pool.close()
+        self.assertTrue(idle.closed)
+        pool.putconn(busy)
+        self.assertTrue(busy.closed)
+        self.assertEqual(pool.stats()['idle'], 0)
+
+
+@mock.patch.object(db_pool, '_current', {})
+@mock.patch.object(db_pool, '_pools', {})
+class GetPoolTests(SimpleTestCase):
+    real = {'database': 'cinemabase', 'host': 'localhost'}
+    test = {'database': 'test_cinemabase', 'host': 'localhost'}
+
+    def test_pool_per_connection_params(self):
+        pool = db_pool.get_pool('default', self.real)
+        self.assertIs(db_pool.get_pool('default', dict(self.real)), pool)
+        conn = pool.getconn(FakeConnection)
+        pool.putconn(conn)
+
+        # the test runner changed NAME: the old connections are closed,
+        # never handed out for the test database
+        test_pool = db_pool.get_pool('default', self.test)
+        self.assertIsNot(test_pool, pool)
+        self.assertTrue(conn.closed)
+        self.assertIsNot(test_pool.getconn(FakeConnection), conn)
+
+    def test_forked_worker_gets_own_pool(self):
+        pool = db_pool.get_pool('default', self.real)
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(db_pool.get_pool('default', self.real), pool)
+
+    def test_close_pools_of_database(self):
+        test_pool = db_pool.get_pool('default', self.test)
+        other = db_pool.get_pool('other', self.real)
+        conn = test_pool.getconn(FakeConnection)
+        test_pool.putconn(conn)
+        db_pool.close_pools('test_cinemabase')
+        self.assertTrue(conn.closed)
+        self.assertEqual(list(db_pool.pool_stats()), ['other'])
+        self.assertIs(db_pool.get_pool('other', self.real), other)
+
+    def test_closed_before_test_database_dropped(self):
+        conn = FakeConnection()
+        pool = db_pool.get_pool('default', self.test)
+        pool.putconn(pool.getconn(lambda: conn))
+        wrapper = mock.MagicMock()
+        cursor = wrapper._nodb_cursor.return_value.__enter__.return_value
+        cursor.execute.side_effect = lambda sql: self.assertTrue(conn.closed)
+        DatabaseCreation(wrapper)._destroy_test_db('test_cinemabase', 0)
+        cursor.execute.assert_called_once()
@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from cinema import profiling
+from cinema.tests import LOCAL_CACHE, create_session, create_user
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class RequestProfilerTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        patcher = mock.patch('cinema.profiling.PROFILES_DIR', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # a cached schedule needs no queries
+        cache.clear()
+        create_session()
+
+    def test_staff_request_profiled(self):
+        self.client.force_login(create_user(is_staff=True))
+        response = self.client.get('/tomorrow/', HTTP_X_PROFILE='1')
+        profile_id = response['X-Profile-Id']
+
+        with open(profiling.profile_path(profile_id, 'json')) as f:
+            summary = json.load(f)
+        self.assertEqual((summary['path'], summary['status'],
+                          summary['user']), ('/tomorrow/', 200, 'bob'))
+        self.assertEqual(summary['view'], 'tomorrow')
+        self.assertGreater(summary['sql_count'], 0)
+        self.assertEqual(len(summary['queries']), summary['sql_count'])
+        self.assertIn('cumulative', summary['functions'])
+        self.assertEqual([p['id'] for p in profiling.list_profiles()],
+                         [profile_id])
+
+        response = self.client.get(f'/profiles/{profile_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.client.get(f'/profiles/{"0" * 32}/').status_code, 404)
+
+    def test_header_ignored_for_customers(self):
+        self.client.force_login(create_user())
+        response = self.client.get('/tomorrow/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.dir), [])
+        self.assertEqual(self.client.get('/profiles/').status_code, 302)
+
+    def test_sampling(self):
+        with mock.patch('cinema.middleware.PROFILER_SAMPLE_RATE', 1):
+            self.assertIn('X-Profile-Id', self.client.get('/tomorrow/'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/tomorrow/'))
+
+    def test_old_profiles_pruned(self):
+        for n in range(3):
+            for extension in ('json', 'prof'):
+                path = profiling.profile_path(f'old{n}', extension)
+                open(path, 'w').close()
+                os.utime(path, (n, n))
+        with mock.patch('cinema.profiling.PROFILES_KEEP', 2):
+            profiling.prune_profiles()
+        self.assertEqual(sorted(os.listdir(self.dir)), [
+            'old1.json', 'old1.prof', 'old2.json', 'old2.prof'])
@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from cinema import rate_limit
+from cinema.middleware import RateLimit
+from cinema.tests import LOCAL_CACHE
+
+RULE = {'name': 'test', 'per': 'ip', 'requests': 4, 'seconds': 10}
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class SlidingWindowTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def hits(self, now, count, rule=RULE, ident='1.2.3.4'):
+        with mock.patch('cinema.rate_limit.time.time', return_value=now):
+            return [rate_limit.hit(rule, ident) for _ in range(count)]
+
+    def test_window(self):
+        self.assertEqual(self.hits(100, 5), [None] * 4 + [10])
+        # half of the 5 requests of the previous window still count
+        self.assertEqual(self.hits(115, 2), [None, 5])
+        self.assertEqual(self.hits(125, 2), [None, None])
+        # a window later nothing is left
+        self.assertEqual(self.hits(150, 4), [None] * 4)
+
+    def test_budget_per_identity(self):
+        self.assertEqual(self.hits(100, 5)[-1], 10)
+        self.assertEqual(self.hits(100, 1, ident='5.6.7.8'), [None])
+        self.assertEqual(self.hits(100, 1, rule=dict(RULE, name='other')),
+                         [None])
+
+    def test_cache_down_lets_requests_through(self):
+        with mock.patch('cinema.rate_limit.cache') as broken:
+            broken.incr.side_effect = ValueError
+            self.assertEqual(self.hits(100, 10), [None] * 10)
+
+
+@mock.patch('cinema.rate_limit.TRUSTED_PROXIES', ['127.0.0.1'])
+class ClientIpTests(SimpleTestCase):
+    def ip(self, remote, forwarded=None):
+        request = RequestFactory().get('/', REMOTE_ADDR=remote)
+        if forwarded is not None:
+            request.META['HTTP_X_FORWARDED_FOR'] = forwarded
+        return rate_limit.client_ip(request)
+
+    def test_direct_client(self):
+        self.assertEqual(self.ip('5.6.7.8', '1.1.1.1'), '5.6.7.8')
+
+    def test_behind_proxy(self):
+        self.assertEqual(self.ip('127.0.0.1', '5.6.7.8'), '5.6.7.8')
+        # the client may send any X-Forwarded-For, nginx appends to it
+        self.assertEqual(self.ip('127.0.0.1', '1.1.1.1, 5.6.7.8'),
+                         '5.6.7.8')
+        self.assertEqual(self.ip('127.0.0.1', '5.6.7.8, 127.0.0.1'),
+                         '5.6.7.8')
+        self.assertEqual(self.ip('127.0.0.1'), '127.0.0.1')
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+@mock.patch('cinema.rate_limit.TRUSTED_PROXIES', ['127.0.0.1'])
+class LoginLimitTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.middleware = RateLimit(lambda request: None)
+
+    def login(self, ip, username='alice'):
+        request = RequestFactory().post(
+            '/accounts/login/', {'username': username, 'password': 'x'},
+            REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR=ip)
+        return self.middleware.process_request(request)
+
+    def test_guessing_one_account(self):
+        for _ in range(5):
+            self.assertIsNone(self.login('5.6.7.8'))
+        response = self.login('5.6.7.8')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) > 0)
+        # the owner of the account logs in from elsewhere
+        self.assertIsNone(self.login('1.1.1.1'))
+
+    def test_clients_behind_proxy_have_own_budget(self):
+        for n in range(20):
+            self.assertIsNone(self.login('5.6.7.8', f'user{n}'))
+        self.assertEqual(self.login('5.6.7.8', 'other').status_code, 429)
+        self.assertIsNone(self.login('1.1.1.1', 'other'))
@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from cinema import refcache
+from cinema.models import Movie, Session
+from cinema.tests import LOCAL_CACHE, create_session
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+@mock.patch('cinema.refcache.REFCACHE_CHECK_SECONDS', 0)
+class RefCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        for patcher in (mock.patch('cinema.refcache._tables', {}),
+                        mock.patch('cinema.refcache._version', None),
+                        mock.patch('cinema.refcache._checked', 0.0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.session = create_session()
+        self.movie = self.session.movie
+
+    def test_loaded_once(self):
+        self.assertEqual(refcache.movie(self.movie.pk).title, 'Alien')
+        refcache.room(self.session.room_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(refcache.movie(self.movie.pk).title, 'Alien')
+            self.assertEqual(refcache.room(self.session.room_id).title,
+                             'Red')
+            self.assertIsNone(refcache.movie(None))
+
+    def test_saved_movie_reloaded(self):
+        refcache.movie(self.movie.pk)
+        self.movie.title = 'Aliens'
+        self.movie.save()
+        self.assertEqual(refcache.movie(self.movie.pk).title, 'Aliens')
+
+    def test_change_of_other_process(self):
+        refcache.movie(self.movie.pk)
+        Movie.objects.filter(pk=self.movie.pk).update(title='Aliens')
+        self.assertEqual(refcache.movie(self.movie.pk).title, 'Alien')
+        # another worker saved a movie and bumped the version
+        cache.set(refcache.VERSION_KEY, 1, None)
+        self.assertEqual(refcache.movie(self.movie.pk).title, 'Aliens')
+
+    def test_version_checked_every_interval(self):
+        refcache.movie(self.movie.pk)
+        with mock.patch('cinema.refcache.REFCACHE_CHECK_SECONDS', 60):
+            refcache.movie(self.movie.pk)
+            Movie.objects.filter(pk=self.movie.pk).update(title='Aliens')
+            cache.set(refcache.VERSION_KEY, 1, None)
+            self.assertEqual(refcache.movie(self.movie.pk).title, 'Alien')
+
+    def test_new_movie_of_other_process(self):
+        refcache.movie(self.movie.pk)
+        Movie.objects.bulk_create([Movie(title='Heat', duration=150)])
+        heat = Movie.objects.get(title='Heat')
+        with self.assertNumQueries(1):
+            self.assertEqual(refcache.movie(heat.pk).title, 'Heat')
+            self.assertEqual(refcache.movie(heat.pk).title, 'Heat')
+
+    def test_sessions_with_references(self):
+        create_session(title='Blue')
+        list(Session.objects.with_references())
+        with self.assertNumQueries(1):
+            sessions = list(Session.objects.with_references())
+            self.assertEqual(sorted(s.room.title for s in sessions),
+                             ['Blue', 'Red'])
+            self.assertEqual({s.movie.title for s in sessions}, {'Alien'})
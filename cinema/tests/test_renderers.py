@@ -0,0 +1,79 @@
+import json
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+import msgpack
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase, \
+    override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from cinema.API.renderers import MessagePackRenderer, ORJSONRenderer
+from cinema.tests import LOCAL_CACHE, create_session
+
+DATA = {
+    # separators escaped by DRF, unicode is not
+    'text': 'caf\u00e9 \u2028 \u2029 </script>',
+    'aware': datetime(2024, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc),
+    'naive': datetime(2024, 1, 2, 3, 4, 5),
+    'date': date(2024, 1, 2),
+    'time': time(1, 2, 3, 400000),
+    'duration': timedelta(seconds=90),
+    'price': Decimal('5.50'),
+    'uuid': uuid.UUID(int=5),
+    'lazy': gettext_lazy('Hi'),
+    'numbers': [0.1, 2 ** 60, -1, True, None],
+    1: 'non-string key',
+    'nested': [{'seats': (1, 2)}],
+}
+
+
+class RendererTests(SimpleTestCase):
+    def test_same_json_as_drf(self):
+        self.assertEqual(ORJSONRenderer().render(DATA),
+                         JSONRenderer().render(DATA))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_indented(self):
+        media_type = 'application/json; indent=4'
+        content = ORJSONRenderer().render(DATA, media_type)
+        self.assertIn(b'\n  "text"', content)
+        self.assertEqual(json.loads(content),
+                         json.loads(JSONRenderer().render(DATA)))
+
+    def test_msgpack_same_values_as_json(self):
+        unpacked = msgpack.unpackb(MessagePackRenderer().render(DATA),
+                                   strict_map_key=False, raw=False)
+        expected = json.loads(JSONRenderer().render(DATA))
+        # msgpack keeps the integer keys
+        expected[1] = expected.pop('1')
+        self.assertEqual(unpacked, expected)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class RenderedListTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        create_session()
+
+    def get(self, accept):
+        return self.client.get('/session_api/', HTTP_ACCEPT=accept)
+
+    def test_formats(self):
+        as_json = self.get('application/json')
+        self.assertEqual(as_json['Content-Type'], 'application/json')
+        as_msgpack = self.get('application/msgpack')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(as_msgpack.content),
+                         as_json.json())
+        self.assertEqual(as_json.json()[0]['movie']['title'], 'Alien')
+        self.assertIn(b'<html', self.get('text/html').content)
+
+    def test_cached_until_sessions_change(self):
+        first = self.get('application/json').content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('application/json').content, first)
+        create_session(title='Blue')
+        self.assertEqual(len(self.get('application/json').json()), 2)
@@ -0,0 +1,75 @@
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from cinema import routers
+from cinema.middleware import ReplicaRouting
+from cinema.models import Movie
+from django_cinema.settings import REPLICA_PIN_COOKIE
+
+
+@mock.patch('cinema.routers.DATABASE_REPLICAS', ['replica1', 'replica2'])
+class RouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        token = routers.replica_reads.set(True)
+        self.addCleanup(routers.replica_reads.reset, token)
+
+    def lags(self, **lags):
+        return mock.patch('cinema.routers.get_replica_lag', lags.get)
+
+    def test_safe_request_reads_replica(self):
+        with self.lags(replica1=0.0, replica2=1.0):
+            self.assertIn(self.router.db_for_read(Movie),
+                          ['replica1', 'replica2'])
+
+    def test_lagging_and_broken_replicas_skipped(self):
+        with self.lags(replica1=60.0, replica2=None):
+            self.assertEqual(self.router.db_for_read(Movie), 'default')
+        with self.lags(replica1=60.0, replica2=0.5):
+            self.assertEqual(self.router.db_for_read(Movie), 'replica2')
+
+    def test_unsafe_request_reads_primary(self):
+        routers.replica_reads.set(False)
+        with self.lags(replica1=0.0, replica2=0.0):
+            self.assertEqual(self.router.db_for_read(Movie), 'default')
+
+    def test_transaction_reads_primary(self):
+        connection = mock.Mock(in_atomic_block=True)
+        with self.lags(replica1=0.0, replica2=0.0), \
+                mock.patch('cinema.routers.connections',
+                           {'default': connection}):
+            self.assertEqual(self.router.db_for_read(Movie), 'default')
+
+    def test_writes_and_migrations_primary(self):
+        self.assertEqual(self.router.db_for_write(Movie), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'cinema'))
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.middleware = ReplicaRouting(lambda request: HttpResponse())
+        self.factory = RequestFactory()
+
+    def reads_replica(self, request):
+        seen = []
+        self.middleware.get_response = lambda request: seen.append(
+            routers.replica_reads.get()) or HttpResponse()
+        response = self.middleware(request)
+        self.assertFalse(routers.replica_reads.get())
+        return seen[0], response
+
+    def test_write_pins_client_to_primary(self):
+        replica, response = self.reads_replica(self.factory.post('/'))
+        self.assertFalse(replica)
+        self.assertIn(REPLICA_PIN_COOKIE, response.cookies)
+
+        request = self.factory.get('/')
+        request.COOKIES[REPLICA_PIN_COOKIE] = '1'
+        self.assertFalse(self.reads_replica(request)[0])
+
+    def test_get_reads_replica(self):
+        replica, response = self.reads_replica(self.factory.get('/'))
+        self.assertTrue(replica)
+        self.assertNotIn(REPLICA_PIN_COOKIE, response.cookies)
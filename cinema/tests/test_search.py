@@ -0,0 +1,58 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from cinema.API.resources import search_movies
+from cinema.models import Movie
+from cinema.tests import LOCAL_CACHE, create_session
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alien = create_session().movie
+        cls.star = Movie.objects.create(
+            title='Star Wars', director='Lucas', year=1977, duration=121,
+            description='A farm boy joins the rebels')
+        cls.trek = Movie.objects.create(
+            title='Star Trek', director='Wise', year=1979, duration=132,
+            description='The enterprise meets a star cloud')
+
+    def search(self, **params):
+        return list(search_movies(params))
+
+    def test_all_words_match(self):
+        self.assertEqual(self.search(q='star wars'), [self.star])
+        # the last word as a prefix, for search as you type
+        self.assertEqual(self.search(q='star wa'), [self.star])
+        self.assertEqual(self.search(q='lucas'), [self.star])
+        self.assertEqual(self.search(q='!?'), [])
+
+    def test_filters(self):
+        self.assertEqual(self.search(q='star', year='1979'), [self.trek])
+        self.assertEqual(self.search(year='1979', today='1'), [self.alien])
+        self.assertEqual(self.search(year='x'), self.search())
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_api(self):
+        response = self.client.get('/movie_api/?q=star%20tr')
+        self.assertEqual([movie['title'] for movie in response.json()],
+                         ['Star Trek'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL')
+class RankingTests(TestCase):
+    def test_title_ranks_first(self):
+        in_title = Movie.objects.create(title='Cloud Atlas', duration=150)
+        in_text = Movie.objects.create(
+            title='Heat', duration=150, description='A cloud of smoke')
+        self.assertEqual(list(Movie.objects.search('cloud')),
+                         [in_title, in_text])
+
+    def test_vector_updated_on_save(self):
+        movie = Movie.objects.create(title='Heat', duration=150)
+        movie.title = 'Ronin'
+        movie.save()
+        self.assertEqual(list(Movie.objects.search('ronin')), [movie])
+        self.assertEqual(list(Movie.objects.search('heat')), [])
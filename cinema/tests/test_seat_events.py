@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+import psycopg2
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase, \
+    override_settings
+
+from cinema import seat_events
+from cinema.tests import LOCAL_CACHE, create_session
+
+
+async def no_app(scope, receive, send):
+    raise AssertionError('not a seat event stream')
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class StreamTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = create_session()
+        self.app = seat_events.seat_events_app(no_app)
+
+    async def stream(self, headers=()):
+        """ Messages sent until the first snapshot, then disconnects """
+        sent = []
+        snapshot = asyncio.Event()
+
+        async def receive():
+            await snapshot.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if b'event: snapshot' in message.get('body', b''):
+                snapshot.set()
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'query_string': b'',
+            'path': f'/session/{self.session.id}/seats/events/',
+            'headers': [(b'accept', b'text/event-stream')] + list(headers),
+            'client': ('10.0.0.1', 5000),
+        }
+        await asyncio.wait_for(self.app(scope, receive, send), 5)
+        return sent
+
+    async def test_snapshot_from_seat_cache(self):
+        with mock.patch('cinema.seat_events._taken_seats',
+                        return_value=[3, 4]) as taken_seats:
+            first = await self.stream()
+            await self.stream()
+        self.assertEqual(first[0]['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream'),
+                      first[0]['headers'])
+        snapshot = first[1]['body'].decode()
+        self.assertEqual(json.loads(snapshot.split('data: ')[1]),
+                         {'taken': [3, 4]})
+        taken_seats.assert_called_once()
+
+    async def test_rate_limited(self):
+        with mock.patch('cinema.rate_limit.hit', return_value=7):
+            sent = await self.stream()
+        self.assertEqual(sent[0]['status'], 429)
+        self.assertIn((b'Retry-After', b'7'), sent[0]['headers'])
+
+    async def test_waiting_room(self):
+        self.session.waiting_room = True
+        self.session.admission_rate = 1
+        await seat_events.run_query(self.session.save)
+        with mock.patch('cinema.waiting_room.WAITING_ROOM_BURST', 0):
+            sent = await self.stream()
+        self.assertEqual(sent[0]['status'], 503)
+        self.assertEqual(json.loads(sent[1]['body'])['position'], 1)
+
+
+class ListenTests(SimpleTestCase):
+    async def test_connects_outside_event_loop(self):
+        hub = seat_events.SeatEventHub()
+        hub.loop = asyncio.get_running_loop()
+        threads = []
+
+        def connect(params):
+            threads.append(threading.current_thread())
+            raise psycopg2.OperationalError('down')
+
+        with mock.patch('cinema.seat_events._connect_listener', connect), \
+                mock.patch.object(hub, 'listen_later') as listen_later:
+            await hub.listen()
+        self.assertIsNot(threads[0], threading.current_thread())
+        listen_later.assert_called_once()
+        self.assertIsNone(hub.listener)
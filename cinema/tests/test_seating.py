@@ -0,0 +1,33 @@
+from django.test import SimpleTestCase
+
+from cinema.seating import RoomLayout
+
+
+class BestSeatsTests(SimpleTestCase):
+    def setUp(self):
+        # the best row is B, 60% from the screen
+        self.layout = RoomLayout([
+            {'row': 'A', 'seats': 'SSSSSS'},  # 1-6
+            {'row': 'B', 'seats': 'SSS.SSS'},  # 7-12
+            {'row': 'C', 'seats': 'VVVVVV'},  # 13-18
+        ])
+
+    def test_nearest_to_best_row_middle(self):
+        self.assertEqual(self.layout.best_seats([], 1), [9])
+        self.assertEqual(self.layout.best_seats([], 2), [8, 9])
+        self.assertEqual(self.layout.best_seats([], 3), [7, 8, 9])
+
+    def test_skips_taken_and_aisles(self):
+        self.assertEqual(self.layout.best_seats([9], 2), [10, 11])
+        self.assertEqual(self.layout.best_seats([], 4), [2, 3, 4, 5])
+        self.assertEqual(self.layout.best_seats([1, 6], 5), [])
+
+    def test_seat_type(self):
+        self.assertEqual(self.layout.best_seats([], 2, 'V'), [15, 16])
+        self.assertEqual(self.layout.best_seats([], 1, 'W'), [])
+
+    def test_invalid_count(self):
+        self.assertEqual(self.layout.best_seats([], 0), [])
+        self.assertEqual(self.layout.best_seats([], 100), [])
+
+
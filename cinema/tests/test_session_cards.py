@@ -0,0 +1,55 @@
+from datetime import datetime as dt
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.template.loader import render_to_string
+from django.test import TestCase, override_settings
+
+from cinema.models import Session, Ticket
+from cinema.tests import LOCAL_CACHE, create_session, create_user
+from cinema.views import with_card_versions
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class SessionCardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = create_session()
+        self.today = dt.now().date()
+
+    def render(self):
+        session = with_card_versions(Session.objects.annotate(
+            tickets=Count('session_tickets',
+                          filter=Q(session_tickets__date=self.today))
+        )).get(pk=self.session.pk)
+        return render_to_string('session-card.html', {
+            'session': session, 'card_cache_seconds': 60,
+            'date': self.today.strftime('%Y-%m-%d')})
+
+    def test_cached_card_needs_no_movie_or_room(self):
+        self.assertIn('Alien', self.render())
+        # one query for the session, none for its movie and room
+        with self.assertNumQueries(1):
+            html = self.render()
+        self.assertIn('Alien', html)
+        self.assertIn('Red', html)
+
+    def test_changed_movie_and_room_shown(self):
+        self.render()
+        movie = self.session.movie
+        movie.title = 'Aliens'
+        movie.save()
+        self.assertIn('Aliens', self.render())
+
+        room = self.session.room
+        room.title = 'Blue'
+        room.save()
+        self.assertIn('Blue', self.render())
+
+    def test_seats_are_live(self):
+        self.assertIn('Free\n            seats: </strong>50', self.render())
+        Ticket.objects.create(session=self.session, user=create_user(),
+                              date=self.today, seat_number=1)
+        html = self.render()
+        self.assertIn('tickets: </strong>1', html)
+        self.assertIn('Free\n            seats: </strong>49', html)
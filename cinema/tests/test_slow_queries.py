@@ -0,0 +1,66 @@
+from datetime import date
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from cinema import slow_queries
+from cinema.models import Movie, SlowQuery
+from cinema.slow_queries import normalize, params_shape
+
+
+class NormalizeTests(SimpleTestCase):
+    def test_literals_replaced(self):
+        self.assertEqual(
+            normalize("SELECT *  FROM t WHERE a = 'it''s'\n AND b = 1.5 "
+                      "AND c = %s"),
+            'SELECT * FROM t WHERE a = ? AND b = ? AND c = ?')
+
+    def test_value_lists_collapsed(self):
+        self.assertEqual(normalize('SELECT 1 FROM t WHERE id IN (%s, %s)'),
+                         normalize('SELECT 1 FROM t WHERE id IN (1,2,3)'))
+
+    def test_params_shape(self):
+        self.assertEqual(params_shape((1, 2, date.today(), 'x'), False),
+                         'int x 2, date, str')
+        self.assertEqual(params_shape({'a': 1}, False), 'a: int')
+        self.assertEqual(params_shape([(1, 'x'), (2, 'y')], True),
+                         '2 x (int, str)')
+        self.assertEqual(params_shape(None, False), '')
+
+
+@mock.patch('cinema.slow_queries.SLOW_QUERY_THRESHOLD_MS', 0)
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('cinema.slow_queries._pending', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_queries(self):
+        for year in (1979, 1980):
+            list(Movie.objects.filter(year=year))
+
+    def test_grouped_by_code(self):
+        self.run_queries()
+        self.run_queries()
+        slow_queries.save_pending()
+
+        logged = SlowQuery.objects.get(sql__contains='"year" = ?')
+        self.assertEqual(logged.calls, 4)
+        self.assertEqual(logged.params_shape, 'int')
+        self.assertRegex(logged.code,
+                         r'^cinema/tests/test_slow_queries.py:\d+ in '
+                         r'run_queries$')
+        self.assertTrue(0 < logged.max_ms <= logged.total_ms)
+
+        # the next requests add up
+        self.run_queries()
+        slow_queries.save_pending()
+        logged.refresh_from_db()
+        self.assertEqual(logged.calls, 6)
+
+    def test_saving_not_logged(self):
+        self.run_queries()
+        slow_queries.save_pending()
+        self.assertEqual(slow_queries._pending, [])
+        self.assertFalse(SlowQuery.objects.filter(
+            sql__contains='cinema_slowquery').exists())
@@ -0,0 +1,94 @@
+import os
+import shutil
+import stat
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TransactionTestCase, \
+    override_settings
+
+from cinema import snapshots
+from cinema.tests import LOCAL_CACHE, create_session
+
+
+class TemporaryRoot:
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+
+class WriteAtomicTests(TemporaryRoot, SimpleTestCase):
+    def test_written_readable(self):
+        snapshots.write_atomic(self.path('a/index.html'), b'page')
+        self.assertEqual(self.read('a/index.html'), b'page')
+        mode = os.stat(self.path('a/index.html')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o644)
+        self.assertEqual(os.listdir(self.path('a')), ['index.html'])
+
+    def test_failed_write_keeps_old_file(self):
+        snapshots.write_atomic(self.path('index.html'), b'old')
+        with mock.patch('os.replace', side_effect=OSError), \
+                self.assertRaises(OSError):
+            snapshots.write_atomic(self.path('index.html'), b'new')
+        self.assertEqual(self.read('index.html'), b'old')
+        self.assertEqual(os.listdir(self.root), ['index.html'])
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class PublishTests(TemporaryRoot, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        create_session()
+        patcher = mock.patch('cinema.snapshots.SNAPSHOT_ROOT', self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(snapshots._pending.clear)
+
+    def test_published_pages_as_served(self):
+        published = snapshots.publish()
+        self.assertEqual(set(published), {
+            'index.html', 'tomorrow/index.html', 'today_session_api.json'})
+        self.assertIn(b'Alien', self.read('tomorrow/index.html'))
+        self.assertEqual(
+            self.read('today_session_api.json'),
+            self.client.get('/today_session_api/',
+                            HTTP_ACCEPT='application/json').content)
+
+    def test_failed_page_removed(self):
+        snapshots.publish()
+        failing = [('index.html', lambda request: HttpResponse(status=500),
+                    '/', 'text/html')]
+        with mock.patch('cinema.snapshots._snapshots', return_value=failing):
+            self.assertEqual(snapshots.publish(), {})
+        self.assertFalse(os.path.exists(self.path('index.html')))
+        self.assertTrue(os.path.exists(self.path('tomorrow/index.html')))
+
+    def test_republished_after_change(self):
+        snapshots.publish()
+        create_session(title='Blue')
+        self.assertTrue(snapshots._pending.is_set())
+        # by the request_finished signal
+        snapshots.publish_pending()
+        self.assertIn(b'Blue', self.read('tomorrow/index.html'))
+        self.assertFalse(snapshots._pending.is_set())
+
+    def test_command(self):
+        setting = 'cinema.management.commands.publish_schedule.SNAPSHOT_ROOT'
+        out = StringIO()
+        with mock.patch(setting, self.root):
+            call_command('publish_schedule', stdout=out)
+        self.assertIn('tomorrow/index.html', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'SNAPSHOT_ROOT'):
+            call_command('publish_schedule')
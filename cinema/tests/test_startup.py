@@ -0,0 +1,19 @@
+from django.template import engines
+from django.test import SimpleTestCase
+
+from cinema import warmup
+from cinema.management.commands.bench_startup import Command, STARTUP_SCRIPT
+
+
+class StartupTests(SimpleTestCase):
+    def test_worker_starts_without_database(self):
+        for module in ('django_cinema.wsgi', 'django_cinema.asgi'):
+            run = Command().start(STARTUP_SCRIPT.format(module=module))
+            self.assertEqual((run['connections'], run['queries']), ([], []))
+
+    def test_warm_up(self):
+        # SimpleTestCase fails on any query
+        self.assertGreater(warmup.warm_up(), 0)
+        names = set(warmup.project_templates(engines['django']))
+        self.assertIn('base.html', names)
+        self.assertIn('profile-list.html', names)
@@ -0,0 +1,113 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from cinema import waiting_room
+from cinema.tests import LOCAL_CACHE, create_session
+
+NOW = 1000000.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+@mock.patch('cinema.waiting_room.WAITING_ROOM_BURST', 2)
+class WaitingRoomTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = Clock()
+        patcher = mock.patch('cinema.waiting_room.time.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def admit(self, token=None, session_id=1, rate=60):
+        request = RequestFactory().get('/')
+        if token:
+            request.META[waiting_room.HEADER] = token
+        return waiting_room.admit(request, session_id, rate)
+
+    def test_line(self):
+        # the burst goes in at once, then one a second
+        self.assertEqual(self.admit()[:3], (True, 1, 0))
+        self.assertEqual(self.admit()[:3], (True, 2, 0))
+        admitted, position, wait, token = self.admit()
+        self.assertEqual((admitted, position, wait), (False, 3, 1))
+        self.assertEqual(self.admit()[:3], (False, 4, 2))
+
+        # the same visitor keeps the place in the line
+        self.assertEqual(self.admit(token)[:3], (False, 3, 1))
+        self.clock.now += 1
+        admitted, position, wait, pass_token = self.admit(token)
+        self.assertEqual((admitted, position), (True, 3))
+        # the admission token lets the visitor through without a new one
+        self.assertEqual(self.admit(pass_token), (True, 3, 0, None))
+
+    def test_admission_expires(self):
+        token = self.admit()[3]
+        self.assertTrue(self.admit(token)[0])
+        self.clock.now += waiting_room.WAITING_ROOM_ADMISSION_SECONDS + 1
+        # the expired token is ignored, the visitor lines up again
+        self.assertEqual(self.admit(token)[:2], (True, 2))
+
+    def test_quiet_time_not_saved_up(self):
+        self.admit()
+        self.clock.now += 3600
+        positions = [self.admit()[:2] for _ in range(4)]
+        # only the burst goes in at once
+        self.assertEqual(positions, [(True, 2), (True, 3), (False, 4),
+                                     (False, 5)])
+
+    def test_foreign_tokens_ignored(self):
+        token = self.admit(session_id=2)[3]
+        self.assertIsNone(waiting_room.read_token(
+            RequestFactory().get('/', HTTP_X_WAITING_ROOM_TOKEN=token), 1))
+        self.assertIsNone(waiting_room.read_token(
+            RequestFactory().get('/', HTTP_X_WAITING_ROOM_TOKEN=token + 'x'),
+            2))
+
+    def test_evicted_counter_continues_from_front(self):
+        for _ in range(5):
+            self.admit()
+        self.clock.now += 10
+        cache.delete('waiting_room:1:issued')
+        # the front is at 12, the line goes on from there
+        self.assertEqual(self.admit()[:2], (True, 11))
+
+    def test_requests_of_sessions(self):
+        factory = RequestFactory()
+        for request, session_id in (
+                (factory.get('/session/5/'), 5),
+                (factory.get('/session_api/5/best_seats/'), 5),
+                (factory.get('/session/5/seats/events/'), 5),
+                (factory.post('/buyticket/', {'session': '5'}), 5),
+                (factory.post('/ticket_api/', {'session': 5},
+                              content_type='application/json'), 5),
+                (factory.get('/buyticket/'), None),
+                (factory.get('/tomorrow/'), None)):
+            self.assertEqual(waiting_room.requested_session(request),
+                             session_id)
+
+    def test_middleware(self):
+        session = create_session(waiting_room=True, admission_rate=60)
+        path = f'/session_api/{session.id}/'
+        for _ in range(2):
+            self.client.cookies.clear()
+            self.assertEqual(self.client.get(path).status_code, 200)
+
+        self.client.cookies.clear()
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        token = response.json()['token']
+        self.assertEqual(response['X-Waiting-Room-Token'], token)
+        self.clock.now += 1
+        self.client.cookies.clear()
+        response = self.client.get(path, HTTP_X_WAITING_ROOM_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
@@ -1,21 +1,36 @@
 import re
+import uuid
 from datetime import datetime as dt, timedelta, date
 
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Q, Sum
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
 from django.contrib.auth.views import LoginView, LogoutView
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse, FileResponse, \
+    Http404, HttpResponse
+from django.template.loader import render_to_string
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from django.views.generic import CreateView, ListView, DetailView, UpdateView, \
-    DeleteView
+    DeleteView, View, TemplateView
+from cinema import idempotency, metrics, seat_events
+from cinema.page_cache import cached_page, page_key, bump_schedule
+from cinema.API.resources import search_movies
+from cinema.db.pool import pool_stats
 from cinema.forms import SignUpForm, RoomCreateForm, MovieCreateForm, \
     SessionCreateForm, BuyTicketForm
-from cinema.models import Movie, Room, Session, Ticket
+from cinema.models import Movie, Room, Session, Ticket, SlowQuery
+from cinema.paginator import EstimatedCountPaginator
+from cinema.profiling import list_profiles, profile_path
+from cinema.rate_limit import client_ip
+from cinema.seating import RoomLayout, STANDARD
 
 from django_cinema.settings import DATE_REGEXP, DEFAULT_SESSION_ORDERING, \
-    SESSION_ORDERINGS, DURATION_OF_BREAKS
+    SESSION_ORDERINGS, DURATION_OF_BREAKS, METRICS_ALLOWED_IPS, \
+    METRICS_TOKEN, CARD_CACHE_SECONDS, BEST_SEATS_MAX
 
 
 class UserLogin(LoginView):
@@ -39,24 +54,71 @@ class UserLogout(LogoutView):
     redirect_field_name = 'next'
 
 
-class SessionsView(ListView):
+def with_card_versions(queryset):
+    """
+    Add the versions of the cached session cards (session-card.html)
+    and the room size, so a cached card needs no movie or room query
+    """
+    return queryset.annotate(
+        movie_modified=F('movie__modified'),
+        room_modified=F('room__modified'),
+        room_seats=F('room__seats_count'),
+    )
+
+
+class EstimatedCountMixin:
+    """
+    Paginate with cinema.paginator.EstimatedCountPaginator, counting
+    self.count_queryset (the list without its Count annotations) when
+    get_queryset() sets it
+    """
+    paginator_class = EstimatedCountPaginator
+    count_queryset = None
+
+    def get_paginator(self, *args, **kwargs):
+        kwargs.setdefault('count_queryset', self.count_queryset)
+        return super().get_paginator(*args, **kwargs)
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        # the parameters of the page links, see pagination.html
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        context['page_query'] = f'{params.urlencode()}&' if params else ''
+        return context
+
+
+class SessionsView(EstimatedCountMixin, ListView):
     """
     List of sessions
     """
     model = Session
     paginate_by = 10
     template_name = 'movie-list-full.html'
-    today = dt.now().date()
-    now_time = dt.now().time()
-    tomorrow = today + timedelta(days=1)
-    queryset = Session.objects.filter(
-        date_finish__gte=today,
-        date_start__lte=today,
-    ).filter(
-        time_start__gte=now_time
-    ).annotate(
-        tickets=Count('session_tickets',
-                      filter=Q(session_tickets__date=today)))
+
+    # the date is read for every request, nothing is queried on import
+    def get_queryset(self):
+        now = dt.now()
+        self.today = now.date()
+        self.tomorrow = self.today + timedelta(days=1)
+        queryset = self.count_queryset = Session.objects.filter(
+            date_finish__gte=self.today,
+            date_start__lte=self.today,
+        ).filter(
+            time_start__gte=now.time()
+        )
+        queryset = queryset.annotate(
+            tickets=Count('session_tickets',
+                          filter=Q(session_tickets__date=self.today)))
+        ordering = self.get_ordering()
+        return with_card_versions(queryset).with_references().order_by(
+            ordering)
+
+    def get(self, request, *args, **kwargs):
+        key = page_key(request, 'sessions', dt.now().date(),
+                       self.get_ordering())
+        return cached_page(request, key, lambda: super(
+            SessionsView, self).get(request, *args, **kwargs))
 
     def get_ordering(self):
         ordering = self.request.GET.get('ordering', DEFAULT_SESSION_ORDERING)
@@ -73,15 +135,73 @@ class SessionsView(ListView):
         context.update({
             'today': self.today,
             'tomorrow': self.tomorrow,
+            'card_cache_seconds': CARD_CACHE_SECONDS,
             'date': date})
         return context
 
 
+def seats_context(request, session, date, bought_seats_numbers):
+    """
+    Free seats, tickets count and the buy form of the session day.
+    ?best=N&type=S preselects the best N adjacent free seats.
+    """
+    layout = RoomLayout.for_room(session.room)
+    all_seats = set(range(1, session.room.seats_count + 1))
+    free_seats = sorted(all_seats - bought_seats_numbers)
+
+    best = request.GET.get('best', '')
+    best = int(best) if best.isdigit() else 0
+    best_seats = layout.best_seats(
+        bought_seats_numbers, best, request.GET.get('type', STANDARD))
+
+    # set form inputs values, choices and  parameters
+    form = BuyTicketForm(request.POST or None)
+    form.fields['date'].initial = dt.strftime(date, '%Y-%m-%d')
+    form.fields['session'].initial = session.id
+    form.fields['idempotency_key'].initial = uuid.uuid4().hex
+    free_seats_choices = [(str(x), layout.label(x)) for x in free_seats]
+    form.fields['seat_numbers'].choices = free_seats_choices
+    form.fields['seat_numbers'].initial = [str(x) for x in best_seats]
+    form.fields['seat_numbers'].widget.attrs.update(
+        {'class': 'form-control', 'size': '10'})
+
+    return {
+        'form': form,
+        'date': date,
+        'free_seats': free_seats,
+        'free_seats_count': len(free_seats),
+        'session_tickets_count': len(bought_seats_numbers),
+        'best': best,
+        'best_seats': [layout.label(x) for x in best_seats],
+        'best_seats_max': BEST_SEATS_MAX,
+        'seat_types': layout.types(),
+        'seat_labels': layout.labels,
+    }
+
+
+class UserNavView(View):
+    """
+    User part of the header of the cached pages (user-nav-hole.html)
+    """
+
+    def get(self, request, *args, **kwargs):
+        nav = {'authenticated': request.user.is_authenticated}
+        if request.user.is_authenticated:
+            nav['links'] = render_to_string('user-links.html',
+                                            request=request)
+            nav['panel'] = render_to_string('user-panel.html',
+                                            request=request)
+        response = JsonResponse(nav)
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+
 class SessionDetailView(DetailView):
     """
     Session with ticket buying
     """
     model = Session
+    queryset = Session.objects.with_references()
     template_name = 'movie-page-full.html'
 
     def get_date(self):
@@ -102,49 +222,41 @@ class SessionDetailView(DetailView):
         date = self.get_date()
 
         # add free seats and tickets count
-        bought_seats = self.object.session_tickets.filter(date=date)
-        bought_seats_numbers = set(i.seat_number for i in bought_seats)
-        all_seats = set(range(1, self.object.room.seats_count + 1))
-        free_seats = list(all_seats - bought_seats_numbers)
-        free_seats_count = len(free_seats)
-        session_tickets_count = len(bought_seats_numbers)
-
-        # set form inputs values, choices and  parameters
-        form = BuyTicketForm(self.request.POST or None)
-        form.fields['date'].initial = dt.strftime(date, '%Y-%m-%d')
-        form.fields['session'].initial = self.object.id
-        free_seats_choices = [(str(x), x) for x in free_seats]
-        form.fields['seat_numbers'].choices = free_seats_choices
-        form.fields['seat_numbers'].widget.attrs.update(
-            {'class': 'form-control', 'size': '10'})
-
-        context.update({
-            'form': form,
-            'date': date,
-            'free_seats': free_seats,
-            'free_seats_count': free_seats_count,
-            'session_tickets_count': session_tickets_count,
-        })
+        bought_seats_numbers = seat_events.bought_seats(self.object.id, date)
+        context.update(seats_context(
+            self.request, self.object, date, bought_seats_numbers))
         return context
 
 
-class TomorrowSessionsView(ListView):
+class TomorrowSessionsView(EstimatedCountMixin, ListView):
     """
     List of sessions
     """
     model = Session
     paginate_by = 6
     template_name = 'tomorrow-list-full.html'
-    today = dt.now().date()
-    tomorrow = today + timedelta(days=1)
-    queryset = Session.objects.filter(
-        date_finish__gte=tomorrow,
-        date_start__lte=tomorrow,
-    ).annotate(
-        tickets=Count(
-            'session_tickets',
-            filter=Q(session_tickets__date=tomorrow))
-    )
+
+    def get_queryset(self):
+        self.today = dt.now().date()
+        self.tomorrow = self.today + timedelta(days=1)
+        queryset = self.count_queryset = Session.objects.filter(
+            date_finish__gte=self.tomorrow,
+            date_start__lte=self.tomorrow,
+        )
+        queryset = queryset.annotate(
+            tickets=Count(
+                'session_tickets',
+                filter=Q(session_tickets__date=self.tomorrow))
+        )
+        ordering = self.get_ordering()
+        return with_card_versions(queryset).with_references().order_by(
+            ordering)
+
+    def get(self, request, *args, **kwargs):
+        tomorrow = dt.now().date() + timedelta(days=1)
+        key = page_key(request, 'tomorrow', tomorrow, self.get_ordering())
+        return cached_page(request, key, lambda: super(
+            TomorrowSessionsView, self).get(request, *args, **kwargs))
 
     def get_ordering(self):
         ordering = self.request.GET.get('ordering', DEFAULT_SESSION_ORDERING)
@@ -160,6 +272,7 @@ class TomorrowSessionsView(ListView):
         context.update({
             'today': self.today,
             'tomorrow': self.tomorrow,
+            'card_cache_seconds': CARD_CACHE_SECONDS,
             'date': date,
         })
         return context
@@ -253,12 +366,16 @@ class SessionCreateView(CreateView):
             if session.time_start <= session_time_start <= session.time_finish:
                 time_err = f"start time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='form')
                 messages.error(self.request, time_err)
                 return HttpResponseRedirect(
                     self.request.META.get('HTTP_REFERER'))
             if session.time_start <= session_time_finish <= session.time_finish:
                 time_err = f"finish time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='form')
                 messages.error(self.request, time_err)
                 return HttpResponseRedirect(
                     self.request.META.get('HTTP_REFERER'))
@@ -267,17 +384,20 @@ class SessionCreateView(CreateView):
 
 
 @method_decorator(staff_member_required, name='dispatch')
-class SessionsListView(ListView):
+class SessionsListView(EstimatedCountMixin, ListView):
     """
     List of sessions
     """
     model = Session
     paginate_by = 10
     template_name = 'session-list.html'
-    today = dt.now().date()
-    queryset = Session.objects.filter(date_finish__gte=today).annotate(
-        tickets=Count('session_tickets')
-    )
+
+    def get_queryset(self):
+        today = dt.now().date()
+        self.count_queryset = Session.objects.filter(date_finish__gte=today)
+        return self.count_queryset.annotate(
+            tickets=Count('session_tickets')
+        ).with_references().order_by('date_start', 'time_start', 'id')
 
 
 @method_decorator(staff_member_required, name='dispatch')
@@ -296,6 +416,8 @@ class SessionUpdate(UpdateView):
         'date_start',
         'date_finish',
         'price',
+        'waiting_room',
+        'admission_rate',
     ]
 
     def form_valid(self, form):
@@ -366,12 +488,16 @@ class SessionUpdate(UpdateView):
             if session.time_start <= session_time_start <= session.time_finish:
                 time_err = f"start time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='form')
                 messages.error(self.request, time_err)
                 return HttpResponseRedirect(
                     self.request.META.get('HTTP_REFERER'))
             if session.time_start <= session_time_finish <= session.time_finish:
                 time_err = f"finish time isn't free at {session.date_start}" \
                            f" - {session.date_finish} / {session.movie.title}"
+                metrics.inc('cinema_session_overlap_rejections_total',
+                            channel='form')
                 messages.error(self.request, time_err)
                 return HttpResponseRedirect(
                     self.request.META.get('HTTP_REFERER'))
@@ -388,16 +514,30 @@ class TicketsBuyView(CreateView):
     success_url = '/tickets/'
 
     def post(self, *args, **kwargs):
-
+        referer = self.request.META.get('HTTP_REFERER')
+        try:
+            (url, error), replayed = idempotency.once(
+                self.request, 'form', self.request.POST, self.buy)
+        except idempotency.InProgress:
+            # a double submit, the first one is still buying the tickets
+            messages.info(self.request, 'Your purchase is being processed')
+            return HttpResponseRedirect(self.success_url)
+        except (idempotency.KeyReused, idempotency.InvalidKey):
+            messages.error(self.request, 'Invalid purchase, please retry')
+            return HttpResponseRedirect(referer)
+        if error:
+            messages.error(self.request, error)
+        return HttpResponseRedirect(url or referer)
+
+    def buy(self):
+        """ Buy the tickets, returns the redirect url and the error """
         form = BuyTicketForm(self.request.POST)
         if form.is_valid():
             data = dict(form.cleaned_data)
             try:
                 session = Session.objects.get(id=data.get('session'))
             except:
-                messages.error(self.request, 'Invalid session')
-                return HttpResponseRedirect(
-                    self.request.META.get('HTTP_REFERER'))
+                return None, 'Invalid session'
 
             date = data.get('date')
             seat_numbers_str = data.get('seat_numbers')
@@ -412,27 +552,20 @@ class TicketsBuyView(CreateView):
             all_seats = set(range(1, session.room.seats_count + 1))
             free_seats = all_seats - bought_seats_numbers
             if not set(seat_numbers).issubset(free_seats):
-                messages.error(self.request, 'Invalid seats')
-                return HttpResponseRedirect(
-                    self.request.META.get('HTTP_REFERER'))
+                metrics.inc('cinema_seat_conflicts_total', channel='form')
+                return None, 'Invalid seats'
 
             # ticket date must  be in session period
             if session.date_start > date or session.date_finish < date:
-                messages.error(self.request, 'Invalid session date')
-                return HttpResponseRedirect(
-                    self.request.META.get('HTTP_REFERER'))
+                return None, 'Invalid session date'
 
             # ticket day must be tomorrow or today
             if tomorrow < date or date < today:
-                messages.error(self.request, 'wrong date')
-                return HttpResponseRedirect(
-                    self.request.META.get('HTTP_REFERER'))
+                return None, 'wrong date'
 
             # ticket time must be greater than now
             if date == today and session.time_start < now.time():
-                messages.error(self.request, 'wrong time')
-                return HttpResponseRedirect(
-                    self.request.META.get('HTTP_REFERER'))
+                return None, 'wrong time'
 
             objects = []
             for seat in seat_numbers:
@@ -444,41 +577,51 @@ class TicketsBuyView(CreateView):
                 }
                 objects.append(object)
 
-            Ticket.objects.bulk_create([Ticket(**q) for q in objects])
-
-            return HttpResponseRedirect(self.success_url)
+            try:
+                with transaction.atomic():
+                    Ticket.objects.bulk_create(
+                        [Ticket(**q) for q in objects])
+            except IntegrityError:
+                # somebody bought one of the seats in the meantime
+                metrics.inc('cinema_seat_conflicts_total', channel='form')
+                return None, 'Invalid seats'
+            metrics.inc('cinema_tickets_sold_total', len(objects),
+                        channel='form')
+            seat_events.publish(session.id, date, taken=seat_numbers)
+            bump_schedule()
+
+            return self.success_url, None
         else:
-            err = form.errors.get('__all__')
-            messages.error(self.request, err)
-            return HttpResponseRedirect(self.request.META.get('HTTP_REFERER'))
+            return None, form.errors.get('__all__')
 
 
 @method_decorator(login_required, name='dispatch')
-class TicketsListView(ListView):
+class TicketsListView(EstimatedCountMixin, ListView):
     """
     List of sessions
     """
     model = Ticket
     paginate_by = 15
     template_name = 'tickets-list.html'
-    today = dt.now().date()
 
     # add user filter to queryset
     def get_queryset(self):
-        return Ticket.objects.filter(user=self.request.user)
+        return Ticket.objects.filter(user=self.request.user).select_related(
+            'session').with_references().order_by('-date', 'id')
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
-        old_tickets = self.object_list.filter(date__lt=self.today)
-        new_tickets = self.object_list.filter(date__gte=self.today)
-        tickets_count = self.object_list.aggregate(Count('id'))
-        money_sum = self.object_list.aggregate(Sum('session__price'))
+        today = dt.now().date()
+        old_tickets = self.object_list.filter(date__lt=today)
+        new_tickets = self.object_list.filter(date__gte=today)
+        totals = self.object_list.aggregate(Count('id'),
+                                            Sum('session__price'))
 
         context.update({
             'old_tickets': old_tickets,
             'new_tickets': new_tickets,
-            'tickets_count': tickets_count.get('id__count'),
-            'money_sum': money_sum.get('session__price__sum'),
+            'tickets_count': totals.get('id__count'),
+            'money_sum': totals.get('session__price__sum'),
         })
         return context
 
@@ -522,36 +665,45 @@ class RoomUpdate(UpdateView):
 
 
 @method_decorator(staff_member_required, name='dispatch')
-class RoomListView(ListView):
+class RoomListView(EstimatedCountMixin, ListView):
     """
     List of rooms
     """
     model = Room
     paginate_by = 10
     template_name = 'room-list.html'
-    today = dt.now().date()
-    q_ticket = Q(room_sessions__session_tickets__date__gte=today)
-    queryset = Room.objects.all().annotate(tickets=Count(q_ticket))
-    # queryset = Room.objects.all().annotate(
-    #     tickets=Count('room_sessions__session_tickets')
-    # )
-    # queryset = Session.objects.filter(date_finish__gte=today).annotate(
-    #     tickets=Count(Q(room_sessions__session_tickets__date__gt=dt.now(
-    #
-    #     ).date()))
-    # )
-    print(queryset)
+
+    def get_queryset(self):
+        today = dt.now().date()
+        q_ticket = Q(room_sessions__session_tickets__date__gte=today)
+        self.count_queryset = Room.objects.all()
+        return self.count_queryset.annotate(
+            tickets=Count(q_ticket)).order_by('title')
 
 
 @method_decorator(staff_member_required, name='dispatch')
-class MovieListView(ListView):
+class MovieListView(EstimatedCountMixin, ListView):
     """
     List of Movie
     """
     model = Movie
     paginate_by = 10
     template_name = 'movie-list.html'
-    queryset = Movie.objects.all()
+
+    def get_queryset(self):
+        queryset = search_movies(self.request.GET)
+        if not queryset.ordered:
+            queryset = queryset.order_by('title', 'id')
+        return queryset
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context.update({
+            'q': self.request.GET.get('q', ''),
+            'year': self.request.GET.get('year', ''),
+            'today': bool(self.request.GET.get('today')),
+        })
+        return context
 
 
 @method_decorator(staff_member_required, name='dispatch')
@@ -581,3 +733,78 @@ class MovieCreateView(CreateView):
     template_name = 'edit.html'
     form_class = MovieCreateForm
     success_url = '/movieslist/'
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class PoolStatsView(View):
+    """
+    Database connection pool stats of the worker. Only for administrators.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(pool_stats())
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ProfileListView(TemplateView):
+    """
+    Stored request profiles. Only for administrators.
+    """
+    template_name = 'profile-list.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['profiles'] = list_profiles()
+        return context
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ProfileDownloadView(View):
+    """
+    cProfile dump of a request profile. Only for administrators.
+    """
+
+    def get(self, request, *args, **kwargs):
+        profile_id = kwargs.get('profile_id')
+        if not re.fullmatch(r'[0-9a-f]{32}', profile_id):
+            raise Http404('Invalid profile')
+        try:
+            stats = open(profile_path(profile_id, 'prof'), 'rb')
+        except OSError:
+            raise Http404('No profile found')
+        return FileResponse(stats, as_attachment=True,
+                            filename=f'{profile_id}.prof')
+
+
+class MetricsView(View):
+    """
+    Prometheus metrics of all workers, see cinema.metrics.
+    Only for the addresses in METRICS_ALLOWED_IPS and METRICS_TOKEN.
+    """
+
+    def get(self, request, *args, **kwargs):
+        token = request.META.get('HTTP_AUTHORIZATION', '')
+        allowed = client_ip(request) in METRICS_ALLOWED_IPS or (
+            METRICS_TOKEN and constant_time_compare(
+                token, f'Bearer {METRICS_TOKEN}'))
+        if not allowed:
+            raise PermissionDenied
+        return HttpResponse(metrics.render(),
+                            content_type='text/plain; version=0.0.4')
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class SlowQueryListView(ListView):
+    """
+    Slow-query log grouped by fingerprint. Only for administrators.
+    """
+    model = SlowQuery
+    paginate_by = 20
+    template_name = 'slow-query-list.html'
+    orderings = ['-total_ms', '-max_ms', '-calls', '-last_seen']
+
+    def get_ordering(self):
+        ordering = self.request.GET.get('ordering', self.orderings[0])
+        if ordering not in self.orderings:
+            ordering = self.orderings[0]
+        return ordering
@@ -0,0 +1,156 @@
+"""
+Virtual waiting room of the sessions with Session.waiting_room on.
+
+cinema.middleware.WaitingRoom stands in front of the session page, the
+best seats API, the seat event stream (checked by cinema.seat_events)
+and the purchases of those sessions. A new visitor gets the next
+position of the session line in a signed cookie (or the
+X-Waiting-Room-Token header for API clients) and the waiting page until
+the line reaches the position. The line moves admission_rate positions
+a minute; the positions nobody took are not saved up beyond
+WAITING_ROOM_BURST, so a rush after a quiet time is queued as well.
+Admitted visitors get a token letting them through for
+WAITING_ROOM_ADMISSION_SECONDS.
+
+Everything lives in the signed tokens and the default cache, the
+database is only queried for the list of the protected sessions when it
+is not cached. The line (issued positions and front) must be one for all
+the workers, so the cache must be shared (memcached, see CACHES): with a
+process-local cache every worker would run its own line and let in
+admission_rate visitors a minute by itself (check cinema.W001).
+"""
+import json
+import math
+import re
+import time
+
+from django.core import signing
+from django.core.cache import cache
+
+from cinema.cache import cached, invalidate
+from django_cinema.settings import WAITING_ROOM_BURST, \
+    WAITING_ROOM_ADMISSION_SECONDS, WAITING_ROOM_TOKEN_SECONDS, \
+    WAITING_ROOM_SESSIONS_SECONDS
+
+SESSIONS_KEY = 'waiting_rooms'
+SALT = 'cinema.waiting_room'
+HEADER = 'HTTP_X_WAITING_ROOM_TOKEN'
+SESSION_PATHS = re.compile(
+    r'^/(?:async/)?session(?:_api)?/(\d+)/'
+    r'(?:best_seats/|seats/events/)?$')
+PURCHASE_PATHS = re.compile(r'^/(?:buyticket|ticket_api)/$')
+
+
+def protected_sessions():
+    """ {session id: admissions per minute} of the waiting rooms """
+    from cinema.models import Session
+
+    return cached(SESSIONS_KEY, lambda: dict(
+        Session.objects.filter(waiting_room=True).values_list(
+            'id', 'admission_rate')), WAITING_ROOM_SESSIONS_SECONDS)
+
+
+def sessions_changed():
+    invalidate(SESSIONS_KEY)
+
+
+def requested_session(request):
+    """ Id of the session the request is about, None for other requests """
+    match = SESSION_PATHS.match(request.path_info)
+    if match:
+        return int(match.group(1))
+    if request.method != 'POST' or not PURCHASE_PATHS.match(
+            request.path_info):
+        return None
+    try:
+        if request.content_type == 'application/json':
+            value = json.loads(request.body).get('session')
+        else:
+            value = request.POST.get('session')
+        return int(value)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def cookie_name(session_id):
+    return f'waiting_room_{session_id}'
+
+
+def read_token(request, session_id):
+    token = request.META.get(HEADER) or \
+        request.COOKIES.get(cookie_name(session_id))
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=SALT,
+                             max_age=WAITING_ROOM_TOKEN_SECONDS)
+    except signing.BadSignature:
+        return None
+    if data.get('session') != session_id:
+        return None
+    if data.get('admitted') and \
+            time.time() > data['admitted'] + WAITING_ROOM_ADMISSION_SECONDS:
+        return None
+    return data
+
+
+def make_token(session_id, position, admitted=None):
+    return signing.dumps(
+        {'session': session_id, 'position': position, 'admitted': admitted},
+        salt=SALT)
+
+
+def line_front(session_id, rate, issued=None):
+    """
+    Last position let in now. The line starts moving from (position,
+    time) in the cache at rate positions a minute.
+    """
+    key = f'waiting_room:{session_id}:front'
+    now = time.time()
+    front = cache.get(key)
+    if front is None:
+        front = (issued or 0) + WAITING_ROOM_BURST, now
+        cache.add(key, front, None)
+    position, since = front
+    current = position + (now - since) * rate / 60
+    if issued is not None and current > issued + WAITING_ROOM_BURST:
+        # nobody was waiting, don't save up the unused admissions
+        current = issued + WAITING_ROOM_BURST
+        cache.set(key, (current, now), None)
+    return current
+
+
+def join(session_id, rate):
+    """ Position of a new visitor and the front of the line """
+    issued_key = f'waiting_room:{session_id}:issued'
+    try:
+        position = cache.incr(issued_key)
+    except ValueError:
+        # a new line, or the counter was evicted: go on from the front,
+        # an evicted counter starting over at 0 would let everybody in
+        front = line_front(session_id, rate)
+        cache.add(issued_key, max(0, math.floor(front) - WAITING_ROOM_BURST),
+                  None)
+        position = cache.incr(issued_key)
+    return position, line_front(session_id, rate, position - 1)
+
+
+def admit(request, session_id, rate):
+    """
+    (admitted, position, seconds to wait, new token or None) of the
+    visitor for the session
+    """
+    token = read_token(request, session_id)
+    if token and token['admitted']:
+        return True, token['position'], 0, None
+    if token:
+        position = token['position']
+        front = line_front(session_id, rate)
+    else:
+        position, front = join(session_id, rate)
+    if position <= front:
+        return True, position, 0, make_token(session_id, position,
+                                             admitted=int(time.time()))
+    wait = math.ceil((position - front) * 60 / rate) if rate else None
+    new_token = None if token else make_token(session_id, position)
+    return False, position, wait, new_token
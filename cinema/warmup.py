@@ -0,0 +1,55 @@
+"""
+Warm-up of a worker before it accepts requests, see wsgi.py and asgi.py.
+
+URL resolvers are built and the project templates are compiled, so the
+first requests don't pay for it. Nothing here touches the database.
+"""
+import os
+
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, \
+    engines
+from django.urls import get_resolver, reverse
+
+TEMPLATE_EXTENSIONS = ('.html', '.txt')
+
+
+def warm_up():
+    warm_up_urls()
+    return warm_up_templates()
+
+
+def warm_up_urls():
+    """ Import the URLconf and build the reverse lookup tables """
+    resolver = get_resolver()
+    resolver.url_patterns
+    reverse('sessions')
+
+
+def project_templates(engine):
+    """ Names of the templates in DIRS and in the cinema app """
+    from django.apps import apps
+
+    dirs = list(engine.dirs)
+    dirs.append(os.path.join(apps.get_app_config('cinema').path, 'templates'))
+    for directory in map(str, dirs):
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(TEMPLATE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, directory)
+
+
+def warm_up_templates():
+    """
+    Compile the project templates. They are kept by the cached loader,
+    which Django uses when DEBUG is off.
+    """
+    compiled = 0
+    for engine in engines.all():
+        for name in project_templates(engine):
+            try:
+                engine.get_template(name)
+            except (TemplateDoesNotExist, TemplateSyntaxError):
+                continue
+            compiled += 1
+    return compiled
@@ -13,4 +13,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_cinema.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# seat event streams are served outside of Django, see cinema.seat_events
+from cinema.seat_events import seat_events_app  # noqa: E402
+from cinema.warmup import warm_up  # noqa: E402
+
+application = seat_events_app(django_application)
+
+# compile URL patterns and templates before the first request
+warm_up()
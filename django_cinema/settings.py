@@ -40,12 +40,17 @@ INSTALLED_APPS = [
     'crispy_forms',
     'mathfilters',
     'rest_framework',
+    'django.contrib.postgres',
 ]
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MIDDLEWARE = [
+    'cinema.middleware.Metrics',
     'django.middleware.security.SecurityMiddleware',
+    'cinema.middleware.RateLimit',
+    'cinema.middleware.WaitingRoom',
+    'cinema.middleware.ReplicaRouting',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -53,6 +58,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'cinema.middleware.AutoLogout',
+    'cinema.middleware.RequestProfiler',
+    'cinema.middleware.SlowQueryLog',
 ]
 
 ROOT_URLCONF = 'django_cinema.urls'
@@ -80,7 +87,8 @@ WSGI_APPLICATION = 'django_cinema.wsgi.application'
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        # connections come from a per-worker pool (cinema.db.pool)
+        'ENGINE': 'cinema.db.backends.postgresql_pool',
         'NAME': 'cinemabase',
         'USER': 'cinemabase',
         'PASSWORD': 'cinemabase',
@@ -89,7 +97,33 @@ DATABASES = {
         'TEST': {
             'NAME': 'cinemabasetest',
         },
-    }
+    },
+    # read replicas are listed in DATABASE_REPLICAS, e.g.
+    # 'replica1': {
+    #     'ENGINE': 'cinema.db.backends.postgresql_pool',
+    #     'NAME': 'cinemabase',
+    #     'USER': 'cinemabase',
+    #     'PASSWORD': 'cinemabase',
+    #     'HOST': 'replica1',
+    #     'PORT': '5432',
+    #     'TEST': {
+    #         'MIRROR': 'default',
+    #     },
+    # },
+}
+
+DATABASE_ROUTERS = ['cinema.routers.PrimaryReplicaRouter']
+
+CACHES = {
+    'default': {
+        # hits and misses are counted, see cinema.metrics.MeteredCache
+        'BACKEND': 'cinema.metrics.MeteredCache',
+        # shared by the workers: rate limits, waiting rooms, check-ins and
+        # the cache versions only hold across them on a shared cache
+        'WRAPPED_BACKEND':
+            'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('MEMCACHED_LOCATION', '127.0.0.1:11211'),
+    },
 }
 
 AUTH_USER_MODEL = "cinema.CinemaUser"
@@ -99,6 +133,13 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # the first one answers clients accepting anything, see
+    # cinema.API.renderers
+    'DEFAULT_RENDERER_CLASSES': [
+        'cinema.API.renderers.ORJSONRenderer',
+        'cinema.API.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     # 'PAGE_SIZE': 10
 }
@@ -151,3 +192,180 @@ LOGOUT_REDIRECT_URL = '/'
 DATE_REGEXP = "^\d{4}\-(0[1-9]|1[012])\-(0[1-9]|[12][0-9]|3[01])$"
 DEFAULT_SESSION_ORDERING = '-time_start'
 SESSION_ORDERINGS = ['-time_start', 'time_start', 'price', '-price']
+# cached session cards are keyed by versions, the timeout only frees memory
+CARD_CACHE_SECONDS = 24 * 60 * 60
+# anonymous schedule pages (cinema.page_cache), started sessions drop out
+# of the today page after at most this long
+PAGE_CACHE_SECONDS = 60
+
+# Read replicas
+# aliases from DATABASES used for reads of safe requests
+DATABASE_REPLICAS = []
+# reads go to the primary this long after the client wrote something
+REPLICA_PIN_SECONDS = 5
+REPLICA_PIN_COOKIE = 'pin_primary'
+# replicas lagging more than this (seconds) are skipped
+REPLICA_MAX_LAG = 10
+REPLICA_LAG_CHECK_INTERVAL = 2
+
+# Database connection pool
+# the cap of all workers together, each worker gets an equal share; a
+# static split over WEB_CONCURRENCY, not counted across the processes
+DB_POOL_MAX_CONNECTIONS = 40
+DB_POOL_WORKERS = int(os.environ.get('WEB_CONCURRENCY', 4))
+# seconds to wait for a free connection
+DB_POOL_TIMEOUT = 5
+# connections idle longer than this (seconds) are checked with SELECT 1
+DB_POOL_CHECK_AFTER = 1
+# connections idle longer than this (seconds) are closed
+DB_POOL_MAX_IDLE = 300
+
+# Ticket partitions (manage.py partition_tickets)
+TICKET_PARTITION_DAYS_AHEAD = 14
+# older partitions are detached and moved to TICKET_ARCHIVE_SCHEMA
+TICKET_PARTITION_RETAIN_DAYS = 30
+TICKET_ARCHIVE_SCHEMA = 'cinema_archive'
+
+# Live seat events (cinema.seat_events)
+SEAT_EVENTS_CHANNEL = 'seat_events'
+# seconds between keepalive comments of an idle stream
+SEAT_EVENTS_KEEPALIVE = 15
+# events buffered per subscriber before it gets a new snapshot
+SEAT_EVENTS_QUEUE_SIZE = 100
+
+# Request profiler (cinema.middleware.RequestProfiler)
+# staff requests with the X-Profile header are always profiled
+PROFILER_HEADER = 'HTTP_X_PROFILE'
+# share of all requests profiled, 0 turns sampling off
+PROFILER_SAMPLE_RATE = 0
+PROFILES_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILES_KEEP = 200
+
+# Metrics (cinema.metrics), scraped at /metrics/
+# shared by the workers of the host, counters survive restarts
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+# seconds between snapshots of a worker
+METRICS_FLUSH_INTERVAL = 5
+# scrapers from these client addresses (see TRUSTED_PROXIES) or with
+# the token in an 'Authorization: Bearer' header, empty turns it off
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Slow-query log (cinema.slow_queries), reported at /slowqueries/
+SLOW_QUERY_THRESHOLD_MS = 100
+# queries kept in memory until the request finishes
+SLOW_QUERY_MAX_PENDING = 1000
+
+# Single-flight cache (cinema.cache)
+# stale values are served this long while one worker rebuilds them
+SINGLE_FLIGHT_STALE_SECONDS = 30
+# longest wait for a value another worker is building
+SINGLE_FLIGHT_WAIT = 2
+SINGLE_FLIGHT_LOCK_SECONDS = 10
+# early refresh eagerness (XFetch beta), 0 turns it off
+SINGLE_FLIGHT_BETA = 1.0
+SEATS_CACHE_SECONDS = 30
+TIMETABLE_CACHE_SECONDS = 60
+
+# Movie search (MovieQuerySet.search)
+# 'simple' doesn't stem, titles and names are matched as written
+MOVIE_SEARCH_CONFIG = 'simple'
+# most results of a search
+MOVIE_SEARCH_LIMIT = 50
+
+# Seat layout (cinema.seating)
+# seats per row of the rooms without a layout
+DEFAULT_ROW_SEATS = 20
+# best row, as a share of the depth of the room from the screen
+BEST_ROW_POSITION = 0.6
+BEST_SEATS_MAX = 10
+
+# Idempotency keys of the purchases (cinema.idempotency)
+# first results are replayed to the retries for a day
+IDEMPOTENCY_TTL = 24 * 60 * 60
+# a retry may run the purchase again if the first request holds
+# the key longer than this
+IDEMPOTENCY_LOCK_SECONDS = 30
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Rate limits (cinema.rate_limit), checked by cinema.middleware.RateLimit
+# reverse proxies (the local nginx) whose X-Forwarded-For is believed,
+# the client address of other requests is REMOTE_ADDR
+TRUSTED_PROXIES = ['127.0.0.1', '::1']
+# requests allowed per sliding window of seconds, per client address
+# ('ip'), per username ('user', Basic auth or the form field) or per
+# username from one address ('ip_user')
+# the door scanners have their own budget
+API_PATHS = r'^/(async/)?(?!checkin_api/)[a-z_]+_api/'
+RATE_LIMITS = [
+    {'name': 'login', 'path': r'^/(accounts|admin)/login/$',
+     'methods': ['POST'], 'per': 'ip', 'requests': 20, 'seconds': 60},
+    {'name': 'login', 'path': r'^/(accounts|admin)/login/$',
+     'methods': ['POST'], 'per': 'ip_user', 'field': 'username',
+     'requests': 5, 'seconds': 300},
+    {'name': 'register', 'path': r'^/(accounts/register|user_api)/$',
+     'methods': ['POST'], 'per': 'ip', 'requests': 5, 'seconds': 3600},
+    {'name': 'buy', 'path': r'^/(buyticket|ticket_api)/$',
+     'methods': ['POST'], 'per': 'ip', 'requests': 30, 'seconds': 60},
+    {'name': 'checkin', 'path': r'^/checkin_api/$',
+     'methods': ['POST'], 'per': 'ip', 'requests': 3000, 'seconds': 60},
+    {'name': 'seat_events', 'path': r'^/session/\d+/seats/events/$',
+     'methods': None, 'per': 'ip', 'requests': 30, 'seconds': 60},
+    {'name': 'api', 'path': API_PATHS,
+     'methods': None, 'per': 'ip', 'requests': 120, 'seconds': 60},
+    {'name': 'api', 'path': API_PATHS,
+     'methods': None, 'per': 'user', 'requests': 300, 'seconds': 60},
+]
+
+# Waiting rooms of the sessions (cinema.waiting_room)
+# admissions per minute of a new waiting room
+WAITING_ROOM_DEFAULT_RATE = 300
+# admissions saved up while nobody waits
+WAITING_ROOM_BURST = 20
+# an admitted visitor may browse and buy this long
+WAITING_ROOM_ADMISSION_SECONDS = 15 * 60
+# a position in the line is kept this long
+WAITING_ROOM_TOKEN_SECONDS = 2 * 60 * 60
+# the list of the protected sessions is cached this long
+WAITING_ROOM_SESSIONS_SECONDS = 60
+
+# Estimated counts of big tables (cinema.paginator)
+# smaller estimates are replaced by an exact COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 10000
+# bigger exact counts are cached this long where there are no estimates
+COUNT_CACHE_SECONDS = 60
+
+# Reference data cache (cinema.refcache)
+# other workers see changed movies and rooms after at most this long
+REFCACHE_CHECK_SECONDS = 1
+
+# Fast API renderers (cinema.API.renderers)
+# rendered session lists are also dropped when the sessions change
+RENDERED_CACHE_SECONDS = 60
+
+# Static schedule snapshots (cinema.snapshots)
+# directory served by nginx, empty turns the snapshots off
+SNAPSHOT_ROOT = os.environ.get('SNAPSHOT_ROOT', '')
+# host name of the absolute URLs (posters) in the snapshots
+SNAPSHOT_HOST = os.environ.get('SNAPSHOT_HOST', 'localhost')
+# publish_schedule republishes this often, the ticket counts of the
+# published pages are at most this old
+SNAPSHOT_SECONDS = 60
+# publish_schedule looks for changed sessions this often
+SNAPSHOT_POLL_SECONDS = 2
+
+# Check-in of signed tickets (cinema.checkin)
+# keys of the door scanners, sent in the X-Scanner-Key header
+CHECKIN_SCANNER_KEYS = [
+    key for key in os.environ.get('CHECKIN_SCANNER_KEYS', '').split(',')
+    if key]
+# revoked and checked in tickets reach the scanners of the other workers
+# after this long
+CHECKIN_REVOCATIONS_SECONDS = 5
+# scans against lists older than this are counted as degraded
+CHECKIN_STALE_SECONDS = 30
+# admissions are written in batches of this size or after this long
+CHECKIN_BATCH_SIZE = 200
+CHECKIN_FLUSH_SECONDS = 5
+# admissions kept while the database can't take them
+CHECKIN_MAX_PENDING = 10000
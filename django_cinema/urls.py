@@ -19,12 +19,15 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 
+from cinema import async_views
 from cinema.API.resources import RoomViewSet, UserViewSet, MovieViewSet, \
-    SessionViewSet, TicketViewSet, TodaySessionViewSet
+    SessionViewSet, TicketViewSet, TodaySessionViewSet, CheckInViewSet
 from cinema.views import Register, UserLogout, UserLogin, SessionsView, \
     TomorrowSessionsView, SessionDetailView, TicketsListView, RoomCreateView, \
     MovieCreateView, SessionCreateView, SessionsListView, RoomListView, \
-    MovieListView, SessionUpdate, MovieUpdate, RoomUpdate, TicketsBuyView
+    MovieListView, SessionUpdate, MovieUpdate, RoomUpdate, TicketsBuyView, \
+    PoolStatsView, ProfileListView, ProfileDownloadView, MetricsView, \
+    SlowQueryListView, UserNavView
 
 router = DefaultRouter()
 router.register(r'room_api', RoomViewSet, basename='room')
@@ -33,12 +36,14 @@ router.register(r'movie_api', MovieViewSet, basename='movie')
 router.register(r'session_api', SessionViewSet, basename='session')
 router.register(r'ticket_api', TicketViewSet, basename='ticket')
 router.register(r'today_session_api', TodaySessionViewSet, basename='today')
+router.register(r'checkin_api', CheckInViewSet, basename='checkin')
 
 
 urlpatterns = [
     path('', SessionsView.as_view(), name="sessions"),
     path('tomorrow/', TomorrowSessionsView.as_view(), name="tomorrow"),
     path('session/<int:pk>/', SessionDetailView.as_view(), name='session'),
+    path('usernav/', UserNavView.as_view(), name="usernav"),
     path('accounts/login/', UserLogin.as_view(), name="login"),
     path('logout/', UserLogout.as_view(), name="logout"),
     path('accounts/register/', Register.as_view(), name="register"),
@@ -56,6 +61,20 @@ urlpatterns = [
     path('movieedit/<int:pk>/', MovieUpdate.as_view(), name="movieedit"),
     path('roomedit/<int:pk>/', RoomUpdate.as_view(), name="roomedit"),
     path('buyticket/', TicketsBuyView.as_view(), name="buyticket"),
+    path('db_pool_stats/', PoolStatsView.as_view(), name="db_pool_stats"),
+    path('profiles/', ProfileListView.as_view(), name="profiles"),
+    path('profiles/<str:profile_id>/', ProfileDownloadView.as_view(),
+         name="profile"),
+    path('metrics/', MetricsView.as_view(), name="metrics"),
+    path('slowqueries/', SlowQueryListView.as_view(), name="slowqueries"),
     path('', include(router.urls)),
+    # async views for ASGI servers
+    path('async/', async_views.sessions, name="async_sessions"),
+    path('async/tomorrow/', async_views.tomorrow_sessions,
+         name="async_tomorrow"),
+    path('async/session/<int:pk>/', async_views.session_detail,
+         name="async_session"),
+    path('async/today_session_api/', async_views.today_sessions_api,
+         name="async_today"),
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_cinema.settings')
 
 application = get_wsgi_application()
+
+# compile URL patterns and templates before the first request
+from cinema.warmup import warm_up  # noqa: E402
+
+warm_up()